@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""Time apps/api reads of the device tree as the tree grows.
+
+Every /list and /get is answered in one go on the main loop: /list builds
+the JSON of the components it is asked for, and /get walks every element
+of every device (walk_elements) once per requested path, matching each
+against the pattern. What a read costs therefore follows the size of the
+whole tree, not the size of the answer, and while it runs nothing else
+is serviced. This grows a tree of --devices devices, one step each, and
+at each step times these reads on one keep-alive connection:
+
+    list            /list of everything, components and elements
+    list-shallow    /list {"shallow": true}
+    list-device     /list of one device
+    get-all         /get ["*"], every element's value
+    get-device      /get ["<device>.*"]
+    get-element     /get of one element path
+    get-many        /get of --paths element paths spread over the tree
+
+For each it reports p50/max latency, response bytes, the elements in the
+answer, the peak resident set over the idle one while the reads ran, and
+the latency of a /health probe sent from another connection meanwhile,
+which is how long every other client and protocol waited. The steps give
+the scaling curve: the last table fits latency ~ elements^k per read.
+
+With --start OpenWatt is started through the harness with an HTTP server
+on --port and the API at --api, and the devices are added with
+/device/add from a generated profile of --components components, each
+with --subcomponents children, each with --elements static elements (the
+profile goes to conf/profiles/bench_api_tree.conf and is removed after).
+Without it, the tree of whatever is listening is measured as one step.
+
+--json writes the results; --baseline compares p50 with an earlier
+--json by step and read and exits non-zero when one is more than
+--tolerance percent slower, so a run can gate a change.
+
+  python3 test/bench/api_tree.py [--start [BINARY]] [--port 8080]
+      [--devices 10,100,500,1000] [--repeat 10] [--json PATH]
+      [--baseline PATH [--tolerance 25]]
+"""
+
+import argparse
+import http.client
+import json
+import math
+import random
+import re
+import socket
+import sys
+import threading
+import time
+
+from common import CONSOLE_ERROR, generated_profile, ms, openwatt, percentile, proc_status, send_all, slow_ticks
+
+PROFILE = "bench_api_tree"
+READS = ("list", "list-shallow", "list-device", "get-all", "get-device", "get-element", "get-many")
+
+# (id, value, display unit, sample frequency); a realistic meter's worth
+POINTS = (
+    ("voltage", "230.1V", "V", "realtime"), ("current", "4.2A", "A", "realtime"),
+    ("power", "966W", "W", "realtime"), ("reactive", "-120var", "var", "realtime"),
+    ("apparent", "973VA", "VA", "realtime"), ("pf", "0.99", "", "high"),
+    ("frequency", "50.01Hz", "Hz", "realtime"), ("import", "12034.5kWh", "kWh", "medium"),
+    ("export", "803.2kWh", "kWh", "medium"), ("temperature", "41.5", "", "low"),
+    ("state", "\"running\"", "", "high"), ("fault", "0", "", "high"),
+)
+
+
+def reset_peak(pid):
+    """Restart VmHWM from the current RSS (Linux 4.0+); False if not allowed."""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def profile_text(components, subcomponents, elements):
+    lines = ["# generated by test/bench/api_tree.py", "device-template:",
+             "\tcomponent:", "\t\tid: info", "\t\ttemplate: DeviceInfo",
+             '\t\telement: manufacturer, "OpenWatt"', '\t\telement: model, "bench tree"',
+             '\t\telement: serial, "SN00000000"']
+
+    def component(indent, cid):
+        tab = "\t" * indent
+        out = [f"{tab}component:", f"{tab}\tid: {cid}"]
+        for i in range(elements):
+            name, value, unit, freq = POINTS[i % len(POINTS)]
+            eid = name if i < len(POINTS) else f"{name}{i // len(POINTS)}"
+            out.append(f"{tab}\telement: {eid}, {value}\tdesc: {unit}, {freq}")
+        return out
+
+    for c in range(components):
+        lines += component(1, f"c{c}")
+        for s in range(subcomponents):
+            lines += component(2, f"s{s}")
+    return "\n".join(lines) + "\n"
+
+
+def element_paths(tree):
+    """Dotted paths of every element in a deep /list answer."""
+    out = []
+
+    def walk(prefix, node):
+        for eid in node.get("elements", {}):
+            out.append(f"{prefix}.{eid}")
+        for cid, child in node.get("components", {}).items():
+            walk(f"{prefix}.{cid}", child)
+
+    for did, dev in tree.items():
+        walk(did, dev)
+    return out
+
+
+class Client:
+    def __init__(self, host, port, api, timeout):
+        self.host, self.port, self.api, self.timeout = host, port, api, timeout
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        """(seconds, status, body bytes); reconnects once if the server closed."""
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if data else {}
+        for attempt in (0, 1):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                self.conn.connect()
+                self.conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            t = time.perf_counter()
+            try:
+                self.conn.request(method, self.api + path, body=data, headers=headers)
+                r = self.conn.getresponse()
+                payload = r.read()
+                return time.perf_counter() - t, r.status, payload
+            except (http.client.HTTPException, ConnectionError):
+                self.close()
+                if attempt:
+                    raise
+        raise AssertionError
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+
+class Probe(threading.Thread):
+    """/health on its own connection every --probe ms, latencies kept while armed."""
+
+    def __init__(self, args):
+        super().__init__(daemon=True)
+        self.client = Client(args.host, args.port, args.api, args.timeout)
+        self.interval = args.probe / 1000
+        self.samples = []
+        self.armed = False
+        self.stopping = False
+
+    def run(self):
+        while not self.stopping:
+            try:
+                dt, _, _ = self.client.request("GET", "/health")
+                if self.armed:
+                    self.samples.append(dt)
+            except (OSError, http.client.HTTPException):
+                pass
+            time.sleep(self.interval)
+        self.client.close()
+
+    def take(self):
+        samples, self.samples = self.samples, []
+        return samples
+
+
+def reads(paths, devices, args, rng):
+    first = next(iter(devices))
+    first_paths = [p for p in paths if p.startswith(first + ".")] or paths
+    return {
+        "list": ("/list", {}),
+        "list-shallow": ("/list", {"shallow": True}),
+        "list-device": ("/list", {"path": first}),
+        "get-all": ("/get", {"paths": ["*"]}),
+        "get-device": ("/get", {"paths": [f"{first}.*"]}),
+        "get-element": ("/get", {"paths": [first_paths[len(first_paths) // 2]]}),
+        "get-many": ("/get", {"paths": rng.sample(paths, min(args.paths, len(paths)))}),
+    }
+
+
+def answered(kind, body):
+    """Elements in an answer, or None if it is not the JSON it should be."""
+    try:
+        doc = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(doc, dict):
+        return None
+    if kind.startswith("get"):
+        return len(doc)
+    if kind == "list-shallow":
+        return sum(len(d.get("elements", {})) for d in doc.values())
+    return len(element_paths(doc))
+
+
+def measure(args, client, probe, pid, kind, path, body):
+    idle = (proc_status(pid, "VmRSS") or 0) if pid else 0
+    peak_ok = pid and reset_peak(pid)
+    hwm = (proc_status(pid, "VmHWM") or 0) if pid else 0
+    times, size, count, errors = [], 0, None, 0
+    probe.take()
+    probe.armed = True
+    for _ in range(args.repeat):
+        try:
+            dt, status, payload = client.request("POST", path, body)
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            continue
+        if status != 200:
+            errors += 1
+            continue
+        times.append(dt)
+        size = len(payload)
+        if count is None:
+            count = answered(kind, payload)
+    probe.armed = False
+    waits = probe.take()
+    row = {"read": kind, "p50_ms": percentile(times, 50) * 1000, "max_ms": max(times, default=math.nan) * 1000,
+           "bytes": size, "elements": count, "errors": errors,
+           "probe_p99_ms": percentile(waits, 99) * 1000, "probe_max_ms": max(waits, default=math.nan) * 1000}
+    if pid:
+        peak = proc_status(pid, "VmHWM") or 0
+        row["peak_kb"] = max(0, peak - idle) if peak_ok else max(0, peak - hwm)
+        row["rss_kb"] = proc_status(pid, "VmRSS") or 0
+    return row
+
+
+# /device/add reports its own failures in its own words
+DEVICE_ADD_ERROR = re.compile(CONSOLE_ERROR.pattern + r"|^(?:Device '[^']*' already exists|Failed to |"
+                                                      r"Element '[^']*' is protocol-coupled)", re.M)
+
+
+def grow(console, have, want):
+    send_all(console, [f"/device/add id=tree{i} profile={PROFILE}" for i in range(have, want)],
+             failed=DEVICE_ADD_ERROR)
+
+
+def print_row(row, pid):
+    elements = "-" if row["elements"] is None else row["elements"]
+    print(f"{row['read']:>13} {ms(row['p50_ms'] / 1000)} {ms(row['max_ms'] / 1000)} "
+          f"{row['bytes'] / 1024:9.1f} {elements:>9} {ms(row['probe_p99_ms'] / 1000)} "
+          f"{ms(row['probe_max_ms'] / 1000)} {row['errors']:6}"
+          + (f" {row['peak_kb']:8} {row['rss_kb']:8}" if pid else ""))
+
+
+def print_fit(steps):
+    if len(steps) < 2:
+        return
+    print(f"\n{'read':>13} {'k':>6} {'us/elem':>8}   (latency ~ elements^k, first step to last)")
+    a, b = steps[0], steps[-1]
+    for kind in READS:
+        ra = next((r for r in a["reads"] if r["read"] == kind), None)
+        rb = next((r for r in b["reads"] if r["read"] == kind), None)
+        if not ra or not rb or not ra["p50_ms"] > 0 or not rb["p50_ms"] > 0 or b["elements"] <= a["elements"]:
+            continue
+        k = math.log(rb["p50_ms"] / ra["p50_ms"]) / math.log(b["elements"] / a["elements"])
+        print(f"{kind:>13} {k:6.2f} {rb['p50_ms'] * 1000 / b['elements']:8.2f}")
+
+
+def compare(results, path, tolerance):
+    """Print p50 against a baseline run; number of reads over tolerance."""
+    with open(path) as f:
+        base = json.load(f)
+    before = {(s["devices"], r["read"]): r["p50_ms"] for s in base["steps"] for r in s["reads"]}
+    print(f"\nagainst {path} (tolerance {tolerance:g}%)")
+    print(f"{'devices':>7} {'read':>13} {'was ms':>8} {'now ms':>8} {'change':>7}")
+    over = 0
+    for s in results["steps"]:
+        for r in s["reads"]:
+            was = before.get((s["devices"], r["read"]))
+            if not was or not was > 0 or not r["p50_ms"] >= 0:
+                continue
+            change = (r["p50_ms"] / was - 1) * 100
+            flag = ""
+            if change > tolerance:
+                over += 1
+                flag = "  slower"
+            print(f"{s['devices']:7} {r['read']:>13} {was:8.1f} {r['p50_ms']:8.1f} {change:+6.0f}%{flag}")
+    return over
+
+
+def run(args, ow, pid):
+    client = Client(args.host, args.port, args.api, args.timeout)
+    probe = Probe(args)
+    probe.start()
+    rng = random.Random(args.seed)
+    stderr = str(ow.stderr_path) if ow else None
+    offset = 0
+    results = {"shape": {"components": args.components, "subcomponents": args.subcomponents,
+                         "elements": args.elements}, "repeat": args.repeat, "paths": args.paths,
+               "steps": []}
+    have = 0
+    for devices in (args.devices if ow else [None]):
+        if ow:
+            grow(ow.get_console(), have, devices)
+            have = devices
+            time.sleep(args.settle)
+        _, status, payload = client.request("POST", "/list", {})
+        if status != 200:
+            print(f"/list answered {status}", file=sys.stderr)
+            return 1
+        tree = json.loads(payload)
+        paths = element_paths(tree)
+        if not paths:
+            print("the tree has no elements", file=sys.stderr)
+            return 1
+        _, offset = slow_ticks(stderr, offset)
+        step = {"devices": len(tree), "elements": len(paths), "reads": []}
+        print(f"\n{len(tree)} devices, {len(paths)} elements")
+        print(f"{'read':>13} {'p50':>8} {'max':>8} {'kB':>9} {'elements':>9} {'probe99':>8} "
+              f"{'probemax':>8} {'errors':>6}" + (f" {'peak kB':>8} {'rss kB':>8}" if pid else ""))
+        for kind, (path, body) in reads(paths, tree, args, rng).items():
+            row = measure(args, client, probe, pid, kind, path, body)
+            if kind == "get-all" and row["elements"] is not None and row["elements"] != len(paths):
+                print(f"warning: get-all answered {row['elements']} of {len(paths)} elements", file=sys.stderr)
+            print_row(row, pid)
+            step["reads"].append(row)
+        ticks, offset = slow_ticks(stderr, offset)
+        if stderr:
+            worst = max(ticks, default=(0, ""))
+            step["slow_ticks"], step["worst_tick_ms"], step["worst_module"] = len(ticks), worst[0], worst[1]
+            print(f"{'':13} {len(ticks)} slow-tick warnings, worst {worst[0]} ms"
+                  + (f" ({worst[1]})" if worst[1] else ""))
+        results["steps"].append(step)
+    print_fit(results["steps"])
+    probe.stopping = True
+    client.close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {args.json}")
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        return 1
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--api", default="/api", help="API uri")
+    ap.add_argument("--start", nargs="?", const="bin/x86_64_debug/openwatt", metavar="BINARY",
+                    help="start OpenWatt, add a server and the API on --port, and grow the tree")
+    ap.add_argument("--devices", type=lambda s: [int(n) for n in s.split(",") if n], default=[10, 100, 500, 1000],
+                    metavar="N,N,...", help="devices in the tree, one step each (with --start)")
+    ap.add_argument("--components", type=int, default=4, help="top-level components per device")
+    ap.add_argument("--subcomponents", type=int, default=2, help="children per component")
+    ap.add_argument("--elements", type=int, default=8, help="elements per component")
+    ap.add_argument("--repeat", type=int, default=10, help="requests per read and step")
+    ap.add_argument("--paths", type=int, default=50, help="element paths in get-many")
+    ap.add_argument("--probe", type=float, default=5.0, help="ms between /health probes")
+    ap.add_argument("--settle", type=float, default=1.0, help="seconds after growing the tree")
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    ap.add_argument("--baseline", metavar="PATH", help="compare p50 with an earlier --json")
+    ap.add_argument("--tolerance", type=float, default=25.0,
+                    help="percent slower than --baseline that fails the run")
+    args = ap.parse_args()
+    if args.devices != sorted(args.devices):
+        ap.error("--devices must grow; the tree is only ever added to")
+
+    ow = openwatt(args.start, "api_tree") if args.start else None
+    with generated_profile(ow, PROFILE, profile_text(args.components, args.subcomponents, args.elements)):
+        if ow and not ow.start():
+            return 1
+        try:
+            if ow:
+                send_all(ow.get_console(), (f"/protocol/http/server/add name=bench-http port={args.port}",
+                                            f"/apps/api/add name=bench-api http-server=bench-http uri={args.api}"))
+                time.sleep(1.0)
+            return run(args, ow, ow.process.pid if ow else None)
+        except KeyboardInterrupt:
+            return 0
+        finally:
+            if ow:
+                ow.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""Helpers the benchmarks in this directory share.
+
+Statistics and table cells, /proc readings of the server under test and the
+slow-tick warnings in its stderr log, and starting and provisioning it under
+test_harness for --start. Imported as a sibling module, the way the scripts
+import proto and mqtt.
+"""
+
+import contextlib
+import os
+import re
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# writeWarning("slow-tick: ", N, "ms (worst: module.phase = Xms)")
+SLOW_TICK = "slow-tick: "
+# How the console starts a line reporting that a command failed: the command
+# layer's own errors and the collection add/get/set ones.
+CONSOLE_ERROR = re.compile(r"^(?:Error: |Usage: |Unknown command: |Unknown parameter |"
+                           r"Missing argument: |Argument '|Too many arguments|"
+                           r"Item with name |No such item: |No item '|"
+                           r"Invalid value for property: |Set '[^']*' failed: )", re.M)
+
+
+def percentile(values, p, default=float("nan")):
+    """Nearest-rank p-th percentile (0-100) of values, or default if empty."""
+    if not values:
+        return default
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def ms(seconds, digits=1):
+    """seconds as an 8-wide millisecond table cell; nan prints as '-'."""
+    return f"{'-':>8}" if seconds != seconds else f"{seconds * 1000:8.{digits}f}"
+
+
+def whole_ms(seconds):
+    """seconds as whole milliseconds for JSON; None and nan give None."""
+    return None if seconds is None or seconds != seconds else round(seconds * 1000)
+
+
+def proc_status(pid, key):
+    """A kB figure from /proc/<pid>/status (VmRSS, VmHWM, ...), or None."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def rss_kb(pid):
+    return proc_status(pid, "VmRSS")
+
+
+def cpu_seconds(pid):
+    """User plus system CPU time pid has used, or None if it is gone."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def slow_ticks(path, offset):
+    """([(total_ms, worst)], new offset) for the slow-tick warnings in the
+    stderr log at path since offset; worst is the "module.phase = Xms" the
+    warning names, or "". No path, no ticks."""
+    if not path:
+        return [], offset
+    with open(path, "r", errors="replace") as f:
+        f.seek(offset)
+        text = f.read()
+        offset = f.tell()
+    ticks = []
+    for line in text.splitlines():
+        i = line.find(SLOW_TICK)
+        if i < 0:
+            continue
+        rest = line[i + len(SLOW_TICK):]
+        total = rest.split("ms", 1)[0]
+        worst = rest[rest.find("(worst: ") + 8:].rstrip(")") if "(worst: " in rest else ""
+        if total.isdigit():
+            ticks.append((int(total), worst))
+    return ticks, offset
+
+
+def raise_fd_limit(want):
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < want:
+        target = want if hard == resource.RLIM_INFINITY else min(want, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        if target < want:
+            print(f"warning: open-file limit is {target}; connections past that will fail",
+                  file=sys.stderr)
+
+
+def openwatt(binary, name):
+    """An OpenWattProcess for binary, not yet started, its stderr going to a
+    fresh <tmp>/<name>_*.log; a pipe nobody reads fills up and stalls it. The
+    log is kept for a look afterwards, and its path printed."""
+    sys.path.insert(0, os.path.join(HERE, ".."))
+    from test_harness import OpenWattProcess
+    fd, path = tempfile.mkstemp(prefix=f"{name}_", suffix=".log")
+    os.close(fd)
+    print(f"server stderr: {path}", file=sys.stderr)
+    return OpenWattProcess(binary, stderr_path=path)
+
+
+def send_all(console, commands, failed=CONSOLE_ERROR):
+    """Send console commands in order; exit on the first whose output has a
+    line matching failed."""
+    for cmd in commands:
+        out = console.send_command(cmd, read_delay=0.01, timeout=0.5)
+        if failed.search(out):
+            sys.exit(f"'{cmd}' failed:\n{out}")
+
+
+@contextlib.contextmanager
+def generated_profile(ow, name, text):
+    """conf/profiles/<name>.conf holding text for as long as the block runs,
+    removed after however it ends; nothing is written when ow is None."""
+    if ow is None:
+        yield None
+        return
+    path = os.path.join(ow.project_root, "conf", "profiles", name + ".conf")
+    try:
+        with open(path, "w") as f:
+            f.write(text)
+        yield path
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""Serve many virtual ESPHome nodes over the native API, for load-testing clients.
+
+Each node listens on its own port (--base-port + i) and speaks the
+plaintext native API as src/protocol/esphome/client.d and binding.d use it:
+hello, device info, the entity list, and state subscriptions. Messages are
+built from api.proto itself (proto.py), so they track the schema the
+firmware is compiled against. Every node carries --sensors sensors,
+--binary-sensors binary sensors, --switches switches and --text-sensors
+text sensors; once subscribed, each entity sends a state change at --rate
+Hz, with phases spread so the load is even.
+
+Client throughput shows up as back-pressure: the send buffer is kept small
+(--sndbuf, about what an ESP32's lwIP offers), and an update that finds
+more than --backlog bytes still queued on its connection is dropped and
+counted, the way a real node coalesces state. Dropped updates mean the
+client is not keeping up.
+
+--rate takes a list; each rate is held --step seconds, so one run ramps the
+load. With --start, OpenWatt is started through the harness and given one
+ESPHome client and binding per node, and its resident memory is sampled to
+give a per-node cost.
+
+  python3 test/bench/esphome_sim.py [--nodes N] [--base-port 16053]
+      [--sensors N] [--rate HZ,HZ,...] [--step S] [--start [BINARY]] [--json PATH]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import time
+
+import proto
+from common import generated_profile, openwatt, rss_kb, send_all
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..", "..")
+PROFILE = "bench_esphome_sim"
+
+
+def frame(msg, values):
+    body = msg.encode(values)
+    return b"\0" + proto.varint(len(body)) + proto.varint(msg.id) + body
+
+
+class Totals:
+    def __init__(self):
+        self.sent = self.dropped = self.bytes = 0
+        self.connects = self.subscribed = 0
+        self.unknown = {}
+        self.handshake = []
+
+
+class Node:
+    def __init__(self, sim, index):
+        self.sim = sim
+        self.index = index
+        self.name = f"sim{index}"
+        self.port = sim.args.base_port + index
+        a = sim.args
+        self.entities = []
+        key = 0x1000 * (index + 1)
+        for kind, count in (("sensor", a.sensors), ("binary_sensor", a.binary_sensors),
+                            ("switch", a.switches), ("text_sensor", a.text_sensors)):
+            for i in range(count):
+                key += 1
+                self.entities.append((kind, key, f"{kind}_{i}"))
+        self.state = {key: 0 for _, key, _ in self.entities}
+
+    def entity_frames(self):
+        s = self.sim.schema
+        out = []
+        for kind, key, object_id in self.entities:
+            common = {"object_id": object_id, "key": key, "name": object_id.replace("_", " ")}
+            if kind == "sensor":
+                out.append(frame(s["ListEntitiesSensorResponse"], dict(
+                    common, unit_of_measurement=("W", "V", "A", "Hz", "kWh")[key % 5],
+                    accuracy_decimals=2, device_class="power", state_class=1)))
+            elif kind == "binary_sensor":
+                out.append(frame(s["ListEntitiesBinarySensorResponse"], common))
+            elif kind == "switch":
+                out.append(frame(s["ListEntitiesSwitchResponse"], common))
+            else:
+                out.append(frame(s["ListEntitiesTextSensorResponse"], common))
+        return out
+
+    def state_frame(self, kind, key):
+        s = self.sim.schema
+        n = self.state[key]
+        if kind == "sensor":
+            return frame(s["SensorStateResponse"], {"key": key, "state": 230.0 + (n % 100) / 10})
+        if kind == "binary_sensor":
+            return frame(s["BinarySensorStateResponse"], {"key": key, "state": bool(n & 1)})
+        if kind == "switch":
+            return frame(s["SwitchStateResponse"], {"key": key, "state": bool(n & 1)})
+        return frame(s["TextSensorStateResponse"], {"key": key, "state": f"state {n}"})
+
+    async def serve(self, reader, writer):
+        sim, s, t = self.sim, self.sim.schema, self.sim.totals
+        sock = writer.get_extra_info("socket")
+        if sock is not None and sim.args.sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sim.args.sndbuf)
+        t.connects += 1
+        opened = time.perf_counter()
+        updater = None
+
+        def send(data):
+            t.bytes += len(data)
+            writer.write(data)
+
+        try:
+            while True:
+                head = await reader.readexactly(1)
+                if head[0] != 0:
+                    return      # noise-encrypted client; not simulated
+                length = await self.read_varint(reader)
+                msg_type = await self.read_varint(reader)
+                body = await reader.readexactly(length) if length else b""
+                name = s.by_id[msg_type].name if msg_type in s.by_id else str(msg_type)
+                if name == "HelloRequest":
+                    send(frame(s["HelloResponse"], {
+                        "api_version_major": 1, "api_version_minor": sim.args.api_minor,
+                        "server_info": f"esphome_sim {self.name}", "name": self.name}))
+                elif name == "DeviceInfoRequest":
+                    send(frame(s["DeviceInfoResponse"], {
+                        "name": self.name, "friendly_name": f"Sim {self.index}",
+                        "mac_address": "02:00:00:%02X:%02X:%02X" % (
+                            self.index >> 16 & 0xFF, self.index >> 8 & 0xFF, self.index & 0xFF),
+                        "esphome_version": "2025.10.0", "compilation_time": "Oct 19 2026, 10:00:00",
+                        "model": "esp32dev", "manufacturer": "Espressif"}))
+                elif name == "ListEntitiesRequest":
+                    for f in self.entity_frames():
+                        send(f)
+                    send(frame(s["ListEntitiesDoneResponse"], {}))
+                elif name == "SubscribeStatesRequest":
+                    t.subscribed += 1
+                    t.handshake.append(time.perf_counter() - opened)
+                    for kind, key, _ in self.entities:
+                        send(self.state_frame(kind, key))
+                    if updater is None:
+                        updater = asyncio.ensure_future(self.update(writer, send))
+                elif name == "PingRequest":
+                    send(frame(s["PingResponse"], {}))
+                elif name == "DisconnectRequest":
+                    send(frame(s["DisconnectResponse"], {}))
+                    await writer.drain()
+                    return
+                elif name == "SwitchCommandRequest":
+                    cmd = s["SwitchCommandRequest"].decode(body)
+                    key = cmd.get("key", 0)
+                    if key in self.state:
+                        self.state[key] = int(cmd.get("state", False))
+                        send(self.state_frame("switch", key))
+                elif name in ("PingResponse", "GetTimeResponse", "DisconnectResponse"):
+                    pass
+                else:
+                    t.unknown[name] = t.unknown.get(name, 0) + 1
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            if updater:
+                updater.cancel()
+            writer.close()
+
+    @staticmethod
+    async def read_varint(reader):
+        n = shift = 0
+        while True:
+            b = (await reader.readexactly(1))[0]
+            n |= (b & 0x7F) << shift
+            if not b & 0x80:
+                return n
+            shift += 7
+
+    async def update(self, writer, send):
+        """One state change per entity per 1/rate s, phases spread evenly."""
+        sim, t = self.sim, self.sim.totals
+        transport = writer.transport
+        n = len(self.entities)
+        rng = random.Random(self.index)
+        rate, start, i = None, 0.0, 0
+        while True:
+            if sim.rate != rate:
+                # new step: restart the schedule rather than catch up to it
+                rate, i = sim.rate, 0
+                start = time.perf_counter() + rng.random() / max(rate * n, 1e-9)
+            if rate <= 0:
+                await asyncio.sleep(0.1)
+                continue
+            due = start + i / (rate * n)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            kind, key, _ = self.entities[i % n]
+            i += 1
+            self.state[key] += 1
+            if transport.is_closing():
+                return
+            if transport.get_write_buffer_size() > sim.args.backlog:
+                t.dropped += 1
+                continue
+            send(self.state_frame(kind, key))
+            t.sent += 1
+
+
+class Sim:
+    def __init__(self, args):
+        self.args = args
+        self.schema = proto.load(args.proto)
+        self.totals = Totals()
+        self.rate = args.rate[0]
+        self.nodes = [Node(self, i) for i in range(args.nodes)]
+        self.servers = []
+
+    async def start(self):
+        for node in self.nodes:
+            self.servers.append(await asyncio.start_server(node.serve, self.args.host, node.port))
+
+
+def provision(console, sim):
+    for node in sim.nodes:
+        send_all(console, (f"/protocol/esphome/client add name={node.name} remote={sim.args.host} "
+                           f"port={node.port}",
+                           f"/binding/esphome add name={node.name} device={node.name} "
+                           f"client={node.name} profile={PROFILE}"))
+
+
+async def run(args, ow):
+    sim = Sim(args)
+    await sim.start()
+    t = sim.totals
+    per_node = len(sim.nodes[0].entities) if sim.nodes else 0
+    print(f"{args.nodes} nodes on {args.host}:{args.base_port}..{args.base_port + args.nodes - 1}, "
+          f"{per_node} entities each")
+
+    base_rss = rss_kb(ow.process.pid) if ow else None
+    if ow:
+        provision(ow.get_console(), sim)
+    deadline = time.perf_counter() + args.timeout
+    while t.subscribed < args.nodes and time.perf_counter() < deadline:
+        await asyncio.sleep(0.2)
+    hs = sorted(t.handshake)
+    print(f"subscribed: {t.subscribed}/{args.nodes} nodes"
+          + (f", connect to subscribe p50 {hs[len(hs) // 2] * 1000:.0f} ms,"
+             f" max {hs[-1] * 1000:.0f} ms" if hs else ""))
+    rows = []
+    mem = None
+    if ow:
+        await asyncio.sleep(1.0)
+        rss = rss_kb(ow.process.pid)
+        if rss is not None and base_rss is not None and t.subscribed:
+            mem = (rss - base_rss) / t.subscribed
+            print(f"openwatt rss: {base_rss} kB before, {rss} kB after "
+                  f"({mem:.1f} kB per subscribed node)")
+
+    print(f"\n{'rate Hz':>8} {'offered/s':>10} {'sent/s':>9} {'dropped/s':>10} "
+          f"{'kB/s':>8} {'connected':>9}{'  rss kB' if ow else ''}")
+    for rate in args.rate:
+        sim.rate = rate
+        before = (t.sent, t.dropped, t.bytes)
+        await asyncio.sleep(args.step)
+        sent, dropped, sent_bytes = (t.sent - before[0], t.dropped - before[1],
+                                     t.bytes - before[2])
+        offered = rate * per_node * t.subscribed
+        rss = rss_kb(ow.process.pid) if ow else None
+        row = {"rate_hz": rate, "offered_per_s": offered, "sent_per_s": sent / args.step,
+               "dropped_per_s": dropped / args.step, "kbytes_per_s": sent_bytes / args.step / 1e3,
+               "connects": t.connects, "rss_kb": rss}
+        rows.append(row)
+        print(f"{rate:8g} {offered:10.0f} {row['sent_per_s']:9.0f} {row['dropped_per_s']:10.0f} "
+              f"{row['kbytes_per_s']:8.1f} {t.connects:9}{f'  {rss:6}' if rss else ''}")
+        if ow and not ow.is_running():
+            print("openwatt exited", file=sys.stderr)
+            break
+    if t.connects > args.nodes:
+        print(f"\n{t.connects - args.nodes} reconnect(s): the client dropped connections under load")
+    if t.unknown:
+        print(f"unhandled requests: {t.unknown}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"nodes": args.nodes, "entities_per_node": per_node,
+                       "subscribed": t.subscribed, "kb_per_node": mem, "steps": rows}, f, indent=2)
+        print(f"wrote {args.json}")
+    for server in sim.servers:
+        server.close()
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--nodes", type=int, default=20)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--base-port", type=int, default=16053)
+    ap.add_argument("--sensors", type=int, default=20)
+    ap.add_argument("--binary-sensors", type=int, default=2)
+    ap.add_argument("--switches", type=int, default=2)
+    ap.add_argument("--text-sensors", type=int, default=1)
+    ap.add_argument("--rate", type=lambda s: [float(r) for r in s.split(",") if r], default=[1.0],
+                    metavar="HZ,HZ,...", help="state changes per entity per second, one per step")
+    ap.add_argument("--step", type=float, default=10.0, help="seconds per rate")
+    ap.add_argument("--sndbuf", type=int, default=8192,
+                    help="socket send buffer per connection; 0 leaves the OS default")
+    ap.add_argument("--backlog", type=int, default=4096,
+                    help="queued bytes past which a state update is dropped")
+    ap.add_argument("--api-minor", type=int, default=10, help="API minor version to announce")
+    ap.add_argument("--proto", default=os.path.join(ROOT, "src", "protocol", "esphome", "api.proto"))
+    ap.add_argument("--start", nargs="?", const="bin/x86_64_debug/openwatt", metavar="BINARY",
+                    help="start OpenWatt and add a client and binding per node")
+    ap.add_argument("--timeout", type=float, default=60.0,
+                    help="seconds to wait for every node to be subscribed")
+    ap.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = ap.parse_args()
+
+    ow = openwatt(args.start, "esphome_sim") if args.start else None
+    # bindings need a profile; entities are discovered at runtime
+    with generated_profile(ow, PROFILE, "# generated by test/bench/esphome_sim.py\n"
+                                        "device-template:\n\tcomponent:\n\t\tid: info\n"
+                                        "\t\telement: type, \"esphome-sim\"\n"):
+        if ow and not ow.start():
+            return 1
+        try:
+            return asyncio.run(run(args, ow))
+        finally:
+            if ow:
+                ow.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+"""EZSP frames from commands.d and ASHv2 framing, for the Zigbee benchmarks.
+
+commands.d is read directly, so the simulator tracks the same command ids,
+enums and struct layouts the host is compiled against. Parameters are
+(de)serialised the way ezsp_serialise() does it: little-endian scalars,
+fixed arrays in place, byte slices with a length byte in front, and
+AddEndpoint's two cluster lists with both lengths first. Structs are
+dicts, byte arrays bytes, other arrays lists; a field left out encodes as
+zero.
+
+    spec = ezsp.load("src/protocol/ezsp/commands.d")
+    cmd = spec.commands["SendUnicast"]
+    spec.decode(cmd.request, data) -> {"type": 0, "indexOrDestination": ...}
+    spec.encode(cmd.response, {"status": 0, "sequence": 7}) -> b"\\x00\\x07"
+    spec.enums["EmberStatus"]["NETWORK_UP"] -> 0x90
+
+The ASH half is the NCP's view of ug101: frames are built whole with
+data_frame()/ack_frame() and pulled out of a byte stream by Deframer.
+"""
+
+import re
+import struct
+from collections import namedtuple
+
+SCALARS = {"ubyte": "B", "byte": "b", "bool": "?", "ushort": "H", "short": "h",
+           "uint": "I", "int": "i", "ulong": "Q", "long": "q"}
+SLICES = ("const(ubyte)[]", "ubyte[]")
+CLUSTER_LIST = "const(ushort)[]"
+
+ENUM_RE = re.compile(r"^enum (\w+) : (\w+)")
+CONST_RE = re.compile(r"^enum (\w+) = (\w+);")
+ALIAS_RE = re.compile(r"^alias (\w+) = ([\w\[\]]+);")
+STRUCT_RE = re.compile(r"^(\s*)struct (\w+) \{")
+MEMBER_RE = re.compile(r"^\s*(\w+) = (\w+),")
+FIELD_RE = re.compile(r"^\s*([\w().\[\]]+) (\w+);")
+COMMAND_RE = re.compile(r"^\s*enum ushort Command = (\w+);")
+ARRAY_RE = re.compile(r"^(\w+)\[([\w.]+)\]$")
+
+Command = namedtuple("Command", "name id request response")
+
+
+class Spec:
+    def __init__(self):
+        self.enums = {}       # name -> {member: value}
+        self.enum_types = {}  # name -> underlying scalar
+        self.constants = {}
+        self.aliases = {}
+        self.structs = {}     # name -> [(field, type)]
+        self.commands = {}    # "SendUnicast" -> Command
+        self.by_id = {}
+
+    def resolve(self, t):
+        while t in self.aliases:
+            t = self.aliases[t]
+        return self.enum_types.get(t, t)
+
+    def length(self, n):
+        if "." in n:
+            enum, member = n.split(".")
+            return self.enums[enum][member]
+        return self.constants[n] if n in self.constants else int(n, 0)
+
+    def encode(self, fields, values):
+        out = bytearray()
+        self._encode_fields(fields, values or {}, out)
+        return bytes(out)
+
+    def decode(self, fields, data):
+        values, _ = self._decode_fields(fields, data, 0)
+        return values
+
+    def _encode_fields(self, fields, values, out):
+        i = 0
+        while i < len(fields):
+            name, t = fields[i]
+            if t == CLUSTER_LIST:
+                # AddEndpoint: both lengths, then both lists
+                a, b = values.get(name, []), values.get(fields[i + 1][0], [])
+                out += bytes((len(a), len(b))) + struct.pack(f"<{len(a) + len(b)}H", *a, *b)
+                i += 2
+                continue
+            self._encode(t, values.get(name), out)
+            i += 1
+
+    def _encode(self, t, v, out):
+        t = self.resolve(t)
+        if t in SCALARS:
+            out += struct.pack("<" + SCALARS[t], v or 0)
+        elif t in SLICES:
+            v = bytes(v or b"")
+            out += bytes((len(v),)) + v
+        elif t in self.structs:
+            self._encode_fields(self.structs[t], v or {}, out)
+        else:
+            m = ARRAY_RE.match(t)
+            if not m:
+                raise KeyError(f"unknown type {t}")
+            n = self.length(m.group(2))
+            if self.resolve(m.group(1)) == "ubyte":
+                v = bytes(v or b"")
+                out += v[:n] + bytes(n - min(n, len(v)))
+            else:
+                v = list(v or [])
+                for j in range(n):
+                    self._encode(m.group(1), v[j] if j < len(v) else None, out)
+
+    def _decode_fields(self, fields, data, pos):
+        values = {}
+        i = 0
+        while i < len(fields):
+            name, t = fields[i]
+            if t == CLUSTER_LIST:
+                a, b = data[pos], data[pos + 1]
+                pos += 2
+                values[name] = list(struct.unpack_from(f"<{a}H", data, pos))
+                values[fields[i + 1][0]] = list(struct.unpack_from(f"<{b}H", data, pos + 2 * a))
+                pos += 2 * (a + b)
+                i += 2
+                continue
+            values[name], pos = self._decode(t, data, pos)
+            i += 1
+        return values, pos
+
+    def _decode(self, t, data, pos):
+        t = self.resolve(t)
+        if t in SCALARS:
+            fmt = "<" + SCALARS[t]
+            return struct.unpack_from(fmt, data, pos)[0], pos + struct.calcsize(fmt)
+        if t in SLICES:
+            n = data[pos]
+            if pos + 1 + n > len(data):
+                raise ValueError("truncated")
+            return bytes(data[pos + 1:pos + 1 + n]), pos + 1 + n
+        if t in self.structs:
+            return self._decode_fields(self.structs[t], data, pos)
+        m = ARRAY_RE.match(t)
+        if not m:
+            raise KeyError(f"unknown type {t}")
+        n = self.length(m.group(2))
+        if self.resolve(m.group(1)) == "ubyte":
+            if pos + n > len(data):
+                raise ValueError("truncated")
+            return bytes(data[pos:pos + n]), pos + n
+        out = []
+        for _ in range(n):
+            v, pos = self._decode(m.group(1), data, pos)
+            out.append(v)
+        return out, pos
+
+
+def load(path):
+    spec = Spec()
+    enum = None
+    stack = []  # open structs: [name, fields, indent]
+    command = None
+    with open(path) as f:
+        for line in f:
+            line = line.split("//", 1)[0].rstrip()
+            if not line:
+                continue
+            if enum is not None:
+                m = MEMBER_RE.match(line)
+                if m:
+                    spec.enums[enum][m.group(1)] = int(m.group(2), 0)
+                elif line.startswith("}"):
+                    enum = None
+                continue
+            m = ENUM_RE.match(line)
+            if m:
+                enum = m.group(1)
+                spec.enums[enum] = {}
+                spec.enum_types[enum] = m.group(2)
+                continue
+            m = CONST_RE.match(line)
+            if m:
+                spec.constants[m.group(1)] = int(m.group(2), 0)
+                continue
+            m = ALIAS_RE.match(line)
+            if m:
+                spec.aliases[m.group(1)] = m.group(2)
+                continue
+            m = STRUCT_RE.match(line)
+            if m:
+                stack.append([m.group(2), [], len(m.group(1))])
+                if not m.group(1) and m.group(2).startswith("EZSP_"):
+                    command = {"name": m.group(2)[5:]}
+                continue
+            if not stack:
+                continue
+            m = COMMAND_RE.match(line)
+            if m and command is not None:
+                command["id"] = int(m.group(1), 0)
+                continue
+            m = FIELD_RE.match(line)
+            if m:
+                stack[-1][1].append((m.group(2), m.group(1)))
+                continue
+            if line.strip() == "}":
+                name, fields, indent = stack.pop()
+                if command is None:
+                    spec.structs[name] = fields
+                elif indent:
+                    command[name.lower()] = fields
+                else:
+                    cmd = Command(command["name"], command["id"], command.get("request", []),
+                                  command.get("response", []))
+                    spec.commands[cmd.name] = cmd
+                    spec.by_id[cmd.id] = cmd
+                    command = None
+    return spec
+
+
+# --- ASHv2 ---------------------------------------------------------------
+
+FLAG, ESCAPE, XON, XOFF, SUBSTITUTE, CANCEL = 0x7E, 0x7D, 0x11, 0x13, 0x18, 0x1A
+RESERVED = frozenset((FLAG, ESCAPE, XON, XOFF, SUBSTITUTE, CANCEL))
+RST, RSTACK, ERROR = 0xC0, 0xC1, 0xC2
+ASH_VERSION = 2
+MAX_DATA = 128
+
+RESET_CODES = {"unknown": 0x00, "external": 0x01, "power-on": 0x02, "watchdog": 0x03,
+               "assert": 0x06, "bootloader": 0x09, "software": 0x0B}
+
+
+def crc16(data):
+    crc = 0xFFFF
+    for b in data:
+        crc ^= b << 8
+        for _ in range(8):
+            crc = (crc << 1 ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+    return crc
+
+
+def _lfsr(n):
+    out = bytearray(n)
+    rand = 0x42
+    for i in range(n):
+        out[i] = rand
+        rand = (rand >> 1) ^ (0xB8 if rand & 1 else 0)
+    return bytes(out)
+
+
+PSEUDO_RANDOM = _lfsr(256)
+
+
+def randomise(data):
+    return bytes(b ^ r for b, r in zip(data, PSEUDO_RANDOM))
+
+
+def stuff(data):
+    out = bytearray()
+    for b in data:
+        if b in RESERVED:
+            out += bytes((ESCAPE, b ^ 0x20))
+        else:
+            out.append(b)
+    return bytes(out)
+
+
+def frame(control, body=b""):
+    raw = bytes((control,)) + body
+    return stuff(raw + crc16(raw).to_bytes(2, "big")) + bytes((FLAG,))
+
+
+def data_frame(frm, ack, payload, retransmit=False):
+    return frame((frm & 7) << 4 | (0x08 if retransmit else 0) | (ack & 7), randomise(payload))
+
+
+def ack_frame(ack, nak=False, not_ready=False):
+    return frame((0xA0 if nak else 0x80) | (0x08 if not_ready else 0) | (ack & 7))
+
+
+def rstack_frame(code):
+    return frame(RSTACK, bytes((ASH_VERSION, code)))
+
+
+def error_frame(code):
+    return frame(ERROR, bytes((ASH_VERSION, code)))
+
+
+class Deframer:
+    """Bytes in, (control, body) out; body is de-randomised for DATA frames.
+    Frames that fail the CRC, contain a substitute byte or unstuff badly
+    come out as (None, None) so the caller can NAK them."""
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data):
+        out = []
+        for b in data:
+            if b in (XON, XOFF):
+                continue
+            if b == CANCEL:
+                self.buf.clear()
+                continue
+            if b != FLAG:
+                self.buf.append(b)
+                continue
+            raw, self.buf = self.buf, bytearray()
+            if not raw:
+                continue
+            out.append(self._parse(raw))
+        return out
+
+    @staticmethod
+    def _parse(raw):
+        if SUBSTITUTE in raw:
+            return None, None
+        body = bytearray()
+        escaped = False
+        for b in raw:
+            if escaped:
+                body.append(b ^ 0x20)
+                escaped = False
+            elif b == ESCAPE:
+                escaped = True
+            else:
+                body.append(b)
+        if escaped or len(body) < 3 or crc16(body[:-2]) != int.from_bytes(body[-2:], "big"):
+            return None, None
+        control, payload = body[0], bytes(body[1:-2])
+        if not control & 0x80:
+            payload = randomise(payload)
+        return control, payload
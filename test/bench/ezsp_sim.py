@@ -0,0 +1,924 @@
+#!/usr/bin/env python3
+"""A simulated EZSP NCP on a pseudo-terminal, with a Zigbee network behind it.
+
+The NCP side of ASHv2 (src/protocol/ezsp/ashv2.d talks to it as it would a
+dongle): RST/RSTACK, CRC, byte stuffing, data randomisation, a sliding
+window, ACK/NAK, and retransmission with the reTx bit when the host does
+not acknowledge in time. Output is paced at --baud, so the serial link is
+as narrow as the real one. Above that, enough EZSP for client.d and
+protocol/zigbee: version negotiation, the coordinator's configuration and
+form/init sequence, network parameters, child and address tables, and
+unicast/broadcast sends answered with MessageSentHandler. Commands are
+decoded and answered from src/protocol/ezsp/commands.d (ezsp.py); anything
+without a special case gets a well-formed all-zero (SUCCESS) response.
+
+Behind the NCP are --nodes simulated devices: once the host permits
+joining they join at --join-rate (TrustCenterJoinHandler, ChildJoinHandler
+for the first --children), answer the interview (node/power/simple
+descriptors, active endpoints, ieee_addr, basic attributes, attribute
+discovery) after --air ms, and then send ZCL attribute reports
+(electrical measurement and metering) at --rate reports/s across the
+network. A report that finds more than --backlog frames waiting for the
+host is dropped, as an NCP out of buffers would.
+
+It reports how long the network takes to form and be interviewed, report
+throughput the host acknowledges at each rate, and, for each of --resets
+NCP resets (--reset-mode rstack|error|silent), how long the host takes to
+reconnect, re-initialise and re-resolve every node. With --start OpenWatt
+is started through the harness and given a serial stream, EZSP client,
+Zigbee interface, coordinator and controller on the pty, and its resident
+set is sampled to give memory per node.
+
+  python3 test/bench/ezsp_sim.py [--nodes 300] [--children 32] [--rate R,R,...]
+      [--step S] [--resets N] [--reset-mode rstack|error|silent] [--baud 115200]
+      [--start [BINARY]] [--link PATH] [--json PATH]
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import struct
+import sys
+import time
+import tty
+
+import ezsp
+from common import openwatt, percentile, rss_kb, send_all, whole_ms
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..", "..")
+
+EUI_BASE = 0x00124B0000B00000
+NCP_EUI = (EUI_BASE | 0xFFFF).to_bytes(8, "little")
+STACK_VERSION = 0x7450  # 7.4.5.0
+HA = 0x0104
+
+# zcl types
+BOOL, UINT8, UINT16, UINT24, UINT48, INT16, INT24, ENUM8, STRING = (
+    0x10, 0x20, 0x21, 0x22, 0x25, 0x29, 0x2A, 0x30, 0x42)
+SIZES = {BOOL: 1, UINT8: 1, ENUM8: 1, UINT16: 2, INT16: 2, UINT24: 3, INT24: 3, UINT48: 6}
+SIGNED = (INT16, INT24)
+
+# a metering smart plug: cluster -> {attribute: (type, value)}
+CLUSTERS = {
+    0x0000: {0x0000: (UINT8, 3), 0x0001: (UINT8, 1), 0x0002: (UINT8, 0), 0x0003: (UINT8, 1),
+             0x0004: (STRING, b"OpenWatt"), 0x0005: (STRING, b"bench-plug"),
+             0x0007: (ENUM8, 1), 0x4000: (STRING, b"1.0.0")},
+    0x0003: {0x0000: (UINT16, 0)},
+    0x0006: {0x0000: (BOOL, 1)},
+    0x0702: {0x0000: (UINT48, 0), 0x0300: (ENUM8, 0), 0x0301: (UINT24, 1),
+             0x0302: (UINT24, 1000), 0x0400: (INT24, 0)},
+    0x0B04: {0x0505: (UINT16, 230), 0x0508: (UINT16, 0), 0x050B: (INT16, 0),
+             0x0600: (UINT16, 1), 0x0601: (UINT16, 1), 0x0602: (UINT16, 1),
+             0x0603: (UINT16, 1000), 0x0604: (UINT16, 1), 0x0605: (UINT16, 1)},
+}
+REPORTS = ((0x0B04, (0x0505, 0x0508, 0x050B)), (0x0702, (0x0000, 0x0400)))
+
+# zdo
+NODE_DESC, POWER_DESC, SIMPLE_DESC, ACTIVE_EP, IEEE_ADDR, NWK_ADDR = 2, 3, 4, 5, 1, 0
+ZDO_OK = (0x0021, 0x0022, 0x0034, 0x0036)  # bind, unbind, leave, permit joining
+
+# zcl global commands
+READ, READ_RSP, WRITE, WRITE_RSP, CONFIGURE, CONFIGURE_RSP = 0x00, 0x01, 0x02, 0x04, 0x06, 0x07
+REPORT, DEFAULT_RSP, DISCOVER, DISCOVER_RSP, DISCOVER_EXT, DISCOVER_EXT_RSP = (
+    0x0A, 0x0B, 0x0C, 0x0D, 0x15, 0x16)
+
+
+def zcl_value(t, v):
+    if t == STRING:
+        return bytes((len(v),)) + v
+    n = SIZES[t]
+    return (v & ((1 << 8 * n) - 1)).to_bytes(n, "little") if t in SIGNED else v.to_bytes(n, "little")
+
+
+class Node:
+    def __init__(self, index, node_id, child):
+        self.index = index
+        self.id = node_id
+        self.eui = (EUI_BASE | index + 1).to_bytes(8, "little")
+        self.child = child
+        self.joined_at = None
+        self.interviewed_at = None
+        self.discovered = set()
+        self.requests = 0
+        self.zcl_seq = index & 0xFF
+        self.summation = index * 1000
+        self.report = index % len(REPORTS)
+
+    def attrs(self, cluster):
+        attrs = dict(CLUSTERS.get(cluster, {}))
+        if cluster == 0x0B04:
+            watts = 40 + (self.index * 37 + int(time.time())) % 2000
+            attrs[0x0508] = (UINT16, watts * 1000 // 230)
+            attrs[0x050B] = (INT16, watts)
+        elif cluster == 0x0702:
+            self.summation += 1
+            attrs[0x0000] = (UINT48, self.summation)
+            attrs[0x0400] = (INT24, 40 + self.index % 2000)
+        return attrs
+
+
+class Link:
+    """The NCP end of ASHv2."""
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.args = sim.args
+        self.deframer = ezsp.Deframer()
+        self.out = collections.deque()
+        self.wake = asyncio.Event()
+        self.counts = collections.Counter()
+        self.state = "down"  # down: waiting for RST; up; failed: only RST; silent: deaf
+        self.reset()
+
+    def reset(self):
+        self.tx_seq = self.rx_seq = 0
+        self.unacked = collections.deque()  # [seq, payload, sent, retries, queued, kind]
+        self.queue = collections.deque()    # (payload, queued, kind)
+        self.rejecting = False
+        self.deframer = ezsp.Deframer()
+
+    # wire
+
+    def write(self, data):
+        if self.state != "silent":
+            self.out.append(data)
+            self.wake.set()
+
+    async def writer(self, fd):
+        free = time.perf_counter()
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+            while self.out:
+                data = self.out.popleft()
+                while data:
+                    try:
+                        n = os.write(fd, data)
+                    except BlockingIOError:
+                        n = 0
+                    except OSError:
+                        return
+                    data = data[n:]
+                    if data:
+                        self.counts["tx_blocked"] += 1
+                        await asyncio.sleep(0.002)
+                self.counts["tx_bytes"] += n
+                free = max(free, time.perf_counter()) + n * 10 / self.args.baud
+                if free - time.perf_counter() > 0.002:
+                    await asyncio.sleep(free - time.perf_counter())
+
+    def on_bytes(self, data):
+        if self.state == "silent":
+            return
+        self.counts["rx_bytes"] += len(data)
+        for control, body in self.deframer.feed(data):
+            self.on_frame(control, body)
+
+    # frames
+
+    def on_frame(self, control, body):
+        if control is None:
+            self.counts["rx_bad"] += 1
+            self.reject()
+            return
+        if control == ezsp.RST:
+            self.counts["rst"] += 1
+            self.reset()
+            self.state = "up"
+            self.write(ezsp.rstack_frame(ezsp.RESET_CODES["software"]))
+            self.sim.on_link_reset()
+            return
+        if self.state != "up":
+            return
+        if control & 0x80 == 0:
+            self.on_ack(control & 7)
+            frm, retransmit = control >> 4 & 7, control & 0x08
+            if frm == self.rx_seq:
+                self.rx_seq = (self.rx_seq + 1) & 7
+                self.rejecting = False
+                self.counts["rx_data"] += 1
+                self.write(ezsp.ack_frame(self.rx_seq))
+                self.sim.ncp.command(body)
+            elif retransmit:
+                self.counts["rx_duplicate"] += 1
+                self.write(ezsp.ack_frame(self.rx_seq))
+            else:
+                self.counts["rx_out_of_sequence"] += 1
+                self.reject()
+        elif control & 0xE0 == 0x80:
+            self.on_ack(control & 7)
+        elif control & 0xE0 == 0xA0:
+            self.counts["rx_nak"] += 1
+            self.on_ack(control & 7)
+            self.resend()
+        self.pump()
+
+    def reject(self):
+        if self.state == "up" and not self.rejecting:
+            self.rejecting = True
+            self.counts["tx_nak"] += 1
+            self.write(ezsp.ack_frame(self.rx_seq, nak=True))
+
+    def on_ack(self, ack):
+        if not any(m[0] == (ack - 1) & 7 for m in self.unacked) and ack != self.tx_seq:
+            return  # nothing of ours up to there; stale
+        now = time.perf_counter()
+        while self.unacked and self.unacked[0][0] != ack:
+            m = self.unacked.popleft()
+            self.sim.on_acked(m[5], now - m[4])
+
+    def send(self, payload, kind="response"):
+        if self.state != "up":
+            self.sim.on_lost(kind)
+            return False
+        self.queue.append((payload, time.perf_counter(), kind))
+        self.pump()
+        return True
+
+    def pump(self):
+        while self.queue and len(self.unacked) < self.args.window and self.state == "up":
+            payload, queued, kind = self.queue.popleft()
+            self.unacked.append([self.tx_seq, payload, time.perf_counter(), 0, queued, kind])
+            self.write(ezsp.data_frame(self.tx_seq, self.rx_seq, payload))
+            self.counts["tx_data"] += 1
+            self.tx_seq = (self.tx_seq + 1) & 7
+
+    def resend(self):
+        now = time.perf_counter()
+        for m in self.unacked:
+            m[2], m[3] = now, m[3] + 1
+            self.counts["tx_retransmit"] += 1
+            self.write(ezsp.data_frame(m[0], self.rx_seq, m[1], retransmit=True))
+
+    def tick(self):
+        if self.state != "up" or not self.unacked:
+            return
+        m = self.unacked[0]
+        if time.perf_counter() - m[2] >= min(self.args.ack_timeout / 1000 * (2 ** m[3]), 3.2):
+            self.resend()
+
+    def backlog(self):
+        return len(self.queue)
+
+
+class Ncp:
+    """EZSP command handling and the network behind it."""
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.args = sim.args
+        self.spec = sim.spec
+        self.st = self.spec.enums["EmberStatus"]
+        self.version = 0
+        self.config = {}
+        self.network = None  # formed network parameters, kept across resets
+        self.up = False
+        self.aps_seq = 0
+        self.known = set()   # node ids whose EUI the NCP can look up
+        self.counters = collections.Counter()
+        self.commands = collections.Counter()
+        self.config_ids = self.spec.enums["EzspConfigId"]
+        self.handlers = {name[3:]: getattr(self, name) for name in dir(self)
+                         if name.startswith("on_") and name[3:] in self.spec.commands}
+
+    def reboot(self):
+        self.version = 0
+        self.up = False
+        self.known = {n.id for n in self.sim.nodes if n.child and n.joined_at}
+
+    # framing
+
+    def command(self, frame):
+        if len(frame) >= 4 and frame[2] != 0x01:
+            # legacy header: only the version command is sent this way
+            seq, cmd = frame[0], frame[2]
+            if cmd == 0x00:
+                self.commands["Version"] += 1
+                self.version = min(frame[3], self.args.ezsp_version) if frame[3] >= 8 else self.args.ezsp_version
+                self.sim.mark("version")
+                self.sim.link.send(bytes((seq, 0x80, 0x00, self.args.ezsp_version, 2))
+                                   + struct.pack("<H", STACK_VERSION))
+            return
+        if len(frame) < 5:
+            return
+        seq, cmd_id = frame[0], frame[3] | frame[4] << 8
+        cmd = self.spec.by_id.get(cmd_id)
+        if cmd is None:
+            self.commands[f"x{cmd_id:04x}"] += 1
+            invalid = self.spec.commands["InvalidCommand"]
+            self.reply(seq, invalid.id, bytes((self.spec.enums["EzspStatus"]["ERROR_INVALID_FRAME_ID"],)))
+            return
+        self.commands[cmd.name] += 1
+        try:
+            request = self.spec.decode(cmd.request, frame[5:])
+        except (ValueError, IndexError, struct.error):
+            request = {}
+        handler = self.handlers.get(cmd.name)
+        values = handler(request) if handler else {}
+        self.reply(seq, cmd.id, self.spec.encode(cmd.response, values))
+
+    def reply(self, seq, cmd_id, params, callback=False):
+        control = 0x90 if callback else 0x80
+        self.sim.link.send(bytes((seq, control, 0x01)) + struct.pack("<H", cmd_id) + params,
+                           kind="callback" if callback else "response")
+
+    def callback(self, name, values, kind="callback"):
+        cmd = self.spec.commands[name]
+        payload = bytes((0, 0x90, 0x01)) + struct.pack("<H", cmd.id) + self.spec.encode(cmd.response, values)
+        return self.sim.link.send(payload, kind=kind)
+
+    def later(self, delay, fn, *args):
+        asyncio.get_running_loop().call_later(delay, fn, *args)
+
+    # commands with something to say
+
+    def on_NetworkState(self, _):
+        states = self.spec.enums["EmberNetworkStatus"]
+        return {"status": states["JOINED_NETWORK"] if self.up else states["NO_NETWORK"]}
+
+    def on_SetConfigurationValue(self, req):
+        self.config[req.get("configId")] = req.get("value", 0)
+        return {}
+
+    def on_GetConfigurationValue(self, req):
+        defaults = {self.config_ids["MAX_END_DEVICE_CHILDREN"]: 32,
+                    self.config_ids["ADDRESS_TABLE_SIZE"]: 16}
+        cid = req.get("configId")
+        return {"value": self.config.get(cid, defaults.get(cid, 0))}
+
+    def on_GetEui64(self, _):
+        return {"eui64": NCP_EUI}
+
+    def on_GetNodeId(self, _):
+        return {"nodeId": 0x0000}
+
+    def on_NetworkInit(self, _):
+        if self.network is None:
+            return {"status": self.st["NOT_JOINED"]}
+        self.later(self.args.init_delay, self.network_up)
+        return {"status": self.st["SUCCESS"]}
+
+    def on_FormNetwork(self, req):
+        self.network = dict(req.get("parameters", {}))
+        self.network["nwkManagerId"] = 0x0000
+        self.later(self.args.init_delay, self.network_up)
+        return {"status": self.st["SUCCESS"]}
+
+    def network_up(self):
+        if self.sim.link.state != "up":
+            return
+        self.up = True
+        self.callback("StackStatusHandler", {"status": self.st["NETWORK_UP"]})
+        self.sim.mark("network")
+
+    def on_LeaveNetwork(self, _):
+        self.up = False
+        self.later(0.05, self.callback, "StackStatusHandler", {"status": self.st["NETWORK_DOWN"]})
+        return {"status": self.st["SUCCESS"]}
+
+    def on_GetNetworkParameters(self, _):
+        node_types = self.spec.enums["EmberNodeType"]
+        return {"status": self.st["SUCCESS"] if self.network else self.st["NOT_JOINED"],
+                "nodeType": node_types["COORDINATOR"], "parameters": self.network or {}}
+
+    def on_PermitJoining(self, req):
+        if req.get("duration"):
+            self.sim.permit_joining()
+        return {"status": self.st["SUCCESS"]}
+
+    def on_GetChildData(self, req):
+        i = req.get("index", 0)
+        children = self.sim.children()
+        if i >= len(children):
+            return {"status": self.st["NOT_JOINED"], "childData": {"id": 0xFFFF}}
+        n = children[i]
+        self.sim.resolved(n, "child table")
+        return {"status": self.st["SUCCESS"],
+                "childData": {"eui64": n.eui, "type": self.spec.enums["EmberNodeType"]["END_DEVICE"],
+                              "id": n.id, "timeout": 8}}
+
+    def on_Id(self, req):
+        children = self.sim.children()
+        for i, n in enumerate(children):
+            if n.id == req.get("childId"):
+                return {"childIndex": i}
+        return {"childIndex": 0xFF}
+
+    def on_GetAddressTableRemoteNodeId(self, req):
+        size = self.config.get(self.config_ids["ADDRESS_TABLE_SIZE"], 16)
+        if req.get("addressTableIndex", 0) == size - 1:
+            self.sim.mark("synced")
+        return {"nodeId": 0xFFFF}
+
+    def on_LookupEui64ByNodeId(self, req):
+        n = self.sim.by_id.get(req.get("nodeId"))
+        if n is None or n.id not in self.known:
+            self.counters["lookup_miss"] += 1
+            return {"status": self.st["ERR_FATAL"]}
+        self.sim.resolved(n, "lookup")
+        return {"status": self.st["SUCCESS"], "eui64": n.eui}
+
+    def on_ReadAndClearCounters(self, _):
+        types = self.spec.enums["EmberCounterType"]
+        values = [0] * types["TYPE_COUNT"]
+        for name, v in self.counters.items():
+            if name in types:
+                values[types[name]] = min(v, 0xFFFF)
+        for name in types:
+            self.counters.pop(name, None)
+        return {"values": values}
+
+    def on_SendUnicast(self, req):
+        return self.send(req, req.get("indexOrDestination"))
+
+    def on_SendBroadcast(self, req):
+        return self.send(req, req.get("destination"))
+
+    def on_SendMulticast(self, req):
+        return self.send(req, None)
+
+    def send(self, req, dst):
+        self.aps_seq = (self.aps_seq + 1) & 0xFF
+        aps = dict(req.get("apsFrame", {}), sequence=self.aps_seq)
+        node = self.sim.by_id.get(dst)
+        unicast = "type" in req
+        delivered = node is not None and node.joined_at is not None or not unicast
+        self.counters["MAC_TX_UNICAST_SUCCESS" if delivered else "MAC_TX_UNICAST_FAILED"] += unicast
+        self.counters["MAC_TX_BROADCAST"] += not unicast
+        status = self.st["SUCCESS"] if delivered else self.st["DELIVERY_FAILED"]
+        out_types = self.spec.enums["EmberOutgoingMessageType"]
+        sent = {"type": req["type"] if unicast else out_types["BROADCAST" if dst else "MULTICAST"],
+                "indexOrDestination": dst or 0, "apsFrame": aps,
+                "messageTag": req.get("messageTag", 0), "status": status,
+                "message": req.get("messageContents", b"")}
+        air = self.args.air / 1000 * (0.5 + random.random())
+        self.later(air, self.callback, "MessageSentHandler", sent)
+        if node is not None and delivered and unicast:
+            self.later(air * 2, self.sim.deliver, node, aps, req.get("messageContents", b""))
+        return {"status": self.st["SUCCESS"], "sequence": self.aps_seq}
+
+    def incoming(self, node, aps, payload, kind="callback"):
+        self.counters["MAC_RX_UNICAST"] += 1
+        msg_types = self.spec.enums["EmberIncomingMessageType"]
+        return self.callback("IncomingMessageHandler", {
+            "type": msg_types["UNICAST"], "apsFrame": aps, "lastHopLqi": 200 - node.index % 60,
+            "lastHopRssi": -50 - node.index % 40, "sender": node.id, "bindingIndex": 0xFF,
+            "addressIndex": 0xFF, "message": payload}, kind=kind)
+
+
+class Sim:
+    def __init__(self, args):
+        self.args = args
+        self.spec = ezsp.load(args.commands)
+        rnd = random.Random(args.seed)
+        ids = rnd.sample(range(0x0001, 0xFFF7), args.nodes)
+        self.nodes = [Node(i, ids[i], i < args.children) for i in range(args.nodes)]
+        self.by_id = {n.id: n for n in self.nodes}
+        self.link = Link(self)
+        self.ncp = Ncp(self)
+        self.rate = 0.0
+        self.joining = False
+        self.marks = {}
+        self.t0 = time.perf_counter()
+        self.acked = collections.Counter()
+        self.lost = collections.Counter()
+        self.latency = collections.defaultdict(list)
+        self.offered = self.overflow = 0
+        self.unresolved = {}
+        self.resolve_times = []
+
+    # milestones
+
+    def mark(self, name):
+        self.marks.setdefault(name, time.perf_counter() - self.t0)
+
+    def on_link_reset(self):
+        self.mark("rst")
+        self.ncp.reboot()
+
+    def on_acked(self, kind, latency):
+        self.acked[kind] += 1
+        if kind == "report":
+            self.latency["report"].append(latency)
+
+    def on_lost(self, kind):
+        self.lost[kind] += 1
+
+    def children(self):
+        return [n for n in self.nodes if n.child and n.joined_at]
+
+    def joined(self):
+        return [n for n in self.nodes if n.joined_at]
+
+    def resolved(self, node, how):
+        t = self.unresolved.pop(node.id, None)
+        if t is not None:
+            self.resolve_times.append(time.perf_counter() - t)
+
+    # joins
+
+    def permit_joining(self):
+        if not self.joining:
+            self.joining = True
+            asyncio.get_running_loop().create_task(self.join_all())
+
+    async def join_all(self):
+        spec = self.spec
+        update = spec.enums["EmberDeviceUpdate"]["STANDARD_SECURITY_UNSECURED_JOIN"]
+        allow = spec.enums["EmberJoinDecision"]["ALLOW_JOIN"]
+        end_device = spec.enums["EmberNodeType"]["END_DEVICE"]
+        routers = []
+        for n in self.nodes:
+            if n.joined_at:
+                continue
+            while not self.ncp.up:
+                await asyncio.sleep(0.1)
+            parent = 0x0000 if n.child or not routers else routers[n.index % len(routers)].id
+            if n.child:
+                index = len(self.children())
+                self.ncp.callback("ChildJoinHandler", {"index": index, "joining": True, "childId": n.id,
+                                                       "childEui64": n.eui, "childType": end_device})
+            else:
+                routers.append(n)
+            self.ncp.callback("TrustCenterJoinHandler", {"newNodeId": n.id, "newNodeEui64": n.eui,
+                                                         "status": update, "policyDecision": allow,
+                                                         "parentOfNewNodeId": parent})
+            n.joined_at = time.perf_counter()
+            self.ncp.known.add(n.id)
+            await asyncio.sleep(1 / self.args.join_rate)
+        self.mark("joined")
+
+    # the devices
+
+    def deliver(self, node, aps, payload):
+        """A host unicast reached node; answer it if it asks for an answer."""
+        node.requests += 1
+        if aps.get("profileId") == 0 and aps.get("destinationEndpoint") == 0:
+            self.zdo(node, aps.get("clusterId", 0), payload)
+        elif payload:
+            self.zcl(node, aps, payload)
+
+    def answer(self, node, profile, cluster, src_ep, dst_ep, payload):
+        self.ncp.aps_seq = (self.ncp.aps_seq + 1) & 0xFF
+        aps = {"profileId": profile, "clusterId": cluster, "sourceEndpoint": src_ep,
+               "destinationEndpoint": dst_ep, "sequence": self.ncp.aps_seq}
+        self.ncp.incoming(node, aps, payload, kind="answer")
+
+    def zdo(self, node, cluster, req):
+        if not req:
+            return
+        tsn, nwk = req[0], struct.pack("<H", node.id)
+        body = None
+        if cluster == NODE_DESC:
+            # router (end device for children), 2.4 GHz, mains, rx on idle, max 82 byte APS
+            kind, caps = (0x02, 0x8C) if node.child else (0x01, 0x8E)
+            body = nwk + bytes((kind, 0x40, caps)) + struct.pack("<HBHHHB", 0x1234, 82, 82, 0x2C00, 82, 0)
+        elif cluster == POWER_DESC:
+            body = nwk + bytes((0x10, 0xC1))
+        elif cluster == ACTIVE_EP:
+            body = nwk + bytes((1, 1))
+        elif cluster == SIMPLE_DESC:
+            ins = list(CLUSTERS)
+            desc = struct.pack("<BHHB", 1, HA, 0x0051, 1) + bytes((len(ins),)) + \
+                struct.pack(f"<{len(ins)}H", *ins) + b"\x00"
+            body = nwk + bytes((len(desc),)) + desc
+        elif cluster in (IEEE_ADDR, NWK_ADDR):
+            self.ncp.known.add(node.id)
+            self.resolved(node, "ieee_addr")
+            body = node.eui + nwk
+        elif cluster in ZDO_OK:
+            body = b""
+        if cluster == NODE_DESC and node.interviewed_at is None:
+            node.discovered.add("node")
+        status = 0x00 if body is not None else 0x84  # not supported
+        self.answer(node, 0, cluster | 0x8000, 0, 0, bytes((tsn, status)) + (body or b""))
+
+    def zcl(self, node, aps, data):
+        control = data[0]
+        offset = 3 if control & 0x04 else 1
+        if len(data) < offset + 2:
+            return
+        seq, cmd, body = data[offset], data[offset + 1], data[offset + 2:]
+        cluster = aps.get("clusterId", 0)
+        attrs = node.attrs(cluster)
+        out_cmd, out = DEFAULT_RSP, bytes((cmd, 0x00))
+        if control & 0x03 == 0x01:
+            pass  # cluster command: default response, success
+        elif cmd == READ:
+            out_cmd, out = READ_RSP, b""
+            for i in range(0, len(body) - 1, 2):
+                attr = struct.unpack_from("<H", body, i)[0]
+                if attr in attrs:
+                    t, v = attrs[attr]
+                    out += struct.pack("<HBB", attr, 0, t) + zcl_value(t, v)
+                else:
+                    out += struct.pack("<HB", attr, 0x86)  # unsupported attribute
+        elif cmd in (DISCOVER, DISCOVER_EXT):
+            start = struct.unpack_from("<H", body, 0)[0] if len(body) >= 2 else 0
+            ids = sorted(a for a in attrs if a >= start)
+            if cmd == DISCOVER:
+                out_cmd, out = DISCOVER_RSP, b"\x01" + b"".join(struct.pack("<HB", a, attrs[a][0]) for a in ids)
+            else:
+                out_cmd = DISCOVER_EXT_RSP
+                out = b"\x01" + b"".join(struct.pack("<HBB", a, attrs[a][0], 0x05) for a in ids)
+            node.discovered.add(cluster)
+            if node.interviewed_at is None and node.discovered >= set(CLUSTERS) | {"node"}:
+                node.interviewed_at = time.perf_counter()
+        elif cmd in (WRITE, CONFIGURE):
+            out_cmd, out = (WRITE_RSP if cmd == WRITE else CONFIGURE_RSP), b"\x00"
+        elif control & 0x10 or control & 0x08:
+            return  # no default response wanted, or a response to something
+        else:
+            out = bytes((cmd, 0x82))  # unsupported general command
+        hdr = bytes((0x18, seq, out_cmd))  # server to client, no default response
+        self.answer(node, aps.get("profileId", HA), cluster, aps.get("destinationEndpoint", 1),
+                    aps.get("sourceEndpoint", 1), hdr + out)
+
+    def report(self, node):
+        cluster, ids = REPORTS[node.report]
+        node.report = (node.report + 1) % len(REPORTS)
+        attrs = node.attrs(cluster)
+        node.zcl_seq = (node.zcl_seq + 1) & 0xFF
+        body = b"".join(struct.pack("<HB", a, attrs[a][0]) + zcl_value(*attrs[a]) for a in ids)
+        self.ncp.aps_seq = (self.ncp.aps_seq + 1) & 0xFF
+        aps = {"profileId": HA, "clusterId": cluster, "sourceEndpoint": 1, "destinationEndpoint": 1,
+               "sequence": self.ncp.aps_seq}
+        return self.ncp.incoming(node, aps, bytes((0x18, node.zcl_seq, REPORT)) + body, kind="report")
+
+    async def reporter(self):
+        turn = 0
+        due = time.perf_counter()
+        while True:
+            nodes = self.joined()
+            if self.rate <= 0 or not nodes:
+                await asyncio.sleep(0.05)
+                due = time.perf_counter()
+                continue
+            due += 1 / self.rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -1:
+                due = time.perf_counter()  # fell too far behind; don't burst
+            node = nodes[turn % len(nodes)]
+            turn += 1
+            self.offered += 1
+            if self.link.state != "up" or not self.ncp.up:
+                self.lost["report"] += 1
+            elif self.link.backlog() >= self.args.backlog:
+                self.overflow += 1
+            else:
+                self.report(node)
+
+    async def ticker(self):
+        while True:
+            await asyncio.sleep(0.05)
+            self.link.tick()
+
+    # resets
+
+    def reset(self, mode):
+        """Reboot the NCP the way mode says; returns when the fault is over."""
+        self.marks = {}
+        self.t0 = time.perf_counter()
+        self.ncp.reboot()
+        self.unresolved = {n.id: self.t0 for n in self.joined()}
+        self.resolve_times = []
+        if mode == "rstack":
+            # watchdog reboot: the NCP announces itself and starts over at frame 0
+            self.link.reset()
+            self.link.state = "up"
+            self.link.write(ezsp.rstack_frame(ezsp.RESET_CODES["watchdog"]))
+        elif mode == "error":
+            self.link.write(ezsp.error_frame(0x51))  # exceeded maximum ack timeouts
+            self.link.reset()
+            self.link.state = "failed"
+        else:
+            self.link.state = "silent"
+            self.link.out.clear()
+            asyncio.get_running_loop().call_later(self.args.outage, self.wake_up)
+
+    def wake_up(self):
+        self.link.reset()
+        self.link.state = "down"
+
+
+def provision(console, args, device):
+    out_clusters = ",".join(f"0x{c:x}" for c in CLUSTERS)
+    send_all(console, (
+        f"/stream/serial/add name=bench-ncp device={device} baud-rate={args.baud}",
+        f"/protocol/ezsp/client/add name=bench-ezsp ash-stream=bench-ncp",
+        f"/interface/zigbee/add name=bench-zb ezsp-client=bench-ezsp",
+        f"/protocol/zigbee/coordinator/add name=bench-coord interface=bench-zb channel=15",
+        f"/protocol/zigbee/endpoint/add name=bench-ep node=bench-coord endpoint-id=1 profile=ha "
+        f"device=0x0007 in-clusters=0,3 out-clusters={out_clusters}",
+        f"/protocol/zigbee/controller/add name=bench-ctl endpoint=bench-ep "
+        f"auto-create={'true' if args.auto_create else 'false'}"))
+
+
+async def wait_for(cond, timeout):
+    deadline = time.perf_counter() + timeout
+    while not cond() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    return cond()
+
+
+async def run(args, ow):
+    sim = Sim(args)
+    loop = asyncio.get_running_loop()
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    os.set_blocking(master, False)
+    device = os.ttyname(slave)
+    if args.link:
+        if os.path.islink(args.link):
+            os.unlink(args.link)
+        os.symlink(device, args.link)
+
+    def readable():
+        try:
+            data = os.read(master, 4096)
+        except (BlockingIOError, OSError):
+            return
+        sim.link.on_bytes(data)
+
+    loop.add_reader(master, readable)
+    tasks = [loop.create_task(c) for c in (sim.link.writer(master), sim.reporter(), sim.ticker())]
+    print(f"NCP on {device}{f' ({args.link})' if args.link else ''}: EZSP v{args.ezsp_version}, "
+          f"{args.baud} baud, window {args.window}; {args.nodes} nodes ({args.children} children)",
+          flush=True)
+    results = {"nodes": args.nodes, "children": args.children, "baud": args.baud}
+
+    pid = ow.process.pid if ow else None
+    if ow:
+        provision(ow.get_console(), args, device)
+
+    # form
+    if not await wait_for(lambda: "network" in sim.marks, args.timeout):
+        print(f"no network after {args.timeout:.0f}s (commands seen: {dict(sim.ncp.commands)})")
+        return 1
+    await wait_for(lambda: sim.joining, args.timeout)
+    formed = dict(sim.marks)
+    print(f"network up {formed['network']:.2f}s after start, joins permitted at "
+          f"{time.perf_counter() - sim.t0:.2f}s")
+    base_rss = rss_kb(pid) if pid else None
+    results["form"] = {k: whole_ms(v) for k, v in formed.items()}
+
+    # join and interview
+    t_join = time.perf_counter()
+    await wait_for(lambda: all(n.interviewed_at for n in sim.nodes), args.timeout)
+    joined = sim.joined()
+    interviewed = [n for n in joined if n.interviewed_at]
+    took = [n.interviewed_at - n.joined_at for n in interviewed]
+    requests = sum(n.requests for n in joined)
+    print(f"{len(joined)} joined in {sim.marks.get('joined', time.perf_counter() - sim.t0) - (t_join - sim.t0):.1f}s, "
+          f"{len(interviewed)} interviewed in {time.perf_counter() - t_join:.1f}s"
+          + (f" (per node p50 {percentile(took, 50, None):.1f}s, max {max(took):.1f}s, "
+             f"{requests / len(joined):.0f} requests each)" if took else ""))
+    results["interview"] = {"joined": len(joined), "interviewed": len(interviewed),
+                            "seconds": time.perf_counter() - t_join,
+                            "p50_s": percentile(took, 50, None), "max_s": max(took) if took else None,
+                            "requests_per_node": requests / len(joined) if joined else None}
+    if pid:
+        await asyncio.sleep(1.0)
+        rss = rss_kb(pid)
+        if rss is not None and base_rss is not None and joined:
+            per_node = (rss - base_rss) / len(joined)
+            print(f"openwatt rss: {base_rss} kB before joins, {rss} kB after ({per_node:.1f} kB per node)")
+            results["rss_kb"] = {"before": base_rss, "after": rss, "per_node": per_node}
+
+    # reports
+    print(f"\n{'rate/s':>8} {'offered/s':>10} {'acked/s':>8} {'overflow/s':>11} {'lost/s':>7} "
+          f"{'p50 ms':>7} {'p99 ms':>7} {'retx':>5} {'naks':>5}{'  rss kB' if pid else ''}")
+    rows = []
+    for rate in args.rate:
+        sim.rate = rate
+        c = sim.link.counts
+        before = (sim.offered, sim.acked["report"], sim.overflow, sim.lost["report"],
+                  c["tx_retransmit"], c["rx_nak"])
+        sim.latency["report"] = []
+        await asyncio.sleep(args.step)
+        now = (sim.offered, sim.acked["report"], sim.overflow, sim.lost["report"],
+               c["tx_retransmit"], c["rx_nak"])
+        d = [(a - b) for a, b in zip(now, before)]
+        lat = sim.latency["report"]
+        rss = rss_kb(pid) if pid else None
+        row = {"rate": rate, "offered_per_s": d[0] / args.step, "acked_per_s": d[1] / args.step,
+               "overflow_per_s": d[2] / args.step, "lost_per_s": d[3] / args.step,
+               "p50_ms": whole_ms(percentile(lat, 50)), "p99_ms": whole_ms(percentile(lat, 99)),
+               "retransmits": d[4], "naks": d[5], "rss_kb": rss}
+        rows.append(row)
+        print(f"{rate:8g} {row['offered_per_s']:10.0f} {row['acked_per_s']:8.0f} "
+              f"{row['overflow_per_s']:11.0f} {row['lost_per_s']:7.0f} {row['p50_ms'] or 0:7} "
+              f"{row['p99_ms'] or 0:7} {d[4]:5} {d[5]:5}{f'  {rss:6}' if rss else ''}")
+        if ow and not ow.is_running():
+            print("openwatt exited", file=sys.stderr)
+            break
+    results["reports"] = rows
+
+    # resets
+    sim.rate = args.reset_rate
+    resets = []
+    if args.resets:
+        print(f"\nNCP reset ({args.reset_mode}) at {args.reset_rate:g} reports/s, "
+              f"times from the reset in ms:")
+        print(f"  {'rst':>6} {'version':>8} {'network':>8} {'synced':>7} {'resolved':>9} "
+              f"{'p50':>6} {'lost':>5} {'retx':>5}")
+    for _ in range(args.resets):
+        lost0, retx0 = sim.lost["report"], sim.link.counts["tx_retransmit"]
+        sim.reset(args.reset_mode)
+        await wait_for(lambda: "synced" in sim.marks and not sim.unresolved, args.timeout)
+        m = {k: whole_ms(v) for k, v in sim.marks.items()}
+        m["resolved"] = whole_ms(time.perf_counter() - sim.t0) if not sim.unresolved else None
+        m["resolve_p50"] = whole_ms(percentile(sim.resolve_times, 50))
+        m["unresolved"] = len(sim.unresolved)
+        m["lost"] = sim.lost["report"] - lost0
+        m["retransmits"] = sim.link.counts["tx_retransmit"] - retx0
+        resets.append(m)
+        cell = lambda v: f"{v}" if v is not None else "-"
+        print(f"  {cell(m.get('rst')):>6} {cell(m.get('version')):>8} {cell(m.get('network')):>8} "
+              f"{cell(m.get('synced')):>7} {cell(m['resolved']):>9} {cell(m['resolve_p50']):>6} "
+              f"{m['lost']:>5} {m['retransmits']:>5}"
+              + (f"  ({m['unresolved']} never resolved)" if m["unresolved"] else ""))
+        await asyncio.sleep(args.settle)
+    results["resets"] = resets
+
+    c = sim.link.counts
+    print(f"\nlink: {c['tx_data']} frames out, {c['rx_data']} in, {c['tx_retransmit']} retransmitted, "
+          f"{c['rx_nak']} NAKs from the host, {c['tx_nak']} to it, {c['rx_bad']} bad frames, "
+          f"{c['rx_duplicate']} duplicates, {c['rst']} RSTs")
+    unanswered = {k: v for k, v in sim.ncp.commands.items()
+                  if k not in sim.ncp.handlers and k not in ("Version",)}
+    if unanswered:
+        print("answered generically: " + ", ".join(f"{k} {v}" for k, v in sorted(unanswered.items())))
+    results["link"] = dict(c)
+    results["commands"] = dict(sim.ncp.commands)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"wrote {args.json}")
+    for t in tasks:
+        t.cancel()
+    loop.remove_reader(master)
+    if args.link and os.path.islink(args.link):
+        os.unlink(args.link)
+    os.close(master)
+    os.close(slave)
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--nodes", type=int, default=300)
+    ap.add_argument("--children", type=int, default=32, help="nodes that join as the NCP's children")
+    ap.add_argument("--join-rate", type=float, default=20.0, help="joins per second")
+    ap.add_argument("--air", type=float, default=30.0, help="ms a unicast takes to be delivered")
+    ap.add_argument("--rate", type=lambda s: [float(r) for r in s.split(",") if r], default=[10.0, 50.0, 100.0],
+                    metavar="R,R,...", help="attribute reports per second across the network, one per step")
+    ap.add_argument("--step", type=float, default=10.0, help="seconds per rate")
+    ap.add_argument("--backlog", type=int, default=32,
+                    help="frames waiting for the host past which a report is dropped")
+    ap.add_argument("--resets", type=int, default=3)
+    ap.add_argument("--reset-mode", choices=("rstack", "error", "silent"), default="rstack")
+    ap.add_argument("--reset-rate", type=float, default=10.0, help="reports/s while resetting")
+    ap.add_argument("--outage", type=float, default=5.0, help="seconds an NCP stays silent")
+    ap.add_argument("--init-delay", type=float, default=0.2, help="seconds from form/init to NETWORK_UP")
+    ap.add_argument("--baud", type=int, default=115200)
+    ap.add_argument("--window", type=int, default=3, help="NCP's unacknowledged frame limit (1-7)")
+    ap.add_argument("--ack-timeout", type=float, default=800.0, help="ms before the NCP retransmits")
+    ap.add_argument("--ezsp-version", type=int, default=13)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--commands", default=os.path.join(ROOT, "src", "protocol", "ezsp", "commands.d"))
+    ap.add_argument("--link", metavar="PATH", help="symlink this path to the pty")
+    ap.add_argument("--auto-create", action="store_true", help="let the controller create devices")
+    ap.add_argument("--start", nargs="?", const="bin/x86_64_debug/openwatt", metavar="BINARY",
+                    help="start OpenWatt and give it the NCP")
+    ap.add_argument("--settle", type=float, default=2.0)
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = ap.parse_args()
+    if not 1 <= args.window <= 7:
+        ap.error("--window must be 1-7")
+    if args.children > args.nodes:
+        ap.error("--children cannot exceed --nodes")
+
+    ow = None
+    if args.start:
+        ow = openwatt(args.start, "ezsp_sim")
+        if not ow.start():
+            return 1
+    try:
+        return asyncio.run(run(args, ow))
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        if ow:
+            ow.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
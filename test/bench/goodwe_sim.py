@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+"""Simulate GoodWe inverters on the AA55 protocol, and measure a poller against them.
+
+Each inverter answers AA55 over UDP the way src/protocol/goodwe/aa55.d
+expects: the offline query / address allocation handshake, ID info
+(0x02), running info (0x01), running data (0x06) and setting info
+(0x03), with frames laid out like the RunningInfo/RunningData structs and
+values that move (PV following a slow sine, grid around 230 V/50 Hz, SOC
+drifting). aa55.d tells inverters apart by source IP alone, so every
+inverter gets its own address, counting up from --host (127.0.0.2,
+127.0.0.3, ... all reach loopback on Linux).
+
+Faults: --latency/--jitter delay every answer, --drop loses a fraction
+of them, and --corrupt spoils a fraction in one of the --faults ways:
+
+    checksum    last byte flipped
+    truncate    frame cut short
+    length      length byte larger than the payload
+    address     answer from the wrong source address (checksum good)
+    garbage     random bytes
+
+With --start, OpenWatt is started through the harness and given one
+aa55 client and goodwe binding per inverter (generated profile polling
+running info at realtime and running data at high), then run through
+phases:
+
+    clean       polling cadence per function against what the profile asks
+                for, answers/s, and OpenWatt CPU per answered frame over
+                its idle baseline (parse, dispatch and element update)
+    corrupt     --corrupt of the answers spoiled: how long after a spoiled
+                answer the next request for that function comes
+    outage      every inverter silent for --outage seconds (past the
+                client's 10 s watchdog by default), then the time from the
+                end of it to each inverter's first answered read again
+
+Main-loop ticks over 100 ms (OpenWatt's slow-tick warning) are counted
+in every phase. Without --start the inverters just run, with the faults
+given, and print what is being asked of them each --interval.
+
+  python3 test/bench/goodwe_sim.py [--inverters N] [--host 127.0.0.2] [--port 8899]
+      [--latency MS] [--jitter MS] [--drop P] [--corrupt P] [--faults checksum,...]
+      [--start [BINARY]] [--duration S] [--outage S] [--json PATH]
+"""
+
+import argparse
+import asyncio
+import ipaddress
+import json
+import math
+import random
+import struct
+import sys
+import time
+
+from common import cpu_seconds, generated_profile, openwatt, percentile, send_all, slow_ticks
+
+PROFILE = "bench_goodwe_sim"
+FAULTS = ("checksum", "truncate", "length", "address", "garbage")
+
+REGISTER, READ, EXECUTE = 0x00, 0x01, 0x03
+OFFLINE_QUERY, ALLOCATE = 0x00, 0x01
+RUNNING_INFO, ID_INFO, SETTING_INFO, RUNNING_DATA = 0x01, 0x02, 0x03, 0x06
+FN_NAMES = {RUNNING_INFO: "running-info", ID_INFO: "id-info", SETTING_INFO: "setting-info",
+            RUNNING_DATA: "running-data"}
+
+# (field, offset, struct format) as in aa55.d's RunningInfo and RunningData
+RUNNING_INFO_LAYOUT = (
+    ("v_pv1", 0, ">H"), ("v_pv2", 2, ">H"), ("i_pv1", 4, ">h"), ("i_pv2", 6, ">h"),
+    ("v_grid", 8, ">H"), ("i_grid", 10, ">h"), ("f_grid", 12, ">H"), ("p_ac", 14, ">h"),
+    ("temp", 18, ">H"), ("e_total", 24, ">I"), ("h_total", 28, ">I"), ("e_day", 44, ">H"),
+    ("v_bat", 46, ">H"), ("soc", 50, ">H"), ("i_bat", 52, ">h"), ("e_load_day", 60, ">H"),
+    ("e_load_total", 62, ">I"), ("total_power", 66, ">H"), ("v_backup", 68, ">H"),
+    ("i_backup", 70, ">h"), ("soh", 78, ">H"), ("bat_temp", 80, ">H"),
+    ("f_backup", 106, ">H"),
+)
+RUNNING_INFO_SIZE, TIME_INFO = 130, 92
+RUNNING_DATA_LAYOUT = (
+    ("v_pv1", 0, ">H"), ("i_pv1", 2, ">h"), ("pv1_state", 4, ">B"), ("v_pv2", 5, ">H"),
+    ("i_pv2", 7, ">h"), ("pv2_state", 9, ">B"), ("v_bat", 10, ">H"), ("bat_temp", 16, ">h"),
+    ("i_bat", 18, ">h"), ("soc", 26, ">B"), ("soh", 29, ">B"), ("bat_mode", 30, ">B"),
+    ("v_grid", 34, ">H"), ("i_grid", 36, ">h"), ("p_grid", 38, ">h"), ("f_grid", 40, ">H"),
+    ("grid_mode", 42, ">B"), ("v_backup", 43, ">H"), ("i_backup", 45, ">h"),
+    ("p_load", 47, ">h"), ("f_backup", 49, ">H"), ("work_mode", 52, ">B"),
+    ("temp", 53, ">H"), ("e_total", 59, ">I"), ("h_total", 63, ">I"), ("e_day", 67, ">H"),
+    ("e_load_day", 69, ">H"), ("e_load_total", 71, ">I"), ("total_power", 75, ">H"),
+    ("grid_in_out", 80, ">B"), ("p_backup", 81, ">h"),
+)
+RUNNING_DATA_SIZE, TIME_DATA = 140, 95
+
+# what the generated profile polls, and at what frequency
+POLLED = {RUNNING_INFO: ("realtime", 0.4), RUNNING_DATA: ("high", 1.0)}
+PROFILE_ELEMENTS = (
+    (RUNNING_INFO, 0, "u16be", "0.1V", "v_pv1", "V", "realtime"),
+    (RUNNING_INFO, 2, "u16be", "0.1V", "v_pv2", "V", "realtime"),
+    (RUNNING_INFO, 4, "i16be", "0.1A", "i_pv1", "A", "realtime"),
+    (RUNNING_INFO, 8, "u16be", "0.1V", "v_grid", "V", "realtime"),
+    (RUNNING_INFO, 12, "u16be", "0.01Hz", "f_grid", "Hz", "realtime"),
+    (RUNNING_INFO, 14, "i16be", "W", "p_ac", "W", "realtime"),
+    (RUNNING_INFO, 24, "u32be", "0.1kWh", "e_total", "kWh", "realtime"),
+    (RUNNING_DATA, 18, "i16be", "0.1A", "i_bat", "A", "high"),
+    (RUNNING_DATA, 26, "u8", "%", "soc", "%", "high"),
+    (RUNNING_DATA, 38, "i16be", "W", "p_grid", "W", "high"),
+    (RUNNING_DATA, 53, "u16be", "0.1°C", "temp", "°C", "high"),
+)
+
+
+def checksum(data):
+    return struct.pack(">H", sum(data) & 0xFFFF)
+
+
+def frame(source, dest, control, function, payload=b""):
+    head = bytes((0xAA, 0x55, source, dest, control, function, len(payload))) + payload
+    return head + checksum(head)
+
+
+def parse_frame(data):
+    """(source, dest, control, function, payload), or None if it is not a good frame."""
+    if len(data) < 9 or data[0] != 0xAA or data[1] != 0x55:
+        return None
+    n = data[6]
+    if len(data) < 9 + n or data[7 + n:9 + n] != checksum(data[:7 + n]):
+        return None
+    return data[2], data[3], data[4], data[5], data[7:7 + n]
+
+
+def pack_layout(size, layout, values, time_offset):
+    out = bytearray(size)
+    for name, offset, fmt in layout:
+        struct.pack_into(fmt, out, offset, values[name])
+    t = time.localtime()
+    out[time_offset:time_offset + 6] = bytes((t.tm_year % 100, t.tm_mon, t.tm_mday,
+                                              t.tm_hour, t.tm_min, t.tm_sec))
+    return bytes(out)
+
+
+def spoil(data, kind, rng):
+    if kind == "checksum":
+        return data[:-1] + bytes((data[-1] ^ 0xFF,))
+    if kind == "truncate":
+        return data[:rng.randrange(7, len(data) - 1)]
+    if kind == "length":
+        return data[:6] + bytes((min(255, data[6] + 16),)) + data[7:]
+    if kind == "address":
+        head = data[:2] + bytes((data[2] ^ 0x55,)) + data[3:-2]
+        return head + checksum(head)
+    return bytes(rng.randrange(256) for _ in range(len(data)))
+
+
+class Inverter(asyncio.DatagramProtocol):
+    def __init__(self, sim, index, host):
+        self.sim = sim
+        self.index = index
+        self.host = host
+        self.name = f"gw{index}"
+        self.serial = f"5048ESU{index:09d}".encode()[:16].ljust(16, b"\0")
+        self.addr = 0x7F
+        self.transport = None
+        self.rng = random.Random(index)
+        self.phase_shift = self.rng.uniform(0, 2 * math.pi)
+        self.e_total = 123400 + index * 37
+        self.soc = 40 + index % 50
+        self.last_request = {}
+        self.spoiled = {}
+        self.recovered = None
+        self.identified = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def values(self):
+        t = time.time()
+        sun = max(0.0, math.sin(t / 600 + self.phase_shift))
+        ppv = sun * 4800 * (0.9 + 0.1 * self.rng.random())
+        v_pv = int(3800 + 200 * sun + self.rng.randrange(-30, 30))
+        i_pv = int(ppv * 50 / v_pv)
+        v_grid = 2300 + self.rng.randrange(-60, 90)
+        f_grid = 5000 + self.rng.randrange(-5, 6)
+        p_load = 350 + self.rng.randrange(0, 900)
+        p_bat = int(ppv - p_load) // 2
+        p_grid = int(ppv - p_load - p_bat)
+        self.e_total += 1 if ppv > 100 and self.rng.random() < 0.05 else 0
+        self.soc = min(100, max(5, self.soc + (1 if p_bat > 0 and self.rng.random() < 0.01 else 0)
+                                - (1 if p_bat < 0 and self.rng.random() < 0.01 else 0)))
+        v_bat = 520 + self.soc // 4
+        return {
+            "v_pv1": v_pv, "v_pv2": v_pv - 50, "i_pv1": i_pv, "i_pv2": i_pv,
+            "pv1_state": 2 if sun else 1, "pv2_state": 2 if sun else 1,
+            "v_grid": v_grid, "i_grid": abs(p_grid) * 100 // v_grid, "f_grid": f_grid,
+            "p_ac": int(ppv), "p_grid": p_grid, "p_load": p_load, "p_backup": 0,
+            "temp": 380 + self.rng.randrange(0, 40), "bat_temp": 250 + self.rng.randrange(0, 20),
+            "e_total": self.e_total, "h_total": 8123 + self.index, "e_day": 123,
+            "v_bat": v_bat, "i_bat": p_bat * 100 // v_bat, "soc": self.soc, "soh": 98,
+            "bat_mode": 3 if p_bat > 0 else 2, "grid_mode": 1, "work_mode": 2,
+            "e_load_day": 88, "e_load_total": 45670, "total_power": int(ppv),
+            "v_backup": v_grid, "i_backup": 0, "f_backup": f_grid,
+            "grid_in_out": 1 if p_grid > 0 else 2,
+        }
+
+    def id_info(self):
+        return (b"04029" + b"GW5048-EM".ljust(10) + bytes(16) + self.serial
+                + b"6000" + b"V1.02.22".ljust(12) + bytes((20,)))
+
+    def answer(self, source, control, function, payload):
+        """The reply frame, or None for requests an inverter would ignore."""
+        if control == REGISTER and function == OFFLINE_QUERY:
+            self.addr = 0x7F
+            return frame(0x7F, source, REGISTER, 0x80, self.serial)
+        if control == REGISTER and function == ALLOCATE:
+            if len(payload) >= 17:
+                self.addr = payload[16]
+            return frame(self.addr, source, REGISTER, 0x81)
+        if control == READ:
+            if function == ID_INFO:
+                body = self.id_info()
+            elif function == RUNNING_INFO:
+                body = pack_layout(RUNNING_INFO_SIZE, RUNNING_INFO_LAYOUT, self.values(), TIME_INFO)
+            elif function == RUNNING_DATA:
+                body = pack_layout(RUNNING_DATA_SIZE, RUNNING_DATA_LAYOUT, self.values(), TIME_DATA)
+            elif function == SETTING_INFO:
+                body = struct.pack(">6H", 1200, 60, 1840, 2760, 4750, 5150)
+            else:
+                return None
+            return frame(self.addr, source, READ, function | 0x80, body)
+        if control == EXECUTE:
+            return frame(self.addr, source, EXECUTE, function | 0x80, b"\x06")
+        return None
+
+    def datagram_received(self, data, addr):
+        sim = self.sim
+        now = time.perf_counter()
+        req = parse_frame(data)
+        if req is None:
+            sim.count("bad_requests")
+            return
+        source, _, control, function, payload = req
+        sim.count("requests")
+        if control == READ:
+            key = (control, function)
+            last = self.last_request.get(key)
+            if last is not None:
+                sim.interval(function, now - last)
+            self.last_request[key] = now
+            if key in self.spoiled:
+                sim.gaps.append(now - self.spoiled.pop(key))
+        elif control == REGISTER and function == OFFLINE_QUERY:
+            sim.count("handshakes")
+        if sim.silent:
+            sim.count("unanswered")
+            return
+        reply = self.answer(source, control, function, payload)
+        if reply is None:
+            sim.count("unknown")
+            return
+        if control == READ and function == ID_INFO and self.identified is None:
+            self.identified = now
+        if sim.args.drop and self.rng.random() < sim.args.drop:
+            sim.count("dropped")
+            return
+        if control == READ and sim.corrupt and self.rng.random() < sim.corrupt:
+            reply = spoil(reply, self.rng.choice(sim.args.faults), self.rng)
+            self.spoiled[(control, function)] = now
+            sim.count("corrupted")
+        elif control == READ and function != ID_INFO:
+            sim.count("answered")
+            if self.recovered is None and sim.outage_end and now >= sim.outage_end:
+                self.recovered = now - sim.outage_end
+        delay = sim.args.latency / 1000
+        if sim.args.jitter:
+            delay += self.rng.uniform(0, sim.args.jitter / 1000)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.send, reply, addr)
+        else:
+            self.send(reply, addr)
+
+    def send(self, data, addr):
+        self.sim.count("bytes_out", len(data))
+        self.transport.sendto(data, addr)
+
+
+class Sim:
+    def __init__(self, args):
+        self.args = args
+        self.inverters = []
+        self.silent = False
+        self.corrupt = args.corrupt
+        self.outage_end = None
+        self.reset()
+
+    def reset(self):
+        self.counts = {}
+        self.intervals = {}
+        self.gaps = []
+
+    def count(self, what, n=1):
+        self.counts[what] = self.counts.get(what, 0) + n
+
+    def interval(self, function, seconds):
+        self.intervals.setdefault(function, []).append(seconds)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        base = ipaddress.IPv4Address(self.args.host)
+        for i in range(self.args.inverters):
+            host = str(base + i)
+            inv = Inverter(self, i, host)
+            await loop.create_datagram_endpoint(lambda inv=inv: inv, local_addr=(host, self.args.port))
+            self.inverters.append(inv)
+
+    def close(self):
+        for inv in self.inverters:
+            if inv.transport:
+                inv.transport.close()
+
+
+def profile_text():
+    lines = ["# generated by test/bench/goodwe_sim.py", "elements:"]
+    for fn, offset, type, units, name, display, freq in PROFILE_ELEMENTS:
+        lines.append(f'\taa55: {fn}, {offset}, {type}, {units},\tdesc: {name}, {display}, {freq}, "{name}"')
+    lines += ["device-template:", "\tcomponent:", "\t\tid: inverter"]
+    for *_, name, _, _ in PROFILE_ELEMENTS:
+        lines.append(f"\t\telement-map: {name}, @{name}")
+    return "\n".join(lines) + "\n"
+
+
+def provision(console, sim):
+    for inv in sim.inverters:
+        send_all(console, (f"/protocol/goodwe/aa55/add name={inv.name} remote={inv.host}:{sim.args.port}",
+                           f"/binding/goodwe/add name={inv.name} device={inv.name} client={inv.name} "
+                           f"profile={PROFILE}"))
+
+
+def cadence(sim):
+    """{function: row} of request intervals against the profile's."""
+    rows = {}
+    for fn, (freq, expect) in POLLED.items():
+        iv = sim.intervals.get(fn, [])
+        rows[FN_NAMES[fn]] = {
+            "frequency": freq, "expect_ms": expect * 1000, "samples": len(iv),
+            "p50_ms": percentile(iv, 50, 0.0) * 1000, "p99_ms": percentile(iv, 99, 0.0) * 1000,
+            "mean_ms": sum(iv) / len(iv) * 1000 if iv else 0.0,
+        }
+    return rows
+
+
+async def run(args, ow):
+    sim = Sim(args)
+    sim.corrupt = 0.0
+    await sim.start()
+    n = len(sim.inverters)
+    print(f"{n} inverters on {sim.inverters[0].host}..{sim.inverters[-1].host}:{args.port}")
+    pid = ow.process.pid
+    stderr = str(ow.stderr_path)
+
+    await asyncio.sleep(args.settle)
+    c0, t0 = cpu_seconds(pid), time.perf_counter()
+    await asyncio.sleep(args.settle)
+    idle = (cpu_seconds(pid) - c0) / (time.perf_counter() - t0)
+
+    t_provision = time.perf_counter()
+    provision(ow.get_console(), sim)
+    deadline = time.perf_counter() + args.timeout
+    while (sum(inv.identified is not None for inv in sim.inverters) < n
+           and time.perf_counter() < deadline):
+        await asyncio.sleep(0.1)
+    up = sorted(inv.identified - t_provision for inv in sim.inverters if inv.identified)
+    print(f"identified: {len(up)}/{n} inverters"
+          + (f", provision to ID info p50 {percentile(up, 50) * 1000:.0f} ms, max {up[-1] * 1000:.0f} ms"
+             if up else ""))
+    if not up:
+        return 1
+    await asyncio.sleep(args.settle)
+    _, offset = slow_ticks(stderr, 0)
+    results = {"inverters": n, "latency_ms": args.latency, "jitter_ms": args.jitter,
+               "idle_cpu": idle}
+
+    # clean
+    sim.reset()
+    c0, t0 = cpu_seconds(pid), time.perf_counter()
+    await asyncio.sleep(args.duration)
+    elapsed = time.perf_counter() - t0
+    cpu = cpu_seconds(pid) - c0 - idle * elapsed
+    ticks, offset = slow_ticks(stderr, offset)
+    answered = sim.counts.get("answered", 0)
+    rows = cadence(sim)
+    print(f"\nclean, {args.duration:.0f}s:")
+    print(f"  {'function':>13} {'profile':>9} {'asks ms':>8} {'p50 ms':>8} {'p99 ms':>8} {'polls/s':>8}")
+    for name, r in rows.items():
+        print(f"  {name:>13} {r['frequency']:>9} {r['expect_ms']:8.0f} {r['p50_ms']:8.1f} "
+              f"{r['p99_ms']:8.1f} {r['samples'] / elapsed:8.1f}")
+    per_frame = cpu / answered * 1e6 if answered else 0.0
+    print(f"  answered {answered / elapsed:.1f}/s, openwatt cpu {cpu / elapsed * 100:.1f}% over idle "
+          f"({idle * 100:.1f}%), {per_frame:.0f} us per answered frame, {len(ticks)} slow ticks")
+    results["clean"] = {"cadence": rows, "answered_per_s": answered / elapsed,
+                        "cpu_us_per_frame": per_frame, "slow_ticks": len(ticks)}
+
+    # corrupt
+    if args.corrupt:
+        sim.reset()
+        sim.corrupt = args.corrupt
+        t0 = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        elapsed = time.perf_counter() - t0
+        sim.corrupt = 0.0
+        ticks, offset = slow_ticks(stderr, offset)
+        spoiled, gaps = sim.counts.get("corrupted", 0), sim.gaps
+        good = sim.counts.get("answered", 0)
+        print(f"\ncorrupt {args.corrupt:.0%} ({','.join(args.faults)}), {args.duration:.0f}s:")
+        print(f"  {spoiled} spoiled, {good / elapsed:.1f} good answers/s "
+              f"({good / elapsed / max(answered / args.duration, 1e-9) * 100:.0f}% of clean)")
+        if gaps:
+            print(f"  spoiled answer to next request: p50 {percentile(gaps, 50) * 1000:.0f} ms, "
+                  f"p99 {percentile(gaps, 99) * 1000:.0f} ms, {len(gaps)} retried")
+        print(f"  handshakes {sim.counts.get('handshakes', 0)}, {len(ticks)} slow ticks")
+        results["corrupt"] = {"fraction": args.corrupt, "faults": args.faults, "spoiled": spoiled,
+                              "good_per_s": good / elapsed, "retry_p50_ms": percentile(gaps, 50, 0.0) * 1000,
+                              "retry_p99_ms": percentile(gaps, 99, 0.0) * 1000,
+                              "handshakes": sim.counts.get("handshakes", 0),
+                              "slow_ticks": len(ticks)}
+
+    # outage
+    if args.outage:
+        sim.reset()
+        await asyncio.sleep(1.0)
+        sim.silent = True
+        await asyncio.sleep(args.outage)
+        sim.silent = False
+        sim.outage_end = time.perf_counter()
+        asked = sim.counts.get("unanswered", 0)
+        deadline = sim.outage_end + args.timeout
+        while (any(inv.recovered is None for inv in sim.inverters)
+               and time.perf_counter() < deadline):
+            await asyncio.sleep(0.1)
+        rec = sorted(inv.recovered for inv in sim.inverters if inv.recovered is not None)
+        ticks, offset = slow_ticks(stderr, offset)
+        print(f"\noutage {args.outage:.0f}s: {asked} requests unanswered, "
+              f"{sim.counts.get('handshakes', 0)} handshakes")
+        if rec:
+            print(f"  recovered {len(rec)}/{n}: p50 {percentile(rec, 50) * 1000:.0f} ms, "
+                  f"max {rec[-1] * 1000:.0f} ms after the inverters came back")
+        else:
+            print(f"  none recovered within {args.timeout:.0f}s")
+        print(f"  {len(ticks)} slow ticks")
+        results["outage"] = {"seconds": args.outage, "recovered": len(rec),
+                             "recovery_p50_ms": percentile(rec, 50, 0.0) * 1000,
+                             "recovery_max_ms": rec[-1] * 1000 if rec else None,
+                             "handshakes": sim.counts.get("handshakes", 0),
+                             "slow_ticks": len(ticks)}
+
+    if not ow.is_running():
+        print("openwatt exited", file=sys.stderr)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"wrote {args.json}")
+    sim.close()
+    return 0
+
+
+async def serve(args):
+    sim = Sim(args)
+    await sim.start()
+    print(f"{len(sim.inverters)} inverters on {sim.inverters[0].host}.."
+          f"{sim.inverters[-1].host}:{args.port}")
+    while True:
+        await asyncio.sleep(args.interval)
+        c = sim.counts
+        iv = " ".join(f"{FN_NAMES.get(fn, fn)} p50 {percentile(v, 50) * 1000:.0f}ms"
+                      for fn, v in sorted(sim.intervals.items()))
+        print(f"requests/s {c.get('requests', 0) / args.interval:7.1f}  answered "
+              f"{c.get('answered', 0)}  corrupted {c.get('corrupted', 0)}  dropped "
+              f"{c.get('dropped', 0)}  handshakes {c.get('handshakes', 0)}  {iv}")
+        sim.reset()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--inverters", type=int, default=10)
+    ap.add_argument("--host", default="127.0.0.2", help="first inverter's address")
+    ap.add_argument("--port", type=int, default=8899)
+    ap.add_argument("--latency", type=float, default=0.0, help="ms before every answer")
+    ap.add_argument("--jitter", type=float, default=0.0, help="up to this many ms more")
+    ap.add_argument("--drop", type=float, default=0.0, help="fraction of answers lost")
+    ap.add_argument("--corrupt", type=float, default=0.05, help="fraction of read answers spoiled")
+    ap.add_argument("--faults", type=lambda s: s.split(","), default=list(FAULTS),
+                    help="ways to spoil them: " + ",".join(FAULTS))
+    ap.add_argument("--start", nargs="?", const="bin/x86_64_debug/openwatt", metavar="BINARY",
+                    help="start OpenWatt, add a client and binding per inverter, run the phases")
+    ap.add_argument("--duration", type=float, default=20.0, help="seconds of the clean and corrupt phases")
+    ap.add_argument("--outage", type=float, default=12.0, help="seconds of silence; 0 skips it")
+    ap.add_argument("--settle", type=float, default=2.0)
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--interval", type=float, default=5.0, help="stats interval without --start")
+    ap.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = ap.parse_args()
+    bad = set(args.faults) - set(FAULTS)
+    if bad:
+        ap.error(f"unknown fault(s): {','.join(bad)}")
+
+    if not args.start:
+        try:
+            asyncio.run(serve(args))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    ow = openwatt(args.start, "goodwe_sim")
+    with generated_profile(ow, PROFILE, profile_text()):
+        if not ow.start():
+            return 1
+        try:
+            return asyncio.run(run(args, ow))
+        finally:
+            ow.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
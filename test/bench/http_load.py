@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""Load OpenWatt's HTTP server the way a room full of dashboard tabs would.
+
+Each client is a browser tab: --conns connections of its own, making a
+--mix of requests back to back (or --think ms apart):
+
+    static      GET of a fileserver file, sizes from --sizes (files over
+                64 KiB are streamed by fileserver.d rather than buffered)
+    api         apps/api reads: /health, /list and /get of --api-paths
+    ws          a websocket upgrade on a fresh connection, a ping, a close
+
+Every step of --clients is run in each --modes:
+
+    close       a new connection per request (Connection: close)
+    keepalive   requests reuse each connection, one in flight
+    pipeline    requests reuse each connection, --depth written at once
+
+and reports requests/s, throughput, p50/p99 latency by kind, connections
+opened and what each cost (connect time, and the first request on a new
+connection against one on a warm connection), and errors. Static bodies
+are checked byte for byte, so a response that arrives interleaved with
+another counts as an error rather than as throughput.
+
+With --start OpenWatt is started through the harness and given an HTTP
+server on --port with a fileserver over a temporary directory of the
+--sizes files, the API at /api and a websocket server at /ws; its CPU time
+and resident set are sampled per step. Without it, --static names the
+files to fetch from whatever is listening (sizes are then not checked).
+
+  python3 test/bench/http_load.py [--host H] [--port 8080] [--start [BINARY]]
+      [--clients 1,10,50,200] [--modes close,keepalive,pipeline] [--depth 4]
+      [--mix static=60,api=35,ws=5] [--sizes 1k,16k,64k,256k,1m] [--json PATH]
+"""
+
+import argparse
+import asyncio
+import base64
+import collections
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from common import cpu_seconds, ms, openwatt, percentile, raise_fd_limit, rss_kb, send_all
+
+KINDS = ("static", "api", "ws")
+MODES = ("close", "keepalive", "pipeline")
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    scale = {"k": 1024, "m": 1024 * 1024}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * scale)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"unknown kind '{kind}' (use {', '.join(KINDS)})")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def content(size):
+    """The bytes of the bench file of this size; a different pattern per size."""
+    block = hashlib.sha256(str(size).encode()).digest() * 32
+    return (block * (size // len(block) + 1))[:size]
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Conn:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.requests = 0
+
+    @classmethod
+    async def open(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    def close(self):
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+    async def response(self):
+        """(status, headers, body) of the next response on the connection."""
+        try:
+            head = await self.reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            raise ProtocolError("closed" if not e.partial else "truncated head")
+        except asyncio.LimitOverrunError:
+            raise ProtocolError("oversized head")
+        lines = head.decode("latin-1").split("\r\n")
+        parts = lines[0].split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+            raise ProtocolError("bad status line")
+        status = int(parts[1])
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+        if status == 101 or status in (204, 304):
+            return status, headers, b""
+        try:
+            if "content-length" in headers:
+                body = await self.reader.readexactly(int(headers["content-length"]))
+            elif headers.get("transfer-encoding", "").lower() == "chunked":
+                body = bytearray()
+                while True:
+                    size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                    if size == 0:
+                        await self.reader.readuntil(b"\r\n")
+                        break
+                    body += await self.reader.readexactly(size + 2)
+                    del body[-2:]
+                body = bytes(body)
+            else:
+                body = await self.reader.read()
+        except (asyncio.IncompleteReadError, ValueError):
+            raise ProtocolError("truncated body")
+        return status, headers, body
+
+
+class Step:
+    """What one (mode, clients) run measured."""
+
+    def __init__(self):
+        self.latency = collections.defaultdict(list)   # kind -> [s]
+        self.count = collections.Counter()
+        self.bytes = 0
+        self.errors = collections.Counter()
+        self.connects = []       # s to establish
+        self.first = []          # s for the first request on a new connection
+        self.warm = []           # s for a request on a reused connection
+        self.ws_ping = []
+
+
+class Workload:
+    def __init__(self, args, statics):
+        self.args = args
+        self.statics = statics   # [(path, expected bytes or None)]
+        self.kinds = [k for k in KINDS if args.mix.get(k)]
+        self.weights = [args.mix[k] for k in self.kinds]
+        self.http_kinds = [k for k in self.kinds if k != "ws"]
+        self.http_weights = [args.mix[k] for k in self.http_kinds]
+        body = json.dumps({"paths": args.api_paths}).encode()
+        self.api = [("GET", f"{args.api}/health", b""),
+                    ("POST", f"{args.api}/list", json.dumps({"shallow": True}).encode()),
+                    ("POST", f"{args.api}/get", body)]
+
+    def request(self, rng, kind, close=False):
+        host = f"{self.args.host}:{self.args.port}"
+        conn = "close" if close else "keep-alive"
+        if kind == "static":
+            path, expect = rng.choice(self.statics)
+            return kind, expect, (f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: {conn}\r\n"
+                                  f"Accept: */*\r\n\r\n").encode()
+        method, path, body = rng.choice(self.api)
+        head = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nConnection: {conn}\r\n"
+        if body:
+            head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        return kind, None, (head + "\r\n").encode() + body
+
+    def check(self, step, kind, expect, status, body):
+        if status != 200:
+            step.errors[f"{kind} {status}"] += 1
+            return False
+        if expect is not None and body != expect:
+            step.errors["static body mismatch"] += 1
+            return False
+        step.bytes += len(body)
+        return True
+
+
+async def websocket(args, rng, step):
+    t = time.perf_counter()
+    try:
+        conn = await asyncio.wait_for(Conn.open(args.host, args.port), args.timeout)
+    except (OSError, asyncio.TimeoutError):
+        step.errors["ws connect"] += 1
+        return
+    step.connects.append(time.perf_counter() - t)
+    key = base64.b64encode(rng.randbytes(16))
+    try:
+        conn.writer.write(f"GET {args.ws} HTTP/1.1\r\nHost: {args.host}:{args.port}\r\nUpgrade: websocket\r\n"
+                          f"Connection: Upgrade\r\nSec-WebSocket-Key: {key.decode()}\r\n"
+                          f"Sec-WebSocket-Version: 13\r\n\r\n".encode())
+        status, headers, _ = await asyncio.wait_for(conn.response(), args.timeout)
+        accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest()).decode()
+        if status != 101 or headers.get("sec-websocket-accept") != accept:
+            step.errors[f"ws upgrade {status}"] += 1
+            return
+        step.latency["ws"].append(time.perf_counter() - t)
+        step.count["ws"] += 1
+        mask = rng.randbytes(4)
+        payload = b"bench"
+        tp = time.perf_counter()
+        conn.writer.write(bytes((0x89, 0x80 | len(payload))) + mask
+                          + bytes(b ^ mask[i & 3] for i, b in enumerate(payload)))
+        hdr = await asyncio.wait_for(conn.reader.readexactly(2), args.timeout)
+        pong = await asyncio.wait_for(conn.reader.readexactly(hdr[1] & 0x7F), args.timeout)
+        if hdr[0] & 0x0F != 0x0A or pong != payload:
+            step.errors["ws pong"] += 1
+        else:
+            step.ws_ping.append(time.perf_counter() - tp)
+        conn.writer.write(bytes((0x88, 0x82)) + mask + bytes(b ^ mask[i & 3] for i, b in enumerate(b"\x03\xe8")))
+        await conn.writer.drain()
+    except (OSError, ProtocolError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+        step.errors[f"ws {type(e).__name__}"] += 1
+    finally:
+        conn.close()
+
+
+async def worker(args, load, mode, step, deadline, seed):
+    rng = random.Random(seed)
+    conn = None
+    depth = args.depth if mode == "pipeline" else 1
+    while time.perf_counter() < deadline:
+        if rng.choices(load.kinds, load.weights)[0] == "ws":
+            await websocket(args, rng, step)
+        elif load.http_kinds:
+            batch = [load.request(rng, rng.choices(load.http_kinds, load.http_weights)[0], mode == "close")
+                     for _ in range(depth)]
+            fresh = conn is None
+            if fresh:
+                t = time.perf_counter()
+                try:
+                    conn = await asyncio.wait_for(Conn.open(args.host, args.port), args.timeout)
+                except (OSError, asyncio.TimeoutError):
+                    step.errors["connect"] += 1
+                    await asyncio.sleep(0.1)
+                    continue
+                step.connects.append(time.perf_counter() - t)
+            t = time.perf_counter()
+            conn.writer.write(b"".join(req for _, _, req in batch))
+            try:
+                for i, (kind, expect, _) in enumerate(batch):
+                    status, _, body = await asyncio.wait_for(conn.response(), args.timeout)
+                    took = time.perf_counter() - t
+                    if load.check(step, kind, expect, status, body):
+                        step.latency[kind].append(took)
+                        step.count[kind] += 1
+                        if depth == 1:
+                            (step.first if fresh else step.warm).append(took)
+                conn.requests += len(batch)
+            except (OSError, ProtocolError, asyncio.TimeoutError) as e:
+                step.errors[str(e) if isinstance(e, ProtocolError) else type(e).__name__] += 1
+                conn.close()
+                conn = None
+                continue
+            if mode == "close":
+                conn.close()
+                conn = None
+        if args.think:
+            await asyncio.sleep(rng.expovariate(1000 / args.think))
+    if conn:
+        conn.close()
+
+
+async def run_step(args, load, mode, clients, pid):
+    step = Step()
+    deadline = time.perf_counter() + args.duration
+    cpu = cpu_seconds(pid) if pid else None
+    t = time.perf_counter()
+    await asyncio.gather(*(worker(args, load, mode, step, deadline, args.seed * 100003 + c * 31 + w)
+                           for c in range(clients) for w in range(args.conns)))
+    elapsed = time.perf_counter() - t
+    total = sum(step.count.values())
+    row = {"mode": mode, "clients": clients, "seconds": elapsed, "requests": total,
+           "rps": total / elapsed, "mbytes_per_s": step.bytes / elapsed / 1e6,
+           "errors": dict(step.errors), "connections": len(step.connects),
+           "connect_ms": percentile(step.connects, 50) * 1000,
+           "first_ms": percentile(step.first, 50) * 1000, "warm_ms": percentile(step.warm, 50) * 1000,
+           "kinds": {k: {"count": step.count[k], "p50_ms": percentile(v, 50) * 1000,
+                         "p99_ms": percentile(v, 99) * 1000} for k, v in step.latency.items()}}
+    if step.ws_ping:
+        row["ws_ping_ms"] = percentile(step.ws_ping, 50) * 1000
+    if pid:
+        row["cpu_pct"] = (cpu_seconds(pid) - cpu) / elapsed * 100
+        row["rss_kb"] = rss_kb(pid)
+    return row
+
+
+def print_row(row):
+    kinds = row["kinds"]
+    lat = lambda k, p: ms(kinds[k][p] / 1000) if k in kinds else f"{'-':>8}"
+    errors = sum(row["errors"].values())
+    print(f"{row['mode']:>9} {row['clients']:7} {row['rps']:8.0f} {row['mbytes_per_s']:7.1f} "
+          f"{lat('static', 'p50_ms')} {lat('static', 'p99_ms')} {lat('api', 'p50_ms')} {lat('api', 'p99_ms')} "
+          f"{lat('ws', 'p50_ms')} {row['connections']:6} {ms(row['connect_ms'] / 1000)} "
+          f"{ms(row['first_ms'] / 1000)} {ms(row['warm_ms'] / 1000)} {errors:6}"
+          + (f" {row['cpu_pct']:5.0f}% {row['rss_kb']:7}" if "cpu_pct" in row else ""))
+
+
+async def run(args, pid, statics):
+    load = Workload(args, statics)
+    results = {"mix": args.mix, "conns": args.conns, "depth": args.depth, "duration": args.duration,
+               "statics": [p for p, _ in statics], "steps": []}
+    print(f"{len(statics)} static paths, mix {','.join(f'{k}={v:g}' for k, v in args.mix.items())}, "
+          f"{args.conns} connection(s) per client, pipeline depth {args.depth}, {args.duration:g}s per step")
+    print(f"\n{'mode':>9} {'clients':>7} {'req/s':>8} {'MB/s':>7} {'static50':>8} {'static99':>8} "
+          f"{'api50':>8} {'api99':>8} {'ws50':>8} {'conns':>6} {'connect':>8} {'first':>8} {'warm':>8} "
+          f"{'errors':>6}" + (f" {'cpu':>6} {'rss kB':>7}" if pid else ""))
+    for clients in args.clients:
+        for mode in args.modes:
+            row = await run_step(args, load, mode, clients, pid)
+            print_row(row)
+            results["steps"].append(row)
+            if row["errors"]:
+                print("          " + ", ".join(f"{k} {v}" for k, v in sorted(row["errors"].items())))
+            await asyncio.sleep(args.settle)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {args.json}")
+    return 0
+
+
+def make_root(sizes):
+    root = tempfile.mkdtemp(prefix="http_load_")
+    statics = []
+    for size in sizes:
+        name = f"bench_{size}.bin"
+        data = content(size)
+        with open(os.path.join(root, name), "wb") as f:
+            f.write(data)
+        statics.append((f"/{name}", data))
+    return root, statics
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--start", nargs="?", const="bin/x86_64_debug/openwatt", metavar="BINARY",
+                    help="start OpenWatt and add a server, fileserver, API and websocket server on --port")
+    ap.add_argument("--clients", type=lambda s: [int(n) for n in s.split(",") if n], default=[1, 10, 50, 200],
+                    metavar="N,N,...", help="concurrent clients, one step each")
+    ap.add_argument("--modes", type=lambda s: s.split(","), default=list(MODES),
+                    metavar="M,M,...", help="connection handling: " + ",".join(MODES))
+    ap.add_argument("--conns", type=int, default=2, help="connections per client")
+    ap.add_argument("--depth", type=int, default=4, help="requests in flight per connection when pipelining")
+    ap.add_argument("--mix", type=parse_mix, default=parse_mix("static=60,api=35,ws=5"),
+                    help="relative weights of the request kinds: " + ", ".join(KINDS))
+    ap.add_argument("--sizes", type=lambda s: [parse_size(n) for n in s.split(",") if n],
+                    default=[parse_size(n) for n in ("1k", "16k", "64k", "256k", "1m")],
+                    metavar="S,S,...", help="static file sizes (with --start)")
+    ap.add_argument("--static", type=lambda s: s.split(","), default=["/"], metavar="PATH,...",
+                    help="static paths to fetch (without --start)")
+    ap.add_argument("--api", default="/api", help="API uri")
+    ap.add_argument("--api-paths", type=lambda s: s.split(","), default=["*"], metavar="PATH,...",
+                    help="element paths for /get")
+    ap.add_argument("--ws", default="/ws", help="websocket uri")
+    ap.add_argument("--think", type=float, default=0.0, help="mean ms between a connection's requests")
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds per step")
+    ap.add_argument("--settle", type=float, default=1.0)
+    ap.add_argument("--timeout", type=float, default=10.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = ap.parse_args()
+    bad = [m for m in args.modes if m not in MODES]
+    if bad:
+        ap.error(f"unknown mode(s) {','.join(bad)}")
+    raise_fd_limit(max(args.clients) * (args.conns + 1) + 64)
+
+    ow = root = None
+    statics = [(p, None) for p in args.static]
+    if args.start:
+        root, statics = make_root(args.sizes)
+        ow = openwatt(args.start, "http_load")
+    try:
+        if ow:
+            if not ow.start():
+                return 1
+            send_all(ow.get_console(), (
+                f"/protocol/http/server/add name=bench-http port={args.port}",
+                f"/protocol/http/fileserver/add name=bench-files http-server=bench-http uri=/ root=\"{root}\"",
+                f"/apps/api/add name=bench-api http-server=bench-http uri={args.api}",
+                f"/protocol/websocket/server/add name=bench-ws http-server=bench-http uri={args.ws}"))
+            time.sleep(1.0)
+        return asyncio.run(run(args, ow.process.pid if ow else None, statics))
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        if ow:
+            ow.stop()
+        if root:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""Just enough MQTT 3.1.1 over asyncio for the broker benchmarks here.
+
+Not a general client: no reconnect, no persistence, no TLS, no v5
+properties. What it does have is byte counters on every connection and
+acks surfaced as futures, which is what the load tools need and what the
+usual libraries hide.
+
+    import mqtt
+    c = await mqtt.Client.open("localhost", 1883, "bench-1")
+    await c.subscribe([("openwatt/#", 0)])
+    await c.publish("openwatt/x", b"1", qos=1)
+"""
+
+import asyncio
+import struct
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = range(1, 8)
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = range(8, 15)
+
+NAMES = {CONNECT: "CONNECT", CONNACK: "CONNACK", PUBLISH: "PUBLISH", PUBACK: "PUBACK",
+         PUBREC: "PUBREC", PUBREL: "PUBREL", PUBCOMP: "PUBCOMP", SUBSCRIBE: "SUBSCRIBE",
+         SUBACK: "SUBACK", UNSUBSCRIBE: "UNSUBSCRIBE", UNSUBACK: "UNSUBACK",
+         PINGREQ: "PINGREQ", PINGRESP: "PINGRESP", DISCONNECT: "DISCONNECT"}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def varint(n):
+    out = bytearray()
+    while True:
+        b, n = n & 0x7F, n >> 7
+        out.append(b | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def utf8(s):
+    b = s.encode() if isinstance(s, str) else s
+    return struct.pack(">H", len(b)) + b
+
+
+def packet(kind, flags, body=b""):
+    return bytes([kind << 4 | flags]) + varint(len(body)) + body
+
+
+async def read_packet(reader):
+    """(kind, flags, body, bytes on the wire); EOF raises IncompleteReadError."""
+    head = await reader.readexactly(1)
+    n, shift, used = 0, 0, 1
+    while True:
+        b = (await reader.readexactly(1))[0]
+        used += 1
+        n |= (b & 0x7F) << shift
+        if not b & 0x80:
+            break
+        shift += 7
+        if shift > 21:
+            raise ProtocolError("remaining length over 4 bytes")
+    body = await reader.readexactly(n) if n else b""
+    return head[0] >> 4, head[0] & 0x0F, body, used + n
+
+
+def connect(client_id, keepalive=60, clean=True, username=None, password=None, will=None):
+    """will, if given, is (topic, payload, qos, retain)."""
+    flags = 0x02 if clean else 0
+    tail = utf8(client_id)
+    if will:
+        topic, payload, qos, retain = will
+        flags |= 0x04 | qos << 3 | (0x20 if retain else 0)
+        tail += utf8(topic) + utf8(payload)
+    if username is not None:
+        flags |= 0x80
+        tail += utf8(username)
+    if password is not None:
+        flags |= 0x40
+        tail += utf8(password)
+    return packet(CONNECT, 0, utf8("MQTT") + bytes([4, flags]) + struct.pack(">H", keepalive) + tail)
+
+
+def parse_connect(body):
+    """(client_id, clean, keepalive, will or None) from a CONNECT body."""
+    n = struct.unpack_from(">H", body)[0]
+    level, flags = body[2 + n], body[3 + n]
+    keepalive = struct.unpack_from(">H", body, 4 + n)[0]
+    pos = 6 + n
+    fields = []
+    for present in (True, flags & 0x04, flags & 0x04, flags & 0x80, flags & 0x40):
+        if present:
+            m = struct.unpack_from(">H", body, pos)[0]
+            fields.append(body[pos + 2:pos + 2 + m])
+            pos += 2 + m
+        else:
+            fields.append(None)
+    if level not in (3, 4, 5):
+        raise ProtocolError(f"protocol level {level}")
+    will = None
+    if flags & 0x04:
+        will = (fields[1].decode(), fields[2], flags >> 3 & 3, bool(flags & 0x20))
+    return fields[0].decode(), bool(flags & 0x02), keepalive, will
+
+
+def publish(topic, payload, qos=0, retain=False, packet_id=0, dup=False):
+    body = utf8(topic) + (struct.pack(">H", packet_id) if qos else b"") + payload
+    return packet(PUBLISH, (0x08 if dup else 0) | qos << 1 | (1 if retain else 0), body)
+
+
+def parse_publish(flags, body):
+    """(topic, payload, qos, retain, packet_id)"""
+    n = struct.unpack_from(">H", body)[0]
+    topic = body[2:2 + n].decode()
+    qos = flags >> 1 & 3
+    pos = 2 + n
+    packet_id = 0
+    if qos:
+        packet_id = struct.unpack_from(">H", body, pos)[0]
+        pos += 2
+    return topic, body[pos:], qos, bool(flags & 1), packet_id
+
+
+def ack(kind, packet_id):
+    return packet(kind, 0x02 if kind == PUBREL else 0, struct.pack(">H", packet_id))
+
+
+def subscribe(packet_id, filters):
+    body = struct.pack(">H", packet_id)
+    for f, qos in filters:
+        body += utf8(f) + bytes([qos])
+    return packet(SUBSCRIBE, 0x02, body)
+
+
+def parse_subscribe(body):
+    """(packet_id, [(filter, qos)])"""
+    packet_id = struct.unpack_from(">H", body)[0]
+    pos, filters = 2, []
+    while pos < len(body):
+        n = struct.unpack_from(">H", body, pos)[0]
+        filters.append((body[pos + 2:pos + 2 + n].decode(), body[pos + 2 + n] & 3))
+        pos += 3 + n
+    return packet_id, filters
+
+
+def matches(filter, topic):
+    """MQTT topic filter match, including the $-topic rule for root wildcards."""
+    if topic.startswith("$") and filter[:1] in ("+", "#"):
+        return False
+    f, t = filter.split("/"), topic.split("/")
+    for i, level in enumerate(f):
+        if level == "#":
+            return True
+        if i >= len(t) or (level != "+" and level != t[i]):
+            return False
+    return len(f) == len(t)
+
+
+class Client:
+    """One connection. Incoming publishes go to on_message(client, topic,
+    payload, qos, retain); QoS 1/2 from the broker are acked here."""
+
+    def __init__(self, reader, writer, client_id):
+        self.reader, self.writer = reader, writer
+        self.client_id = client_id
+        self.on_message = None
+        self.bytes_in = self.bytes_out = 0
+        self.pending = {}
+        self.next_id = 0
+        self.closed = asyncio.get_running_loop().create_future()
+        self.task = None
+
+    @classmethod
+    async def open(cls, host, port, client_id, keepalive=60, clean=True, timeout=10.0, **kw):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        c = cls(reader, writer, client_id)
+        c.send(connect(client_id, keepalive, clean, **kw))
+        kind, _, body, n = await asyncio.wait_for(read_packet(reader), timeout)
+        c.bytes_in += n
+        if kind != CONNACK or len(body) < 2:
+            writer.close()
+            raise ProtocolError(f"{client_id}: expected CONNACK, got {NAMES.get(kind, kind)}")
+        if body[1]:
+            writer.close()
+            raise ProtocolError(f"{client_id}: connection refused, code {body[1]}")
+        c.task = asyncio.ensure_future(c._run())
+        return c
+
+    def send(self, data):
+        self.bytes_out += len(data)
+        self.writer.write(data)
+
+    def _id(self):
+        self.next_id = self.next_id % 0xFFFF + 1
+        return self.next_id
+
+    def _expect(self, packet_id):
+        fut = asyncio.get_running_loop().create_future()
+        self.pending[packet_id] = fut
+        return fut
+
+    async def _run(self):
+        try:
+            while True:
+                kind, flags, body, n = await read_packet(self.reader)
+                self.bytes_in += n
+                if kind == PUBLISH:
+                    topic, payload, qos, retain, packet_id = parse_publish(flags, body)
+                    if qos == 1:
+                        self.send(ack(PUBACK, packet_id))
+                    elif qos == 2:
+                        self.send(ack(PUBREC, packet_id))
+                    if self.on_message:
+                        self.on_message(self, topic, payload, qos, retain)
+                elif kind == PUBREL:
+                    self.send(ack(PUBCOMP, struct.unpack(">H", body)[0]))
+                elif kind == PUBREC:
+                    packet_id = struct.unpack(">H", body)[0]
+                    self.send(ack(PUBREL, packet_id))
+                elif kind in (PUBACK, PUBCOMP, SUBACK, UNSUBACK):
+                    fut = self.pending.pop(struct.unpack_from(">H", body)[0], None)
+                    if fut and not fut.done():
+                        fut.set_result(body[2:])
+        except (asyncio.IncompleteReadError, ConnectionError, ProtocolError) as e:
+            if not self.closed.done():
+                self.closed.set_result(e)
+        finally:
+            for fut in self.pending.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError(f"{self.client_id}: connection lost"))
+            self.pending.clear()
+
+    async def subscribe(self, filters):
+        """Granted QoS per filter (0x80 = refused)."""
+        packet_id = self._id()
+        fut = self._expect(packet_id)
+        self.send(subscribe(packet_id, filters))
+        return list(await fut)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """None for QoS 0, else a future that completes on PUBACK/PUBCOMP."""
+        if not qos:
+            self.send(publish(topic, payload, 0, retain))
+            return None
+        packet_id = self._id()
+        fut = self._expect(packet_id)
+        self.send(publish(topic, payload, qos, retain, packet_id))
+        return fut
+
+    async def close(self):
+        try:
+            self.send(packet(DISCONNECT, 0))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+        if self.task:
+            self.task.cancel()
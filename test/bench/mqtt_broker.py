@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""A small MQTT 3.1.1 broker to stand in for the real one in benchmarks.
+
+Wildcard subscriptions through a topic trie, retained messages, QoS 0/1/2
+both ways (outbound at the lower of the publish and subscription QoS),
+clean sessions only. Every connection counts its bytes, and every publish
+it receives can be handed to a hook with its arrival time, which is what
+the discovery-storm benchmark measures against.
+
+Standalone, it just runs and prints a summary line per interval:
+
+  python3 test/bench/mqtt_broker.py [--host H] [--port 1883] [--interval S]
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+import mqtt
+
+
+class Trie:
+    """filter levels -> {session: qos}"""
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, filter, session, qos):
+        node = self.root
+        for level in filter.split("/"):
+            node = node.setdefault(level, {})
+        node.setdefault(None, {})[session] = qos
+
+    def remove(self, filter, session):
+        node = self.root
+        for level in filter.split("/"):
+            node = node.get(level)
+            if node is None:
+                return
+        node.get(None, {}).pop(session, None)
+
+    def match(self, topic):
+        """{session: max qos} over every filter the topic matches."""
+        out = {}
+        levels = topic.split("/")
+        dollar = topic.startswith("$")
+
+        def merge(subs):
+            for s, q in subs.items():
+                if out.get(s, -1) < q:
+                    out[s] = q
+
+        def walk(node, i):
+            if "#" in node and not (dollar and i == 0):
+                merge(node["#"].get(None, {}))
+            if i == len(levels):
+                merge(node.get(None, {}))
+                return
+            if levels[i] in node:
+                walk(node[levels[i]], i + 1)
+            if "+" in node and not (dollar and i == 0):
+                walk(node["+"], i + 1)
+
+        walk(self.root, 0)
+        return out
+
+
+class Session:
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader, self.writer = reader, writer
+        self.client_id = None
+        self.filters = set()
+        self.will = None
+        self.next_id = 0
+        self.inbound_qos2 = {}
+        self.bytes_in = self.bytes_out = 0
+        self.connected_at = time.perf_counter()
+
+    def send(self, data):
+        self.bytes_out += len(data)
+        self.broker.bytes_out += len(data)
+        self.writer.write(data)
+
+    def deliver(self, topic, payload, qos, retain):
+        packet_id = 0
+        if qos:
+            self.next_id = self.next_id % 0xFFFF + 1
+            packet_id = self.next_id
+        self.send(mqtt.publish(topic, payload, qos, retain, packet_id))
+
+    async def run(self):
+        b = self.broker
+        try:
+            kind, _, body, n = await asyncio.wait_for(mqtt.read_packet(self.reader), 10)
+            self.bytes_in += n
+            b.bytes_in += n
+            if kind != mqtt.CONNECT:
+                return
+            self.client_id, _, _, self.will = mqtt.parse_connect(body)
+            old = b.sessions.get(self.client_id)
+            if old:
+                old.writer.close()
+            b.sessions[self.client_id] = self
+            b.connects += 1
+            self.send(mqtt.packet(mqtt.CONNACK, 0, b"\0\0"))
+            if b.on_connect:
+                b.on_connect(self)
+            while True:
+                kind, flags, body, n = await mqtt.read_packet(self.reader)
+                self.bytes_in += n
+                b.bytes_in += n
+                if kind == mqtt.PUBLISH:
+                    topic, payload, qos, retain, packet_id = mqtt.parse_publish(flags, body)
+                    if qos == 2:
+                        if packet_id not in self.inbound_qos2:
+                            self.inbound_qos2[packet_id] = (topic, payload, retain)
+                        self.send(mqtt.ack(mqtt.PUBREC, packet_id))
+                        continue
+                    if qos == 1:
+                        self.send(mqtt.ack(mqtt.PUBACK, packet_id))
+                    b.route(self, topic, payload, qos, retain, n)
+                elif kind == mqtt.PUBREL:
+                    packet_id = int.from_bytes(body[:2], "big")
+                    held = self.inbound_qos2.pop(packet_id, None)
+                    self.send(mqtt.ack(mqtt.PUBCOMP, packet_id))
+                    if held:
+                        b.route(self, held[0], held[1], 2, held[2], len(held[1]))
+                elif kind == mqtt.PUBREC:
+                    self.send(mqtt.ack(mqtt.PUBREL, int.from_bytes(body[:2], "big")))
+                elif kind == mqtt.SUBSCRIBE:
+                    packet_id, filters = mqtt.parse_subscribe(body)
+                    for f, qos in filters:
+                        self.filters.add(f)
+                        b.trie.add(f, self, qos)
+                        if b.on_subscribe:
+                            b.on_subscribe(self, f, qos)
+                    self.send(mqtt.packet(mqtt.SUBACK, 0, body[:2] + bytes(q for _, q in filters)))
+                    for f, qos in filters:
+                        for topic, payload, rqos in b.retained_matching(f):
+                            self.deliver(topic, payload, min(qos, rqos), True)
+                            b.retained_sent += 1
+                elif kind == mqtt.UNSUBSCRIBE:
+                    pos = 2
+                    while pos < len(body):
+                        m = int.from_bytes(body[pos:pos + 2], "big")
+                        f = body[pos + 2:pos + 2 + m].decode()
+                        self.filters.discard(f)
+                        b.trie.remove(f, self)
+                        pos += 2 + m
+                    self.send(mqtt.packet(mqtt.UNSUBACK, 0, body[:2]))
+                elif kind == mqtt.PINGREQ:
+                    self.send(mqtt.packet(mqtt.PINGRESP, 0))
+                elif kind == mqtt.DISCONNECT:
+                    self.will = None
+                    return
+                await self.writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.CancelledError,
+                ConnectionError, mqtt.ProtocolError):
+            pass
+        finally:
+            for f in self.filters:
+                b.trie.remove(f, self)
+            if b.sessions.get(self.client_id) is self:
+                del b.sessions[self.client_id]
+            if self.will:
+                topic, payload, qos, retain = self.will
+                b.route(self, topic, payload, qos, retain, len(payload))
+            self.writer.close()
+            if b.on_disconnect and self.client_id is not None:
+                b.on_disconnect(self)
+
+
+class Broker:
+    """on_publish(session, topic, payload, retain, wire_bytes, t) sees every
+    publish routed, on_subscribe(session, filter, qos) every filter, and
+    on_connect/on_disconnect(session) every session."""
+
+    def __init__(self):
+        self.trie = Trie()
+        self.sessions = {}
+        self.retained = {}
+        self.retained_tree = {}
+        self.server = None
+        self.on_publish = self.on_subscribe = self.on_connect = self.on_disconnect = None
+        self.bytes_in = self.bytes_out = 0
+        self.publishes = self.deliveries = self.retained_sent = self.connects = 0
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await asyncio.start_server(
+            lambda r, w: Session(self, r, w).run(), host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    def retain(self, topic, payload, qos=0):
+        """Store (or with an empty payload, clear) a retained message."""
+        node = self.retained_tree
+        for level in topic.split("/"):
+            node = node.setdefault(level, {})
+        if payload:
+            self.retained[topic] = (payload, qos)
+            node[None] = topic
+        else:
+            self.retained.pop(topic, None)
+            node.pop(None, None)
+
+    def retained_matching(self, filter):
+        """(topic, payload, qos) of every retained message the filter matches."""
+        levels = filter.split("/")
+        found = []
+
+        def everything(node):
+            for key, child in node.items():
+                if key is None:
+                    found.append(child)
+                else:
+                    everything(child)
+
+        def walk(node, i, root):
+            if i == len(levels):
+                if None in node:
+                    found.append(node[None])
+                return
+            level = levels[i]
+            if level == "#":
+                for key, child in node.items():
+                    if key is None:
+                        found.append(child)
+                    elif not (root and key.startswith("$")):
+                        everything(child)
+                return
+            if level == "+":
+                for key, child in node.items():
+                    if key is not None and not (root and key.startswith("$")):
+                        walk(child, i + 1, False)
+            elif level in node:
+                walk(node[level], i + 1, False)
+
+        walk(self.retained_tree, 0, True)
+        return [(t,) + self.retained[t] for t in found if t in self.retained]
+
+    def route(self, sender, topic, payload, qos, retain, wire):
+        self.publishes += 1
+        if self.on_publish:
+            self.on_publish(sender, topic, payload, retain, wire, time.perf_counter())
+        if retain:
+            self.retain(topic, payload, qos)
+        for s, sub_qos in self.trie.match(topic).items():
+            s.deliver(topic, payload, min(qos, sub_qos), False)
+            self.deliveries += 1
+
+    async def close(self):
+        for s in list(self.sessions.values()):
+            s.writer.close()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+async def serve(args):
+    broker = Broker()
+    port = await broker.start(args.host, args.port)
+    print(f"listening on {args.host}:{port}")
+    last = (0, 0, 0)
+    while True:
+        await asyncio.sleep(args.interval)
+        now = (broker.publishes, broker.deliveries, broker.bytes_out)
+        print(f"sessions {len(broker.sessions):6}  publishes/s "
+              f"{(now[0] - last[0]) / args.interval:9.0f}  deliveries/s "
+              f"{(now[1] - last[1]) / args.interval:9.0f}  out "
+              f"{(now[2] - last[2]) / args.interval / 1e6:7.2f} MB/s  retained {len(broker.retained)}")
+        last = now
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=1883)
+    ap.add_argument("--interval", type=float, default=5.0)
+    args = ap.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
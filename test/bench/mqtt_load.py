@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""Load an MQTT broker the way a site full of OpenWatt devices and dashboards would.
+
+Opens thousands of client connections, subscribes them with a mix of exact,
+single-level, multi-level and Home Assistant discovery filters, publishes at
+a fixed rate and QoS, and reports what the broker did with it. Meant for
+OpenWatt's own broker (/protocol/mqtt/broker) against whatever external
+broker it might replace; run the same command at both.
+
+Topics model a gateway: every node publishes openwatt/<node>/<group>/<point>
+state, and (a --ha-share of the traffic) the discovery configs
+ha_discovery.d would, homeassistant/<component>/<node>/<object>/config.
+Every payload starts with its send time, so each delivery gives a
+publish-to-deliver latency; the expected fan-out of every topic is worked
+out up front, so loss is counted rather than guessed.
+
+Phases, in order:
+
+    connect     open --clients subscriber connections, --hass of them a
+                dashboard taking homeassistant/# and openwatt/#
+    load        --publishers publish --rate msgs/s for --duration seconds
+                at --qos; throughput, latency percentiles, loss
+    retained    publish --retained retained messages, time a subscribe
+                that matches all of them and one that matches none
+    sweep       add idle subscriptions up to each --sweep count and time a
+                probe topic, to see how matching scales with the table
+
+The generator runs on one event loop; its own schedule lag is reported so a
+saturated generator is not mistaken for a slow broker.
+
+  python3 test/bench/mqtt_load.py [--host H] [--port N] [--start [BINARY]]
+      [--clients N] [--rate N] [--qos 0|1|2] [--sweep N,N,...] [--json PATH]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import struct
+import sys
+import time
+
+import mqtt
+from common import ms, openwatt, percentile, raise_fd_limit, send_all
+
+POINTS = (
+    ("realtime/power", "sensor"), ("realtime/voltage", "sensor"),
+    ("realtime/current", "sensor"), ("realtime/frequency", "sensor"),
+    ("energy/import", "sensor"), ("energy/export", "sensor"),
+    ("status/state", "binary_sensor"), ("config/mode", "select"),
+)
+MIX_KINDS = ("exact", "single", "multi", "ha")
+STAMP = struct.Struct(">dI")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in MIX_KINDS or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"mix wants {'=N,'.join(MIX_KINDS)}=N, not {part!r}")
+        mix[kind] = int(weight)
+    return mix
+
+
+def state_topic(node, point):
+    return f"openwatt/node{node}/{point}"
+
+
+def ha_topic(node, point, component):
+    return f"homeassistant/{component}/node{node}/{point.replace('/', '_')}/config"
+
+
+def filter_for(kind, rng, nodes):
+    node = rng.randrange(nodes)
+    point = rng.choice(POINTS)[0]
+    if kind == "exact":
+        return state_topic(node, point)
+    if kind == "single":
+        return rng.choice((f"openwatt/+/{point}", f"openwatt/node{node}/{point.split('/')[0]}/+"))
+    if kind == "multi":
+        return f"openwatt/node{node}/#"
+    return f"homeassistant/+/node{node}/+/config"
+
+
+class Stats:
+    def __init__(self):
+        self.latency = []
+        self.ack = []
+        self.lag = []
+        self.received = 0
+        self.bytes = 0
+        self.sent = 0
+        self.start = self.end = 0.0
+
+    def deliver(self, payload):
+        sent, _ = STAMP.unpack_from(payload)
+        self.latency.append(time.perf_counter() - sent)
+        self.received += 1
+        self.bytes += len(payload)
+
+
+async def open_clients(args, count, prefix, concurrency):
+    gate = asyncio.Semaphore(concurrency)
+    times, failures = [], []
+
+    async def one(i):
+        async with gate:
+            t = time.perf_counter()
+            try:
+                c = await mqtt.Client.open(args.host, args.port, f"{prefix}-{i}",
+                                           keepalive=args.keepalive)
+            except (OSError, asyncio.TimeoutError, mqtt.ProtocolError) as e:
+                failures.append(str(e) or type(e).__name__)
+                return None
+            times.append(time.perf_counter() - t)
+            return c
+
+    clients = await asyncio.gather(*(one(i) for i in range(count)))
+    return [c for c in clients if c], times, failures
+
+
+async def subscribe_all(pairs):
+    """[(client, [(filter, qos)])] in batches; (suback times, granted qos counts)."""
+    times, granted = [], {}
+
+    async def one(c, filters):
+        for i in range(0, len(filters), 64):
+            t = time.perf_counter()
+            for g in await c.subscribe(filters[i:i + 64]):
+                granted[g] = granted.get(g, 0) + 1
+            times.append(time.perf_counter() - t)
+
+    await asyncio.gather(*(one(c, f) for c, f in pairs))
+    return times, granted
+
+
+async def paced(publishers, rate, duration, pick, qos, stats):
+    """Publish pick() at rate msgs/s round-robin over publishers."""
+    acks = []
+    stats.start = time.perf_counter()
+    total = int(rate * duration)
+    for seq in range(total):
+        due = stats.start + seq / rate
+        now = time.perf_counter()
+        if due > now:
+            await asyncio.sleep(due - now)
+            now = time.perf_counter()
+        stats.lag.append(now - due)
+        topic, pad, retain = pick(seq)
+        c = publishers[seq % len(publishers)]
+        t = time.perf_counter()
+        fut = c.publish(topic, STAMP.pack(t, seq) + pad, qos, retain)
+        stats.sent += 1
+        if fut:
+            fut.add_done_callback(lambda f, t=t: f.cancelled() or f.exception()
+                                  or stats.ack.append(time.perf_counter() - t))
+            acks.append(fut)
+        if seq % 256 == 255:
+            await asyncio.sleep(0)
+    stats.end = time.perf_counter()
+    if acks:
+        await asyncio.wait(acks, timeout=10)
+
+
+async def drained(stats, expected, settle):
+    """Wait until deliveries stop or reach the expected count."""
+    last, idle = -1, time.perf_counter()
+    while stats.received < expected:
+        await asyncio.sleep(0.05)
+        if stats.received != last:
+            last, idle = stats.received, time.perf_counter()
+        elif time.perf_counter() - idle > settle:
+            break
+
+
+def report_latency(label, stats, expected):
+    elapsed = max(stats.end - stats.start, 1e-9)
+    lat = stats.latency
+    row = {
+        "sent": stats.sent, "expected": expected, "delivered": stats.received,
+        "publish_rate": stats.sent / elapsed, "deliver_rate": stats.received / elapsed,
+        "p50_ms": percentile(lat, 50) * 1000, "p99_ms": percentile(lat, 99) * 1000,
+        "max_ms": max(lat, default=float("nan")) * 1000,
+        "generator_lag_p99_ms": percentile(stats.lag, 99) * 1000,
+    }
+    if stats.ack:
+        row["ack_p50_ms"] = percentile(stats.ack, 50) * 1000
+        row["ack_p99_ms"] = percentile(stats.ack, 99) * 1000
+    lost = expected - stats.received
+    print(f"{label}: sent {stats.sent} ({row['publish_rate']:.0f}/s), delivered "
+          f"{stats.received}/{expected} ({row['deliver_rate']:.0f}/s)"
+          f"{f', {lost} lost' if lost > 0 else f', {-lost} extra' if lost < 0 else ''}")
+    print(f"  deliver latency ms  p50 {ms(percentile(lat, 50), 2)}  p99 {ms(percentile(lat, 99), 2)}"
+          f"  max {ms(max(lat, default=float('nan')), 2)}")
+    if stats.ack:
+        print(f"  ack latency ms      p50 {ms(percentile(stats.ack, 50), 2)}"
+              f"  p99 {ms(percentile(stats.ack, 99), 2)}")
+    print(f"  generator lag ms    p99 {ms(percentile(stats.lag, 99), 2)}"
+          f"{'  (generator saturated; numbers are a floor)' if percentile(stats.lag, 99) > 0.05 else ''}")
+    return row
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    results = {"broker": f"{args.host}:{args.port}", "qos": args.qos}
+
+    # connect
+    t = time.perf_counter()
+    subs, times, failures = await open_clients(args, args.clients, "sub", args.connect_concurrency)
+    pubs, _, pfail = await open_clients(args, args.publishers, "pub", args.connect_concurrency)
+    took = time.perf_counter() - t
+    print(f"connect: {len(subs)}/{args.clients} subscribers, {len(pubs)}/{args.publishers} "
+          f"publishers in {took:.2f}s ({(len(subs) + len(pubs)) / took:.0f}/s)")
+    print(f"  connect latency ms  p50 {ms(percentile(times, 50), 2)}  p99 {ms(percentile(times, 99), 2)}")
+    for f in sorted(set(failures + pfail))[:5]:
+        print(f"  failed: {f}")
+    if not subs or not pubs:
+        print("nothing to measure", file=sys.stderr)
+        return 1
+    results["connect"] = {"clients": len(subs), "failed": len(failures) + len(pfail),
+                          "p50_ms": percentile(times, 50) * 1000,
+                          "p99_ms": percentile(times, 99) * 1000}
+
+    # subscribe
+    kinds = [k for k, w in args.mix.items() for _ in range(w)]
+    plan = []
+    for i, c in enumerate(subs):
+        if i < args.hass:
+            filters = ["homeassistant/#", "openwatt/#"]
+        else:
+            filters = sorted({filter_for(rng.choice(kinds), rng, args.nodes)
+                              for _ in range(args.filters)})
+        plan.append((c, [(f, args.qos) for f in filters]))
+    t = time.perf_counter()
+    times, granted = await subscribe_all(plan)
+    total_filters = sum(len(f) for _, f in plan)
+    print(f"subscribe: {total_filters} filters in {time.perf_counter() - t:.2f}s"
+          f"   suback ms p50 {ms(percentile(times, 50), 2)}  p99 {ms(percentile(times, 99), 2)}"
+          f"   granted qos {dict(sorted(granted.items()))}")
+    results["subscribe"] = {"filters": total_filters, "granted": granted,
+                            "p99_ms": percentile(times, 99) * 1000}
+
+    # load
+    topics = []
+    for node in range(args.nodes):
+        for point, component in POINTS:
+            topics.append((state_topic(node, point), False))
+            topics.append((ha_topic(node, point, component), True))
+    fanout = {topic: sum(1 for _, fs in plan if any(mqtt.matches(f, topic) for f, _ in fs))
+              for topic, _ in topics}
+    state = [t for t, ha in topics if not ha]
+    discovery = [t for t, ha in topics if ha]
+    stats = Stats()
+    for c in subs:
+        c.on_message = lambda c, topic, payload, qos, retain: stats.deliver(payload)
+    pad = bytes(max(0, args.size - STAMP.size))
+    ha_pad = bytes(max(0, args.ha_size - STAMP.size))
+    picked = []
+
+    def pick(seq):
+        if rng.random() < args.ha_share:
+            topic, p = rng.choice(discovery), ha_pad
+        else:
+            topic, p = rng.choice(state), pad
+        picked.append(topic)
+        return topic, p, False
+
+    bytes_before = sum(c.bytes_in for c in subs)
+    await paced(pubs, args.rate, args.duration, pick, args.qos, stats)
+    expected = sum(fanout[t] for t in picked)
+    await drained(stats, expected, args.settle)
+    results["load"] = report_latency("load", stats, expected)
+    wire = sum(c.bytes_in for c in subs) - bytes_before
+    print(f"  fan-out {expected / max(stats.sent, 1):.1f} per publish, "
+          f"{wire / 1e6:.2f} MB to subscribers")
+    results["load"]["wire_bytes"] = wire
+
+    # retained
+    if args.retained:
+        for c in subs:
+            c.on_message = None
+        store = pubs[0]
+        t = time.perf_counter()
+        acks = [store.publish(f"bench/retained/{i}", STAMP.pack(0, i) + pad, 1, True)
+                for i in range(args.retained)]
+        await asyncio.wait(acks, timeout=30)
+        stored = time.perf_counter() - t
+        probe = await mqtt.Client.open(args.host, args.port, "retained-probe")
+        got = []
+        arrived = asyncio.get_running_loop().create_future()
+
+        def on_retained(c, topic, payload, qos, retain):
+            got.append(retain)
+            if len(got) == args.retained and not arrived.done():
+                arrived.set_result(None)
+
+        probe.on_message = on_retained
+        t = time.perf_counter()
+        await probe.subscribe([("bench/other/#", 0)])
+        miss = time.perf_counter() - t
+        t = time.perf_counter()
+        await probe.subscribe([("bench/retained/#", 0)])
+        suback = time.perf_counter() - t
+        try:
+            await asyncio.wait_for(arrived, timeout=30)
+        except asyncio.TimeoutError:
+            pass
+        all_in = time.perf_counter() - t
+        print(f"retained: stored {args.retained} in {stored:.2f}s (qos 1), subscribe "
+              f"matching all: suback {ms(suback, 2).strip()} ms, {len(got)} delivered in "
+              f"{ms(all_in, 2).strip()} ms ({sum(got)} flagged retained)")
+        print(f"  subscribe matching none: suback {ms(miss, 2).strip()} ms")
+        results["retained"] = {"count": args.retained, "store_s": stored,
+                               "suback_ms": suback * 1000, "all_delivered_ms": all_in * 1000,
+                               "delivered": len(got), "miss_suback_ms": miss * 1000}
+        acks = [store.publish(f"bench/retained/{i}", b"", 1, True) for i in range(args.retained)]
+        await asyncio.wait(acks, timeout=30)
+        await probe.close()
+
+    # sweep
+    if args.sweep:
+        for c in subs:
+            c.on_message = None
+        idle, _, _ = await open_clients(args, args.sweep_clients, "idle", args.connect_concurrency)
+        holders = idle or subs
+        probe = await mqtt.Client.open(args.host, args.port, "sweep-probe")
+        await probe.subscribe([("bench/probe/+/value", args.qos)])
+        print(f"\nsweep: probe latency vs idle subscriptions "
+              f"({args.sweep_rate}/s for {args.sweep_duration}s each)")
+        print(f"{'subscriptions':>13} {'p50 ms':>8} {'p99 ms':>8} {'deliver/s':>10}")
+        added, results["sweep"] = 0, []
+        for target in sorted(args.sweep):
+            plan = []
+            while added < target:
+                filters = []
+                for _ in range(min(256, target - added)):
+                    # same shape as the real filters, on topics nobody publishes
+                    kind = rng.choice(kinds)
+                    filters.append(("idle/" + filter_for(kind, rng, args.nodes), args.qos))
+                    added += 1
+                plan.append((holders[added % len(holders)], filters))
+            await subscribe_all(plan)
+            stats = Stats()
+            probe.on_message = lambda c, topic, payload, qos, retain: stats.deliver(payload)
+            await paced(pubs, args.sweep_rate, args.sweep_duration,
+                        lambda seq: (f"bench/probe/{seq % 16}/value", pad, False), args.qos, stats)
+            await drained(stats, stats.sent, args.settle)
+            elapsed = max(stats.end - stats.start, 1e-9)
+            print(f"{total_filters + added:13} {ms(percentile(stats.latency, 50), 2)} "
+                  f"{ms(percentile(stats.latency, 99), 2)} {stats.received / elapsed:10.0f}")
+            results["sweep"].append({"subscriptions": total_filters + added,
+                                     "p50_ms": percentile(stats.latency, 50) * 1000,
+                                     "p99_ms": percentile(stats.latency, 99) * 1000,
+                                     "delivered": stats.received, "sent": stats.sent})
+        await probe.close()
+        subs += idle
+
+    await asyncio.gather(*(c.close() for c in subs + pubs), return_exceptions=True)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {args.json}")
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="localhost")
+    ap.add_argument("--port", type=int, default=1883)
+    ap.add_argument("--start", nargs="?", const="bin/x86_64_debug/openwatt", metavar="BINARY",
+                    help="start OpenWatt and add a broker on --port first")
+    ap.add_argument("--clients", type=int, default=1000, help="subscriber connections")
+    ap.add_argument("--hass", type=int, default=1,
+                    help="of those, dashboards taking homeassistant/# and openwatt/#")
+    ap.add_argument("--filters", type=int, default=3, help="filters per other subscriber")
+    ap.add_argument("--mix", type=parse_mix, default=parse_mix("exact=40,single=25,multi=15,ha=20"),
+                    help="relative weights of the filter kinds: "
+                         "exact, single (+), multi (#), ha (discovery)")
+    ap.add_argument("--nodes", type=int, default=100, help="devices in the topic model")
+    ap.add_argument("--publishers", type=int, default=10)
+    ap.add_argument("--rate", type=float, default=1000, help="publishes per second, total")
+    ap.add_argument("--duration", type=float, default=10, help="seconds of load")
+    ap.add_argument("--qos", type=int, choices=(0, 1, 2), default=0)
+    ap.add_argument("--size", type=int, default=64, help="state payload bytes")
+    ap.add_argument("--ha-size", type=int, default=600, help="discovery payload bytes")
+    ap.add_argument("--ha-share", type=float, default=0.05,
+                    help="fraction of publishes that are discovery configs")
+    ap.add_argument("--retained", type=int, default=1000,
+                    help="retained messages for the retained phase; 0 skips it")
+    ap.add_argument("--sweep", type=lambda s: [int(n) for n in s.split(",") if n], default=[],
+                    metavar="N,N,...", help="idle subscription counts to time the probe at")
+    ap.add_argument("--sweep-clients", type=int, default=20)
+    ap.add_argument("--sweep-rate", type=float, default=500)
+    ap.add_argument("--sweep-duration", type=float, default=3)
+    ap.add_argument("--connect-concurrency", type=int, default=200)
+    ap.add_argument("--keepalive", type=int, default=300)
+    ap.add_argument("--settle", type=float, default=2.0,
+                    help="seconds without a delivery before giving up on the rest")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = ap.parse_args()
+    raise_fd_limit(args.clients + args.publishers + args.sweep_clients + 64)
+
+    ow = None
+    if args.start:
+        ow = openwatt(args.start, "mqtt_load")
+        if not ow.start():
+            return 1
+    try:
+        if ow:
+            send_all(ow.get_console(),
+                     (f"/protocol/mqtt/broker add name=bench port={args.port} allow-anonymous=true",))
+            time.sleep(1.0)
+        return asyncio.run(run(args))
+    finally:
+        if ow:
+            ow.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""Measure a gateway's MQTT reconnect storm against a local broker stand-in.
+
+When the broker connection drops, every MQTT binding restarts: on the new
+session OpenWatt replays one SUBSCRIBE per binding filter, and the broker
+answers each with every retained message it matches (the devices' state,
+and their Home Assistant discovery configs). With hundreds of devices
+that is one burst the main loop has to eat in one go, and it is the one
+that sets HA instances choking when they sit on the same broker.
+
+This runs mqtt_broker.py's broker in-process, fills it with N simulated
+devices' retained state and discovery configs, provisions N MQTT bindings
+in OpenWatt pointing at it (through the harness console, with a generated
+profile), then kicks the gateway's session --rounds times and for each
+reconnect reports:
+
+    reconnect   kick to CONNECT, and CONNECT to the last SUBSCRIBE
+    replay      retained messages sent to the gateway and the time until
+                the socket took the last of them
+    published   what the gateway published during the burst
+    wire        bytes each way on the gateway's session
+    stall       main-loop ticks over 100 ms OpenWatt logged meanwhile
+                (its slow-tick warning), and the worst module
+
+With --no-start nothing is launched or provisioned: point a gateway (an
+ESP32 on the bench, say) at --host/--port with --client-id and it is
+measured the same way, less the stall figures.
+
+  python3 test/bench/mqtt_storm.py [--devices N] [--rounds N] [--binary PATH]
+      [--no-start --client-id ID] [--port N] [--json PATH]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from common import generated_profile, openwatt, send_all, slow_ticks
+from mqtt_broker import Broker
+
+POINTS = (
+    ("power", "W", "power"), ("voltage", "V", "voltage"), ("current", "A", "current"),
+    ("frequency", "Hz", "frequency"), ("energy_import", "kWh", "energy"),
+    ("energy_export", "kWh", "energy"),
+)
+PROFILE = "bench_mqtt_storm"
+
+
+def profile_text():
+    lines = [
+        "# generated by test/bench/mqtt_storm.py",
+        "parameters: device_id",
+        'mqtt-subscribe: "{device_id}/sensor/+/state"',
+        'mqtt-subscribe: "{device_id}/switch/+/state"',
+        'mqtt-subscribe: "homeassistant/+/{device_id}/+/config"',
+        "elements:",
+    ]
+    for name, unit, _ in POINTS:
+        lines.append(f"\tmqtt: {{device_id}}/sensor/{name}/state, f32, R\tdesc: {name}, {unit}")
+    lines.append("\tmqtt: {device_id}/switch/relay/state, bool, RW\tdesc: relay")
+    lines.append("\t\twrite: {device_id}/switch/relay/set")
+    lines += ["device-template:", "\tcomponent:", "\t\tid: meter"]
+    for name, _, _ in POINTS:
+        lines.append(f"\t\telement-map: {name}, @{name}")
+    lines.append("\t\telement-map: relay, @relay")
+    return "\n".join(lines) + "\n"
+
+
+def discovery_config(device, name, unit, device_class):
+    return json.dumps({
+        "name": name.replace("_", " ").title(),
+        "unique_id": f"{device}_{name}",
+        "state_topic": f"{device}/sensor/{name}/state",
+        "availability_topic": f"{device}/status",
+        "device_class": device_class,
+        "state_class": "total_increasing" if device_class == "energy" else "measurement",
+        "unit_of_measurement": unit,
+        "value_template": "{{ value | float | round(2) }}",
+        "device": {"identifiers": [device], "name": device, "manufacturer": "OpenWatt",
+                   "model": "bench meter", "sw_version": "1.0"},
+    }, separators=(",", ":")).encode()
+
+
+def populate(broker, devices):
+    """Retained state and discovery for every simulated device; message count."""
+    n = 0
+    for i in range(devices):
+        device = f"sim{i}"
+        for name, unit, device_class in POINTS:
+            broker.retain(f"{device}/sensor/{name}/state", f"{230 + i % 10}.{i % 100:02}".encode())
+            broker.retain(f"homeassistant/sensor/{device}/{name}/config",
+                          discovery_config(device, name, unit, device_class))
+            n += 2
+        broker.retain(f"{device}/switch/relay/state", b"OFF")
+        broker.retain(f"homeassistant/switch/{device}/relay/config", json.dumps({
+            "name": "Relay", "unique_id": f"{device}_relay",
+            "state_topic": f"{device}/switch/relay/state",
+            "command_topic": f"{device}/switch/relay/set",
+            "device": {"identifiers": [device]}}).encode())
+        broker.retain(f"{device}/status", b"online")
+        n += 3
+    return n
+
+
+class Watch:
+    """The gateway session's view of one reconnect."""
+
+    def __init__(self, client_id, expected_subs):
+        self.client_id = client_id
+        self.expected_subs = expected_subs
+        self.session = None
+        self.connected = None
+        self.subscribed = None
+        self.subs = 0
+        self.published = []
+        self.ready = asyncio.Event()
+
+    def on_connect(self, s):
+        if s.client_id != self.client_id:
+            return
+        self.session = s
+        self.connected = time.perf_counter()
+        self.subs = 0
+        self.published = []
+
+    def on_subscribe(self, s, filter, qos):
+        if s is self.session:
+            self.subs += 1
+            if self.subs >= self.expected_subs and not self.ready.is_set():
+                self.subscribed = time.perf_counter()
+                self.ready.set()
+
+    def on_publish(self, s, topic, payload, retain, wire, t):
+        if s is self.session:
+            self.published.append((t, topic, wire))
+
+
+def provision(console, args, port):
+    send_all(console, [f"/protocol/mqtt/client add name=storm host=127.0.0.1 port={port} "
+                       f"client-id={args.client_id} keep-alive=60"]
+             + [f"/binding/mqtt/add name=storm{i} device=storm{i} client=storm "
+                f"profile={PROFILE} device_id=sim{i}" for i in range(args.devices)])
+
+
+async def run(args, ow):
+    broker = Broker()
+    port = await broker.start(args.host, args.port)
+    retained = populate(broker, args.devices)
+    watch = Watch(args.client_id, args.devices * 3 if not args.no_start else args.expect_subs)
+    broker.on_connect, broker.on_subscribe = watch.on_connect, watch.on_subscribe
+    broker.on_publish = watch.on_publish
+    print(f"broker on {args.host}:{port}: {args.devices} devices, {retained} retained messages "
+          f"({sum(len(p) for p, _ in broker.retained.values()) / 1e3:.0f} kB)")
+
+    stderr_offset = 0
+    if ow:
+        provision(ow.get_console(), args, port)
+        print(f"provisioned {args.devices} bindings")
+    else:
+        print(f"waiting for {args.client_id} to connect")
+    try:
+        await asyncio.wait_for(watch.ready.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        print(f"gateway did not subscribe within {args.timeout}s "
+              f"({watch.subs}/{watch.expected_subs} filters)", file=sys.stderr)
+        return 1
+    await asyncio.sleep(args.settle)
+    _, stderr_offset = slow_ticks(args.stderr, 0)
+
+    rounds = []
+    print(f"\n{'round':>5} {'reconnect':>10} {'subscribe':>10} {'replayed':>9} {'flushed':>9} "
+          f"{'pubs':>6} {'in kB':>7} {'out kB':>7} {'stalls':>7} {'worst ms':>9}")
+    for r in range(1, args.rounds + 1):
+        s = watch.session
+        watch.ready.clear()
+        sent = broker.retained_sent
+        kicked = time.perf_counter()
+        s.writer.close()
+        try:
+            await asyncio.wait_for(watch.ready.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            print(f"round {r}: gateway did not come back within {args.timeout}s "
+                  f"({watch.subs}/{watch.expected_subs} filters)", file=sys.stderr)
+            return 1
+        s = watch.session
+        replayed = broker.retained_sent - sent
+        try:
+            await asyncio.wait_for(s.writer.drain(), args.timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        flushed = time.perf_counter()
+        await asyncio.sleep(args.settle)
+        ticks, stderr_offset = slow_ticks(args.stderr, stderr_offset)
+        worst = max(ticks, default=(0, ""))
+        row = {
+            "reconnect_ms": (watch.connected - kicked) * 1000,
+            "subscribe_ms": (watch.subscribed - watch.connected) * 1000,
+            "replayed": replayed, "flushed_ms": (flushed - watch.connected) * 1000,
+            "published": len(watch.published),
+            "last_publish_ms": ((watch.published[-1][0] - watch.connected) * 1000
+                                if watch.published else None),
+            "bytes_in": s.bytes_in, "bytes_out": s.bytes_out,
+            "slow_ticks": len(ticks), "worst_tick_ms": worst[0], "worst_module": worst[1],
+        }
+        rounds.append(row)
+        print(f"{r:5} {row['reconnect_ms']:8.0f}ms {row['subscribe_ms']:8.0f}ms {replayed:9} "
+              f"{row['flushed_ms']:7.0f}ms {row['published']:6} {s.bytes_in / 1e3:7.1f} "
+              f"{s.bytes_out / 1e3:7.1f} {len(ticks) if args.stderr else '-':>7} "
+              f"{worst[0] if args.stderr else '-':>9}")
+        if worst[1]:
+            print(f"{'':6}worst tick in {worst[1]}")
+
+    topics = {}
+    for t, topic, wire in watch.published:
+        topics[topic] = topics.get(topic, 0) + 1
+    if topics:
+        repeats = sum(n - 1 for n in topics.values())
+        print(f"\nlast round: {len(topics)} distinct topics published, {repeats} repeats")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"devices": args.devices, "retained": retained, "rounds": rounds}, f, indent=2)
+        print(f"wrote {args.json}")
+    await broker.close()
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--devices", type=int, default=200, help="simulated devices")
+    ap.add_argument("--rounds", type=int, default=3, help="forced reconnects")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=0, help="broker port; 0 picks one")
+    ap.add_argument("--binary", default="bin/x86_64_debug/openwatt")
+    ap.add_argument("--no-start", action="store_true",
+                    help="measure a gateway configured by hand instead of starting OpenWatt")
+    ap.add_argument("--client-id", default="openwatt-storm")
+    ap.add_argument("--expect-subs", type=int, default=1,
+                    help="with --no-start, filters the gateway subscribes before it counts as up")
+    ap.add_argument("--settle", type=float, default=2.0, help="seconds to watch after each burst")
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = ap.parse_args()
+
+    ow = None if args.no_start else openwatt(args.binary, "mqtt_storm")
+    args.stderr = str(ow.stderr_path) if ow else None
+    with generated_profile(ow, PROFILE, profile_text()):
+        if ow and not ow.start():
+            return 1
+        try:
+            return asyncio.run(run(args, ow))
+        finally:
+            if ow:
+                ow.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""Read a .proto file and encode/decode its messages, no protoc required.
+
+Enough of proto2/proto3 for the schemas in src/protocol: messages (nested
+or not), enums, scalar/string/bytes/message fields, repeated fields
+(packed or not on the way in, packed on the way out for numbers), oneof
+members as plain fields, and the `option (id) = N;` message option the
+ESPHome API numbers its messages with. Services, imports, reserved ranges,
+extensions and map fields are skipped.
+
+    schema = proto.load("src/protocol/esphome/api.proto")
+    msg = schema["HelloRequest"]
+    data = msg.encode({"client_info": "bench", "api_version_major": 1})
+    msg.decode(data) -> {"client_info": "bench", "api_version_major": 1}
+"""
+
+import re
+import struct
+
+TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|[A-Za-z_][\w.]*|-?\d[\w.]*|\S')
+COMMENT_RE = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+
+VARINT = {"int32", "int64", "uint32", "uint64", "bool", "sint32", "sint64"}
+FIXED32 = {"fixed32": "<I", "sfixed32": "<i", "float": "<f"}
+FIXED64 = {"fixed64": "<Q", "sfixed64": "<q", "double": "<d"}
+
+
+def varint(n):
+    if n < 0:
+        n &= (1 << 64) - 1
+    out = bytearray()
+    while True:
+        b, n = n & 0x7F, n >> 7
+        out.append(b | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def read_varint(data, pos):
+    n = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return n, pos
+        shift += 7
+
+
+class Field:
+    __slots__ = ("name", "number", "type", "repeated")
+
+    def __init__(self, name, number, type, repeated):
+        self.name, self.number, self.type, self.repeated = name, number, type, repeated
+
+
+class Enum:
+    def __init__(self, name, values):
+        self.name = name
+        self.values = values
+        self.names = {v: k for k, v in values.items()}
+
+
+class Message:
+    def __init__(self, schema, name):
+        self.schema = schema
+        self.name = name
+        self.id = None
+        self.fields = {}
+        self.by_name = {}
+
+    def add(self, f):
+        self.fields[f.number] = f
+        self.by_name[f.name] = f
+
+    def _kind(self, type):
+        """varint, zigzag, fixed32, fixed64, string, bytes, enum or message"""
+        if type in ("sint32", "sint64"):
+            return "zigzag"
+        if type in VARINT:
+            return "varint"
+        if type in FIXED32:
+            return "fixed32"
+        if type in FIXED64:
+            return "fixed64"
+        if type in ("string", "bytes"):
+            return type
+        t = self.schema.resolve(type, self.name)
+        return "enum" if isinstance(t, Enum) else "message"
+
+    def _scalar(self, f, kind, v):
+        if kind == "enum":
+            if isinstance(v, str):
+                v = self.schema.resolve(f.type, self.name).values[v]
+            return varint(v)
+        if kind == "zigzag":
+            return varint((v << 1) ^ (v >> 63))
+        if kind == "varint":
+            return varint(int(v))
+        if kind == "fixed32":
+            return struct.pack(FIXED32[f.type], v)
+        return struct.pack(FIXED64[f.type], v)
+
+    def encode(self, values):
+        out = bytearray()
+        for name, v in values.items():
+            f = self.by_name.get(name)
+            if f is None:
+                raise KeyError(f"{self.name} has no field {name}")
+            kind = self._kind(f.type)
+            items = v if f.repeated else [v]
+            if kind in ("string", "bytes", "message"):
+                for item in items:
+                    if kind == "message":
+                        body = self.schema.resolve(f.type, self.name).encode(item)
+                    else:
+                        body = item.encode() if isinstance(item, str) else bytes(item)
+                    out += varint(f.number << 3 | 2) + varint(len(body)) + body
+            elif f.repeated:
+                body = b"".join(self._scalar(f, kind, item) for item in items)
+                if body:
+                    out += varint(f.number << 3 | 2) + varint(len(body)) + body
+            else:
+                wire = {"fixed32": 5, "fixed64": 1}.get(kind, 0)
+                out += varint(f.number << 3 | wire) + self._scalar(f, kind, v)
+        return bytes(out)
+
+    def decode(self, data):
+        values, pos = {}, 0
+        while pos < len(data):
+            key, pos = read_varint(data, pos)
+            number, wire = key >> 3, key & 7
+            if wire == 0:
+                raw, pos = read_varint(data, pos)
+                chunks = [("v", raw)]
+            elif wire == 5:
+                chunks, pos = [("b", data[pos:pos + 4])], pos + 4
+            elif wire == 1:
+                chunks, pos = [("b", data[pos:pos + 8])], pos + 8
+            elif wire == 2:
+                n, pos = read_varint(data, pos)
+                chunks, pos = [("l", data[pos:pos + n])], pos + n
+            else:
+                raise ValueError(f"{self.name}: wire type {wire}")
+            f = self.fields.get(number)
+            if f is None:
+                continue
+            kind = self._kind(f.type)
+            for v in self._values(f, kind, chunks[0]):
+                if f.repeated:
+                    values.setdefault(f.name, []).append(v)
+                else:
+                    values[f.name] = v
+        return values
+
+    def _values(self, f, kind, chunk):
+        form, raw = chunk
+        if kind in ("string", "bytes", "message"):
+            if kind == "string":
+                return [raw.decode(errors="replace")]
+            if kind == "bytes":
+                return [bytes(raw)]
+            return [self.schema.resolve(f.type, self.name).decode(raw)]
+        if form == "l":
+            # packed
+            out, pos = [], 0
+            while pos < len(raw):
+                if kind in ("fixed32", "fixed64"):
+                    size = 4 if kind == "fixed32" else 8
+                    out += self._values(f, kind, ("b", raw[pos:pos + size]))
+                    pos += size
+                else:
+                    n, pos = read_varint(raw, pos)
+                    out += self._values(f, kind, ("v", n))
+            return out
+        if form == "b":
+            return [struct.unpack(FIXED32.get(f.type) or FIXED64[f.type], raw)[0]]
+        if kind == "zigzag":
+            return [(raw >> 1) ^ -(raw & 1)]
+        if f.type == "bool":
+            return [bool(raw)]
+        if f.type in ("int32", "int64") and raw >> 63:
+            raw -= 1 << 64
+        return [raw]
+
+
+class Schema(dict):
+    """name -> Message or Enum; .by_id maps option (id) to its Message."""
+
+    def __init__(self):
+        super().__init__()
+        self.by_id = {}
+
+    def resolve(self, type, scope):
+        # innermost scope first, as protoc does
+        parts = scope.split(".")
+        for i in range(len(parts), -1, -1):
+            name = ".".join(parts[:i] + [type])
+            if name in self:
+                return self[name]
+        raise KeyError(f"unknown type {type} in {scope}")
+
+
+def parse(text):
+    tokens = TOKEN_RE.findall(COMMENT_RE.sub(" ", text))
+    schema = Schema()
+    pos = 0
+
+    def skip_block():
+        nonlocal pos
+        depth = 0
+        while pos < len(tokens):
+            t = tokens[pos]
+            pos += 1
+            if t == "{":
+                depth += 1
+            elif t == "}":
+                depth -= 1
+                if depth == 0:
+                    return
+            elif t == ";" and depth == 0:
+                return
+
+    def statement_end():
+        nonlocal pos
+        while tokens[pos] != ";":
+            pos += 1
+        pos += 1
+
+    def parse_enum(scope):
+        nonlocal pos
+        name = tokens[pos + 1]
+        full = f"{scope}.{name}" if scope else name
+        pos += 3
+        values = {}
+        while tokens[pos] != "}":
+            if tokens[pos] in ("option", "reserved"):
+                statement_end()
+                continue
+            values[tokens[pos]] = int(tokens[pos + 2], 0)
+            statement_end()
+        pos += 1
+        schema[full] = Enum(full, values)
+
+    def parse_message(scope):
+        nonlocal pos
+        name = tokens[pos + 1]
+        full = f"{scope}.{name}" if scope else name
+        msg = schema[full] = Message(schema, full)
+        pos += 3
+        oneofs = 0
+        while True:
+            t = tokens[pos]
+            if t == "}":
+                pos += 1
+                if not oneofs:
+                    break
+                oneofs -= 1
+            elif t == "message":
+                parse_message(full)
+            elif t == "enum":
+                parse_enum(full)
+            elif t == "oneof":
+                # its members are plain fields as far as the wire goes
+                pos += 3
+                oneofs += 1
+            elif t == "option":
+                if tokens[pos + 1:pos + 5] == ["(", "id", ")", "="]:
+                    msg.id = int(tokens[pos + 5], 0)
+                statement_end()
+            elif t == "extend":
+                skip_block()
+            elif t in ("reserved", "extensions", "map"):
+                statement_end()
+            elif t == ";":
+                pos += 1
+            else:
+                repeated = t == "repeated"
+                if t in ("repeated", "optional", "required"):
+                    pos += 1
+                type, fname, number = tokens[pos], tokens[pos + 1], int(tokens[pos + 3], 0)
+                msg.add(Field(fname, number, type, repeated))
+                statement_end()
+        if msg.id is not None:
+            schema.by_id[msg.id] = msg
+
+    while pos < len(tokens):
+        t = tokens[pos]
+        if t == "message":
+            parse_message("")
+        elif t == "enum":
+            parse_enum("")
+        elif t in ("syntax", "import", "package", "option"):
+            statement_end()
+        else:
+            skip_block()
+    return schema
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return parse(f.read())
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""Serve hundreds of virtual REST devices for the HTTP client binding.
+
+Each device answers four JSON endpoints under its own path, polled at the
+rates a profile asks for:
+
+    /{dev}/status     power, voltage, current       realtime (400 ms)
+    /{dev}/meter      import, export energy         high (1 s)
+    /{dev}/settings   export limit                  medium (10 s)
+    /{dev}/info       serial                        const (once)
+
+--per-host devices share a port, so they share an http-client in OpenWatt
+(which has one request in flight per client); with the default of 1
+every device is a host of its own. Answers take --latency ms (per
+endpoint with status=20,meter=50), plus --jitter, and --chunked of them
+are sent chunked, --chunk bytes at a time --chunk-gap ms apart.
+
+The run has two phases of --duration seconds. In the first every device
+is healthy; in the second the first --slow devices add --slow-latency ms
+to every answer, and of their requests --stall never get one (the
+connection is held until the client gives up) and --reset are answered
+with a TCP reset. Per phase, healthy and slow devices are reported
+apart: the interval between polls of each endpoint against what the
+profile asks for, the worst gap, connections opened and requests per
+connection, and requests that arrived while an answer on the same
+connection was still owed (the client gave up on one and moved on;
+whatever answer it reads next belongs to the request before). How much
+the healthy devices' intervals move between the phases is what the slow
+ones cost everybody else.
+
+With --start OpenWatt is given an http-client per host and an HTTP
+client binding per device from a generated profile (written to
+conf/profiles/bench_rest.conf and removed after), and its CPU and
+slow-tick warnings are reported per phase. Without it, point bindings at
+http://--host:--base-port+N/ with dev=dN.
+
+  python3 test/bench/rest_sim.py [--devices 200] [--per-host 1] [--start [BINARY]]
+      [--latency 20] [--chunked 0.2] [--slow 2 --slow-latency 3000 --stall 0.1 --reset 0.1]
+      [--duration 30] [--json PATH]
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import math
+import random
+import socket
+import struct
+import sys
+import time
+
+from common import cpu_seconds, generated_profile, ms, openwatt, percentile, send_all, slow_ticks
+
+PROFILE = "bench_rest"
+# endpoint -> ms between polls the profile asks for (None: once)
+ENDPOINTS = {"status": 400, "meter": 1000, "settings": 10000, "info": None}
+
+
+def parse_latency(text):
+    """'20' or 'status=20,meter=50' -> {endpoint: ms}; a bare number is every endpoint."""
+    out = dict.fromkeys(ENDPOINTS, 0.0)
+    for part in text.split(","):
+        name, eq, value = part.partition("=")
+        if not eq:
+            out = dict.fromkeys(ENDPOINTS, float(name))
+        elif name in ENDPOINTS:
+            out[name] = float(value)
+        else:
+            raise argparse.ArgumentTypeError(f"unknown endpoint '{name}' (use {', '.join(ENDPOINTS)})")
+    return out
+
+
+def profile_text():
+    return "\n".join([
+        "# generated by test/bench/rest_sim.py",
+        "parameters: dev",
+        "elements:",
+        "\thttp: status, power, f64, W\tdesc: power, W, realtime",
+        "\thttp: status, voltage, f64, V\tdesc: voltage, V, realtime",
+        "\thttp: status, current, f64, A\tdesc: current, A, realtime",
+        "\thttp: meter, import, f64, kWh\tdesc: import, kWh, high",
+        "\thttp: meter, export, f64, kWh\tdesc: export, kWh, high",
+        "\thttp: settings, limit, f64, W\tdesc: limit, W, medium",
+        "\thttp: info, serial, str\tdesc: serial, , const",
+        "requests:",
+        '\trequest: status, GET, "/{dev}/status"',
+        '\trequest: meter, GET, "/{dev}/meter"',
+        '\trequest: settings, GET, "/{dev}/settings"',
+        '\trequest: info, GET, "/{dev}/info"',
+        "device-template:",
+        "\tcomponent:",
+        "\t\tid: info",
+        "\t\ttemplate: DeviceInfo",
+        "\t\telement-map: serial, @serial",
+        "\tcomponent:",
+        "\t\tid: meter",
+        "\t\ttemplate: RealtimeEnergyMeter",
+        "\t\telement-map: power, @power",
+        "\t\telement-map: voltage, @voltage",
+        "\t\telement-map: current, @current",
+        "\t\telement-map: import, @import",
+        "\t\telement-map: export, @export",
+        "\t\telement-map: limit, @limit",
+    ]) + "\n"
+
+
+class Device:
+    def __init__(self, index, rng):
+        self.index = index
+        self.name = f"d{index}"
+        self.slow = False
+        self.power = rng.uniform(200, 4000)
+        self.imported = rng.uniform(1000, 20000)
+        self.exported = rng.uniform(0, 5000)
+        self.polls = collections.defaultdict(list)   # endpoint -> [t]
+
+    def body(self, endpoint, pad):
+        t = time.time()
+        if endpoint == "status":
+            power = self.power * (1 + 0.05 * math.sin(t / 7 + self.index))
+            doc = {"power": round(power, 1), "voltage": round(230 + 2 * math.sin(t / 11), 1),
+                   "current": round(power / 230, 2)}
+            if pad:
+                doc["pad"] = "x" * pad
+        elif endpoint == "meter":
+            doc = {"import": round(self.imported + t / 3600, 3), "export": round(self.exported, 3)}
+        elif endpoint == "settings":
+            doc = {"limit": 5000}
+        else:
+            doc = {"serial": f"SIM{self.index:06}"}
+        return json.dumps(doc).encode()
+
+
+class Phase:
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end = None
+        self.requests = collections.Counter()    # group -> n
+        self.opened = collections.Counter()
+        self.used = collections.defaultdict(set)
+        self.owed = collections.Counter()
+        self.stalls = 0
+        self.resets = 0
+        self.chunked = 0
+        self.errors = collections.Counter()
+        self.max_in_flight = 0
+
+
+class Conn:
+    def __init__(self, writer):
+        self.writer = writer
+        self.queue = asyncio.Queue()
+        self.requests = 0
+        self.pending = 0     # requests read and not yet answered
+
+
+class Sim:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.devices = [Device(i, self.rng) for i in range(args.devices)]
+        self.by_name = {d.name: d for d in self.devices}
+        self.phase = Phase("warmup")
+        self.servers = []
+        self.conns = set()
+        self.in_flight = 0
+
+    async def start(self):
+        hosts = (len(self.devices) + self.args.per_host - 1) // self.args.per_host
+        for h in range(hosts):
+            server = await asyncio.start_server(self.serve, self.args.host, self.args.base_port + h,
+                                                backlog=64, reuse_address=True)
+            self.servers.append(server)
+        return hosts
+
+    async def close(self):
+        for server in self.servers:
+            server.close()
+        for conn in list(self.conns):
+            conn.writer.close()
+        await asyncio.sleep(0.1)
+
+    def group(self, dev):
+        """slow, shared (healthy, on a slow device's port) or healthy."""
+        if dev is None:
+            return "healthy"
+        if dev.slow:
+            return "slow"
+        k = self.args.per_host
+        host = self.devices[dev.index // k * k:dev.index // k * k + k]
+        return "shared" if any(d.slow for d in host) else "healthy"
+
+    async def serve(self, reader, writer):
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = Conn(writer)
+        self.conns.add(conn)
+        answering = asyncio.ensure_future(self.answer(conn))
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                parts = lines[0].split(" ")
+                headers = {}
+                for line in lines[1:]:
+                    k, _, v = line.partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                length = int(headers.get("content-length") or 0)
+                if length:
+                    try:
+                        await reader.readexactly(length)
+                    except (asyncio.IncompleteReadError, ConnectionError):
+                        break
+                path = parts[1] if len(parts) > 1 else ""
+                _, dev_name, endpoint = (path.split("?")[0].split("/", 2) + ["", ""])[:3]
+                dev = self.by_name.get(dev_name)
+                phase = self.phase
+                group = self.group(dev)
+                if not conn.requests:
+                    phase.opened[group] += 1
+                phase.used[group].add(conn)
+                if conn.pending:
+                    phase.owed[group] += 1
+                conn.requests += 1
+                conn.pending += 1
+                phase.requests[group] += 1
+                if dev and endpoint in ENDPOINTS:
+                    dev.polls[endpoint].append(time.perf_counter())
+                close = headers.get("connection", "").lower() == "close" or parts[-1] == "HTTP/1.0"
+                conn.queue.put_nowait((dev, endpoint, close))
+        finally:
+            # whatever is still owed can no longer be delivered
+            answering.cancel()
+            self.conns.discard(conn)
+            writer.close()
+
+    async def answer(self, conn):
+        args = self.args
+        writer = conn.writer
+        while True:
+            dev, endpoint, close = await conn.queue.get()
+            phase = self.phase
+            self.in_flight += 1
+            phase.max_in_flight = max(phase.max_in_flight, self.in_flight)
+            try:
+                if dev is None or endpoint not in ENDPOINTS:
+                    phase.errors["404"] += 1
+                    await self.send(writer, 404, b'{"error":"not found"}', False)
+                    continue
+                delay = args.latency[endpoint] + self.rng.uniform(0, args.jitter)
+                if dev.slow:
+                    delay += args.slow_latency
+                    roll = self.rng.random()
+                    if roll < args.stall:
+                        phase.stalls += 1
+                        await asyncio.Future()   # until the client closes
+                    if roll < args.stall + args.reset:
+                        phase.resets += 1
+                        await asyncio.sleep(delay / 1000)
+                        self.reset(writer)
+                        return
+                await asyncio.sleep(delay / 1000)
+                chunked = self.rng.random() < args.chunked
+                phase.chunked += chunked
+                await self.send(writer, 200, dev.body(endpoint, args.pad), chunked)
+                if close:
+                    writer.close()
+                    return
+            except ConnectionError:
+                return
+            finally:
+                self.in_flight -= 1
+                conn.pending -= 1
+
+    async def send(self, writer, status, body, chunked):
+        reason = {200: "OK", 404: "Not Found"}[status]
+        head = f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+        if not chunked:
+            writer.write((head + f"Content-Length: {len(body)}\r\n\r\n").encode() + body)
+            await writer.drain()
+            return
+        writer.write((head + "Transfer-Encoding: chunked\r\n\r\n").encode())
+        for i in range(0, len(body), self.args.chunk):
+            piece = body[i:i + self.args.chunk]
+            writer.write(f"{len(piece):x}\r\n".encode() + piece + b"\r\n")
+            await writer.drain()
+            if self.args.chunk_gap:
+                await asyncio.sleep(self.args.chunk_gap / 1000)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def reset(writer):
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        writer.transport.abort()
+
+    def begin(self, name):
+        for dev in self.devices:
+            dev.polls.clear()
+        self.phase = Phase(name)
+        return self.phase
+
+    def end(self):
+        self.phase.end = time.perf_counter()
+        self.phase = Phase("between")
+
+
+def intervals(devices, endpoint, phase):
+    out = []
+    for dev in devices:
+        t = [t for t in dev.polls.get(endpoint, []) if t <= phase.end]
+        out += [(b - a) * 1000 for a, b in zip(t, t[1:])]
+    return out
+
+
+def summarise(sim, phase):
+    duration = phase.end - phase.start
+    rows = []
+    for group in ("healthy", "shared", "slow"):
+        devices = [d for d in sim.devices if sim.group(d) == group]
+        if not devices:
+            continue
+        row = {"phase": phase.name, "group": group, "devices": len(devices),
+               "req_per_s": phase.requests[group] / duration,
+               "connections": len(phase.used[group]), "opened": phase.opened[group],
+               "req_per_conn": phase.requests[group] / max(1, len(phase.used[group])),
+               "owed": phase.owed[group], "endpoints": {}}
+        for endpoint, want in ENDPOINTS.items():
+            if want is None:
+                continue
+            iv = intervals(devices, endpoint, phase)
+            unpolled = sum(1 for d in devices if not d.polls.get(endpoint))
+            row["endpoints"][endpoint] = {"want_ms": want, "p50_ms": percentile(iv, 50),
+                                          "p99_ms": percentile(iv, 99), "max_ms": max(iv, default=math.nan),
+                                          "unpolled": unpolled}
+        rows.append(row)
+    return rows
+
+
+def print_phase(phase, rows, cpu, ticks):
+    duration = phase.end - phase.start
+    extra = f", {phase.stalls} stalled, {phase.resets} reset" if phase.stalls or phase.resets else ""
+    print(f"\n{phase.name}: {duration:.0f}s, {phase.chunked} chunked answers{extra}, "
+          f"{phase.max_in_flight} answers in flight at most"
+          + (f", OpenWatt {cpu:.0f}% CPU" if cpu is not None else "")
+          + (f", {len(ticks)} slow ticks (worst {max(ticks, default=(0, ''))[0]} ms)"
+             if ticks is not None else ""))
+    print(f"{'group':>8} {'endpoint':>9} {'want':>8} {'p50':>8} {'p99':>8} {'max':>8} {'unpolled':>8}"
+          f" {'req/s':>7} {'conns':>6} {'opened':>6} {'req/conn':>8} {'owed':>5}")
+    for row in rows:
+        first = True
+        for endpoint, e in row["endpoints"].items():
+            lead = (f"{row['req_per_s']:7.1f} {row['connections']:6} {row['opened']:6} "
+                    f"{row['req_per_conn']:8.1f} {row['owed']:5}"
+                    if first else "")
+            print(f"{row['group'] if first else '':>8} {endpoint:>9} {e['want_ms']:8} "
+                  f"{ms(e['p50_ms'] / 1000, 0)} {ms(e['p99_ms'] / 1000, 0)} {ms(e['max_ms'] / 1000, 0)} "
+                  f"{e['unpolled']:8} {lead}")
+            first = False
+
+
+def provision(console, args, hosts):
+    send_all(console, [f"/protocol/http/client/add name=rest{h} remote=http://{args.host}:{args.base_port + h}"
+                       for h in range(hosts)]
+             + [f"/binding/http/client/add name=rest-d{i} device=rest-d{i} "
+                f"client=rest{i // args.per_host} profile={PROFILE} dev=d{i}" for i in range(args.devices)])
+
+
+async def run(args, ow):
+    sim = Sim(args)
+    hosts = await sim.start()
+    print(f"{args.devices} devices on {hosts} port(s) from {args.host}:{args.base_port}, "
+          f"{args.per_host} per port")
+    pid = ow.process.pid if ow else None
+    stderr = str(ow.stderr_path) if ow else None
+    if ow:
+        provision(ow.get_console(), args, hosts)
+        print(f"provisioned {hosts} http-clients and {args.devices} bindings")
+    await asyncio.sleep(args.warmup)
+    _, offset = slow_ticks(stderr, 0)
+
+    names = ["healthy"] + (["slow"] if args.slow else [])
+    results = {"devices": args.devices, "per_host": args.per_host, "slow": args.slow,
+               "latency": args.latency, "slow_latency": args.slow_latency, "stall": args.stall,
+               "reset": args.reset, "chunked": args.chunked, "phases": []}
+    rows_by_phase = {}
+    for name in names:
+        if name == "slow":
+            for dev in sim.devices[:args.slow]:
+                dev.slow = True
+        phase = sim.begin(name)
+        cpu0 = cpu_seconds(pid) if pid else None
+        await asyncio.sleep(args.duration)
+        sim.end()
+        cpu1 = cpu_seconds(pid) if pid else None
+        cpu = (cpu1 - cpu0) / (phase.end - phase.start) * 100 if cpu0 is not None and cpu1 is not None else None
+        ticks, offset = slow_ticks(stderr, offset)
+        rows = summarise(sim, phase)
+        rows_by_phase[name] = rows
+        print_phase(phase, rows, cpu, ticks if stderr else None)
+        results["phases"].append({"phase": name, "rows": rows, "stalls": phase.stalls, "resets": phase.resets,
+                                  "chunked": phase.chunked, "max_in_flight": phase.max_in_flight,
+                                  "cpu_pct": cpu, "slow_ticks": len(ticks) if stderr else None})
+
+    if "slow" in rows_by_phase:
+        before = next(r for r in rows_by_phase["healthy"] if r["group"] == "healthy")
+        print(f"\nhealthy devices' poll intervals, all healthy -> {args.slow} slow:")
+        for row in rows_by_phase["slow"]:
+            if row["group"] == "slow":
+                continue
+            for endpoint, b in row["endpoints"].items():
+                a = before["endpoints"][endpoint]
+                print(f"{row['group']:>8} {endpoint:>9}  "
+                      f"p99 {ms(a['p99_ms'] / 1000, 0)} ->{ms(b['p99_ms'] / 1000, 0)} ms   "
+                      f"max {ms(a['max_ms'] / 1000, 0)} ->{ms(b['max_ms'] / 1000, 0)} ms")
+
+    await sim.close()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {args.json}")
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--devices", type=int, default=200)
+    ap.add_argument("--per-host", type=int, default=1, help="devices per port (per http-client)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--base-port", type=int, default=18100)
+    ap.add_argument("--start", nargs="?", const="bin/x86_64_debug/openwatt", metavar="BINARY",
+                    help="start OpenWatt and add a client per port and a binding per device")
+    ap.add_argument("--latency", type=parse_latency, default=parse_latency("5"),
+                    metavar="MS|EP=MS,...", help="answer latency, for all endpoints or per endpoint")
+    ap.add_argument("--jitter", type=float, default=5.0, help="ms of uniform jitter on top")
+    ap.add_argument("--chunked", type=float, default=0.0, help="fraction of answers sent chunked")
+    ap.add_argument("--chunk", type=int, default=16, help="bytes per chunk")
+    ap.add_argument("--chunk-gap", type=float, default=2.0, help="ms between chunks")
+    ap.add_argument("--pad", type=int, default=0, help="filler bytes in each status answer")
+    ap.add_argument("--slow", type=int, default=0, help="devices made slow in the second phase")
+    ap.add_argument("--slow-latency", type=float, default=3000.0, help="ms added to a slow device's answers")
+    ap.add_argument("--stall", type=float, default=0.0, help="fraction of a slow device's requests never answered")
+    ap.add_argument("--reset", type=float, default=0.0, help="fraction of a slow device's requests answered with RST")
+    ap.add_argument("--warmup", type=float, default=5.0, help="seconds before the first phase")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds per phase")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = ap.parse_args()
+    if args.per_host < 1:
+        ap.error("--per-host must be at least 1")
+    args.slow = min(args.slow, args.devices)
+
+    ow = openwatt(args.start, "rest_sim") if args.start else None
+    with generated_profile(ow, PROFILE, profile_text()):
+        if ow and not ow.start():
+            return 1
+        try:
+            return asyncio.run(run(args, ow))
+        except KeyboardInterrupt:
+            return 0
+        finally:
+            if ow:
+                ow.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
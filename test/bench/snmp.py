@@ -0,0 +1,161 @@
+"""Just enough BER and SNMPv1/v2c for the SNMP benchmarks.
+
+Messages are built and taken apart whole; a varbind is (oid, (tag, value))
+with the oid a tuple of ints and the value an int, bytes, an oid tuple or
+None, by tag:
+
+    data = snmp.message(snmp.V2C, b"public", snmp.GETBULK, 7,
+                        [((1, 3, 6, 1), (snmp.NULL, None))], 0, 25)
+    snmp.parse_message(data) -> Message(version, community, pdu, request_id,
+                                        a, b, varbinds)
+
+`a`/`b` are error-status/error-index, or non-repeaters/max-repetitions in a
+GETBULK.
+"""
+
+from collections import namedtuple
+
+V1, V2C = 0, 1
+
+INTEGER, OCTETS, NULL, OID = 0x02, 0x04, 0x05, 0x06
+SEQUENCE = 0x30
+IPADDR, COUNTER32, GAUGE32, TIMETICKS, OPAQUE, COUNTER64 = 0x40, 0x41, 0x42, 0x43, 0x44, 0x46
+NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB = 0x80, 0x81, 0x82
+EXCEPTIONS = (NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB)
+
+GET, GETNEXT, RESPONSE, SET, GETBULK = 0xA0, 0xA1, 0xA2, 0xA3, 0xA5
+UNSIGNED = (COUNTER32, GAUGE32, TIMETICKS, COUNTER64)
+
+NO_ERROR, TOO_BIG = 0, 1
+
+Message = namedtuple("Message", "version community pdu request_id a b varbinds")
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def length(n):
+    if n < 0x80:
+        return bytes((n,))
+    body = n.to_bytes((n.bit_length() + 7) // 8, "big")
+    return bytes((0x80 | len(body),)) + body
+
+
+def tlv(tag, body):
+    return bytes((tag,)) + length(len(body)) + body
+
+
+def integer(n, tag=INTEGER):
+    if tag in UNSIGNED:
+        body = n.to_bytes(n.bit_length() // 8 + 1, "big")
+    else:
+        body = n.to_bytes((n + (n < 0)).bit_length() // 8 + 1, "big", signed=True)
+    return tlv(tag, body)
+
+
+def oid(arcs):
+    if len(arcs) < 2:
+        arcs = tuple(arcs) + (0,) * (2 - len(arcs))
+    out = bytearray((arcs[0] * 40 + arcs[1],))
+    for a in arcs[2:]:
+        chunk = [a & 0x7F]
+        a >>= 7
+        while a:
+            chunk.append(0x80 | a & 0x7F)
+            a >>= 7
+        out += bytes(reversed(chunk))
+    return tlv(OID, bytes(out))
+
+
+def value(tag, v):
+    if tag == INTEGER or tag in UNSIGNED:
+        return integer(v, tag)
+    if tag == OID:
+        return oid(v)
+    if tag in (OCTETS, IPADDR, OPAQUE):
+        return tlv(tag, v)
+    return tlv(tag, b"")
+
+
+def varbind(name, tagged):
+    return tlv(SEQUENCE, oid(name) + value(*tagged))
+
+
+def message(version, community, pdu, request_id, varbinds, a=0, b=0):
+    body = integer(request_id) + integer(a) + integer(b)
+    body += tlv(SEQUENCE, b"".join(varbind(n, v) for n, v in varbinds))
+    return tlv(SEQUENCE, integer(version) + tlv(OCTETS, community) + tlv(pdu, body))
+
+
+def read_tlv(data, pos):
+    """(tag, start, end) of the element at pos."""
+    if pos + 2 > len(data):
+        raise ProtocolError("truncated")
+    tag, n = data[pos], data[pos + 1]
+    pos += 2
+    if n & 0x80:
+        k = n & 0x7F
+        n = int.from_bytes(data[pos:pos + k], "big")
+        pos += k
+    if pos + n > len(data):
+        raise ProtocolError("truncated")
+    return tag, pos, pos + n
+
+
+def parse_oid(body):
+    if not body:
+        return ()
+    arcs = [body[0] // 40, body[0] % 40]
+    n = 0
+    for b in body[1:]:
+        n = n << 7 | b & 0x7F
+        if not b & 0x80:
+            arcs.append(n)
+            n = 0
+    return tuple(arcs)
+
+
+def parse_value(tag, body):
+    if tag == INTEGER:
+        return int.from_bytes(body, "big", signed=True)
+    if tag in UNSIGNED:
+        return int.from_bytes(body, "big")
+    if tag == OID:
+        return parse_oid(body)
+    if tag in (NULL,) + EXCEPTIONS:
+        return None
+    return bytes(body)
+
+
+def parse_message(data):
+    tag, pos, end = read_tlv(data, 0)
+    if tag != SEQUENCE:
+        raise ProtocolError(f"not a message (tag {tag:#x})")
+    fields = []
+    for _ in range(2):
+        tag, start, pos = read_tlv(data, pos)
+        fields.append(parse_value(tag, data[start:pos]))
+    pdu, pos, end = read_tlv(data, pos)
+    for _ in range(3):
+        tag, start, pos = read_tlv(data, pos)
+        fields.append(parse_value(tag, data[start:pos]))
+    _, pos, end = read_tlv(data, pos)
+    varbinds = []
+    while pos < end:
+        _, pos, vb_end = read_tlv(data, pos)
+        _, start, pos = read_tlv(data, pos)
+        name = parse_oid(data[start:pos])
+        tag, start, pos = read_tlv(data, pos)
+        varbinds.append((name, (tag, parse_value(tag, data[start:pos]))))
+        pos = vb_end
+    version, community, request_id, a, b = fields
+    return Message(version, community, pdu, request_id, a, b, varbinds)
+
+
+def parse_dotted(text):
+    return tuple(int(a) for a in text.strip(".").split(".") if a)
+
+
+def dotted(arcs):
+    return ".".join(map(str, arcs))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""A stand-in SNMP agent serving a synthetic device tree.
+
+Answers v1/v2c GET, GETNEXT and GETBULK the way src/protocol/snmp/agent.d
+does: one 1500-byte datagram each way, a GETBULK filled to
+max-repetitions whatever that comes to, and a response that does not fit
+dropped rather than answered. --truncate answers instead with as many
+varbinds as fit (what RFC 3416 asks of GETBULK), to compare against.
+
+The tree is the system group plus --elements readings under an enterprise
+arc, laid out device.component.element like OpenWatt's, so a walker sees
+something the size and shape of a gateway's. --lookup picks how the agent
+finds the next OID: bisect over the sorted list, or a linear scan, which
+is what a handler walking the device tree element by element costs.
+
+  python3 test/bench/snmp_agent.py [--port 1161] [--elements N]
+      [--lookup bisect|scan] [--truncate] [--community public]
+"""
+
+import argparse
+import asyncio
+import bisect
+import sys
+import time
+
+import snmp
+
+ENTERPRISE = (1, 3, 6, 1, 4, 1, 99999, 1)
+SYSTEM = (1, 3, 6, 1, 2, 1, 1)
+MTU = 1500
+PER_COMPONENT = 12
+PER_DEVICE = 4
+
+
+def build_tree(elements):
+    """Sorted [(oid, (tag, value))]."""
+    tree = [
+        (SYSTEM + (1, 0), (snmp.OCTETS, b"OpenWatt bench agent")),
+        (SYSTEM + (2, 0), (snmp.OID, ENTERPRISE)),
+        (SYSTEM + (3, 0), (snmp.TIMETICKS, 0)),
+        (SYSTEM + (5, 0), (snmp.OCTETS, b"bench")),
+    ]
+    kinds = ((snmp.GAUGE32, 23000), (snmp.INTEGER, -120), (snmp.COUNTER64, 10 ** 9),
+             (snmp.OCTETS, b"ok"))
+    for i in range(elements):
+        component, element = divmod(i, PER_COMPONENT)
+        device, component = divmod(component, PER_DEVICE)
+        tag, v = kinds[element % len(kinds)]
+        tree.append((ENTERPRISE + (device + 1, component + 1, element + 1),
+                     (tag, v + i if isinstance(v, int) else v)))
+    tree.sort()
+    return tree
+
+
+class Agent(asyncio.DatagramProtocol):
+    def __init__(self, tree, community, lookup, truncate):
+        self.tree = tree
+        self.names = [n for n, _ in tree]
+        self.values = dict(tree)
+        self.community = community
+        self.next = self.next_scan if lookup == "scan" else self.next_bisect
+        self.truncate = truncate
+        self.started = time.monotonic()
+        self.transport = None
+        self.requests = self.responses = self.dropped = self.truncated = 0
+        self.varbinds = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def next_bisect(self, name):
+        i = bisect.bisect_right(self.names, name)
+        return self.tree[i] if i < len(self.tree) else None
+
+    def next_scan(self, name):
+        for entry in self.tree:
+            if entry[0] > name:
+                return entry
+        return None
+
+    def get(self, name):
+        if name == SYSTEM + (3, 0):
+            return snmp.TIMETICKS, int((time.monotonic() - self.started) * 100)
+        return self.values.get(name, (snmp.NO_SUCH_OBJECT, None))
+
+    def get_next(self, name):
+        entry = self.next(name)
+        if entry is None:
+            return name, (snmp.END_OF_MIB, None)
+        return entry[0], self.get(entry[0])
+
+    def datagram_received(self, data, addr):
+        try:
+            msg = snmp.parse_message(data)
+        except (snmp.ProtocolError, ValueError, IndexError):
+            return
+        if msg.community != self.community:
+            return
+        self.requests += 1
+        if msg.pdu == snmp.GET:
+            out = [(n, self.get(n)) for n, _ in msg.varbinds]
+        elif msg.pdu == snmp.GETNEXT:
+            out = [self.get_next(n) for n, _ in msg.varbinds]
+        elif msg.pdu == snmp.GETBULK and msg.version != snmp.V1:
+            out = self.get_bulk(msg)
+        else:
+            return
+        reply = snmp.message(msg.version, msg.community, snmp.RESPONSE, msg.request_id, out)
+        if len(reply) > MTU:
+            if not self.truncate:
+                self.dropped += 1
+                return
+            # what fits, by bisecting on the varbind count
+            lo, hi = 0, len(out)
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if len(snmp.message(msg.version, msg.community, snmp.RESPONSE,
+                                    msg.request_id, out[:mid])) <= MTU:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            out = out[:lo]
+            reply = snmp.message(msg.version, msg.community, snmp.RESPONSE, msg.request_id, out)
+            self.truncated += 1
+        self.responses += 1
+        self.varbinds += len(out)
+        self.transport.sendto(reply, addr)
+
+    def get_bulk(self, msg):
+        nr = max(0, min(msg.a, len(msg.varbinds)))
+        out = [self.get_next(n) for n, _ in msg.varbinds[:nr]]
+        cursors = [n for n, _ in msg.varbinds[nr:]]
+        for _ in range(max(0, msg.b)):
+            progress = False
+            for j, cursor in enumerate(cursors):
+                name, v = self.get_next(cursor)
+                if v[0] != snmp.END_OF_MIB:
+                    cursors[j] = name
+                    progress = True
+                out.append((name, v))
+            if not cursors or not progress:
+                break
+        return out
+
+
+async def serve(args):
+    tree = build_tree(args.elements)
+    loop = asyncio.get_running_loop()
+    transport, agent = await loop.create_datagram_endpoint(
+        lambda: Agent(tree, args.community.encode(), args.lookup, args.truncate),
+        local_addr=(args.host, args.port))
+    port = transport.get_extra_info("sockname")[1]
+    print(f"listening on {args.host}:{port}: {len(tree)} objects, {args.lookup} lookup"
+          f"{', truncating' if args.truncate else ''}", flush=True)
+    last = (0, 0)
+    while True:
+        await asyncio.sleep(args.interval)
+        if args.quiet:
+            continue
+        now = (agent.requests, agent.varbinds)
+        print(f"requests/s {(now[0] - last[0]) / args.interval:8.0f}  varbinds/s "
+              f"{(now[1] - last[1]) / args.interval:9.0f}  dropped {agent.dropped}  "
+              f"truncated {agent.truncated}", flush=True)
+        last = now
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=1161)
+    ap.add_argument("--elements", type=int, default=1000, help="readings in the tree")
+    ap.add_argument("--lookup", choices=("bisect", "scan"), default="bisect")
+    ap.add_argument("--truncate", action="store_true",
+                    help="answer oversized GETBULKs with what fits instead of dropping them")
+    ap.add_argument("--community", default="public")
+    ap.add_argument("--interval", type=float, default=5.0)
+    ap.add_argument("--quiet", action="store_true", help="no periodic stats")
+    args = ap.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""Walk an SNMP agent's whole tree and measure how fast it gives it up.
+
+An NMS polling a gateway every minute walks everything it exports; with
+enough devices behind it the walk outlasts the poll interval and the next
+one starts on top of it. This runs the walks an NMS would, each from
+--managers managers at once (one socket each), over v2c:
+
+    getnext     one GETNEXT per object; also gives the object list
+    getbulk     GETBULK at each --max-rep, one row per value
+    get         GET of every object walked, --get-batch names a request
+
+and reports per walk OIDs/s, requests, request latency p50/p99, response
+size (mean and max against the 1500-byte datagram the agent answers in),
+and requests that got no answer. src/protocol/snmp/agent.d drops a
+response that does not fit, so a GETBULK whose max-repetitions is too
+generous shows up as unanswered, not as a short reply.
+
+The cost of finding the next OID shows as GETNEXT latency by position in
+the tree (first tenth against last: a flat line is a lookup that does not
+care how far in it is), and, with --agent-elements, as how the figures move
+with the element count: each size is served in turn by a snmp_agent.py
+child process (--lookup and --truncate are passed on to it).
+
+  python3 test/bench/snmp_walk.py [--host H] [--port 161] [--community C]
+      [--root OID] [--managers N] [--max-rep 1,10,50] [--modes getnext,getbulk,get]
+      [--agent-elements 1000,10000] [--start [BINARY]] [--json PATH]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import snmp
+from common import openwatt, percentile, send_all
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+MTU = 1500
+BUCKETS = 10
+
+
+class Manager(asyncio.DatagramProtocol):
+    """One manager socket; request() is a round trip with retries."""
+
+    def __init__(self, community, timeout, retries):
+        self.community = community
+        self.timeout, self.retries = timeout, retries
+        self.pending = {}
+        self.next_id = random.randrange(1, 1 << 30)
+        self.transport = None
+
+    @classmethod
+    async def open(cls, host, port, community, timeout=1.0, retries=1):
+        loop = asyncio.get_running_loop()
+        _, m = await loop.create_datagram_endpoint(
+            lambda: cls(community, timeout, retries), remote_addr=(host, port))
+        return m
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            msg = snmp.parse_message(data)
+        except (snmp.ProtocolError, ValueError, IndexError):
+            return
+        fut = self.pending.pop(msg.request_id, None)
+        if fut and not fut.done():
+            fut.set_result((msg, len(data), time.perf_counter()))
+
+    async def request(self, pdu, names, a=0, b=0):
+        """(message, response bytes, seconds); TimeoutError if nothing came back."""
+        for _ in range(self.retries + 1):
+            self.next_id = self.next_id % 0x7FFFFFFF + 1
+            rid = self.next_id
+            fut = self.pending[rid] = asyncio.get_running_loop().create_future()
+            t = time.perf_counter()
+            self.transport.sendto(snmp.message(snmp.V2C, self.community, pdu, rid,
+                                               [(n, (snmp.NULL, None)) for n in names], a, b))
+            try:
+                msg, size, done = await asyncio.wait_for(fut, self.timeout)
+                return msg, size, done - t
+            except asyncio.TimeoutError:
+                self.pending.pop(rid, None)
+        raise asyncio.TimeoutError
+
+    def close(self):
+        self.transport.close()
+
+
+class Stats:
+    def __init__(self):
+        self.requests = self.oids = self.unanswered = self.errors = 0
+        self.latency = []
+        self.sizes = []
+        self.names = []
+        self.elapsed = 0.0
+
+    def add(self, size, seconds, oids):
+        self.requests += 1
+        self.oids += oids
+        self.sizes.append(size)
+        self.latency.append(seconds)
+
+
+def in_view(root, name, v):
+    return v[0] != snmp.END_OF_MIB and name[:len(root)] == root
+
+
+async def walk_next(m, root, stats):
+    cursor = root
+    while True:
+        msg, size, t = await m.request(snmp.GETNEXT, [cursor])
+        name, v = msg.varbinds[0] if msg.varbinds else (cursor, (snmp.END_OF_MIB, None))
+        if not in_view(root, name, v) or name <= cursor:
+            stats.add(size, t, 0)
+            return
+        stats.add(size, t, 1)
+        stats.names.append(name)
+        cursor = name
+
+
+async def walk_bulk(m, root, max_rep, stats):
+    cursor = root
+    while True:
+        msg, size, t = await m.request(snmp.GETBULK, [cursor], 0, max_rep)
+        got = 0
+        for name, v in msg.varbinds:
+            if not in_view(root, name, v) or name <= cursor:
+                stats.add(size, t, got)
+                return
+            cursor = name
+            got += 1
+        stats.add(size, t, got)
+        if not got:
+            return
+
+
+async def get_all(m, names, batch, stats):
+    for i in range(0, len(names), batch):
+        chunk = names[i:i + batch]
+        msg, size, t = await m.request(snmp.GET, chunk)
+        if msg.a != snmp.NO_ERROR:
+            stats.errors += 1
+        stats.add(size, t, sum(1 for _, v in msg.varbinds if v[0] not in snmp.EXCEPTIONS))
+
+
+async def run_mode(args, mode, max_rep=None, names=None):
+    """One walk per manager, all at once; (aggregate stats, per-walk seconds)."""
+    managers = [await Manager.open(args.host, args.port, args.community.encode(),
+                                   args.timeout, args.retries) for _ in range(args.managers)]
+    walks = [Stats() for _ in managers]
+
+    async def one(m, stats):
+        t = time.perf_counter()
+        try:
+            if mode == "getnext":
+                await walk_next(m, args.root, stats)
+            elif mode == "getbulk":
+                await walk_bulk(m, args.root, max_rep, stats)
+            else:
+                await get_all(m, names, args.get_batch, stats)
+        except asyncio.TimeoutError:
+            stats.unanswered += 1
+        stats.elapsed = time.perf_counter() - t
+
+    t = time.perf_counter()
+    await asyncio.gather(*(one(m, s) for m, s in zip(managers, walks)))
+    wall = time.perf_counter() - t
+    for m in managers:
+        m.close()
+    total = Stats()
+    for s in walks:
+        total.requests += s.requests
+        total.oids += s.oids
+        total.unanswered += s.unanswered
+        total.errors += s.errors
+        total.latency += s.latency
+        total.sizes += s.sizes
+    total.elapsed = wall
+    total.names = walks[0].names
+    total.by_position = walks[0].latency
+    return total, [s.elapsed for s in walks]
+
+
+def row(mode, max_rep, stats, walk_secs, args):
+    r = {
+        "mode": mode, "max_rep": max_rep, "managers": args.managers,
+        "oids": stats.oids, "requests": stats.requests,
+        "oids_per_s": stats.oids / stats.elapsed if stats.elapsed else 0.0,
+        "walk_s": max(walk_secs, default=0.0),
+        "p50_ms": percentile(stats.latency, 50, 0.0) * 1000, "p99_ms": percentile(stats.latency, 99, 0.0) * 1000,
+        "mean_bytes": statistics.mean(stats.sizes) if stats.sizes else 0,
+        "max_bytes": max(stats.sizes, default=0),
+        "unanswered": stats.unanswered, "errors": stats.errors,
+    }
+    print(f"{mode:>8} {max_rep if max_rep else '-':>7} {r['oids']:8} {r['requests']:8} "
+          f"{r['oids_per_s']:9.0f} {r['walk_s']:8.2f}s {r['p50_ms']:7.2f} {r['p99_ms']:7.2f} "
+          f"{r['mean_bytes']:6.0f} {r['max_bytes']:6}{'*' if r['max_bytes'] > MTU - 100 else ' '}"
+          f" {r['unanswered']:5}")
+    return r
+
+
+def lookup_cost(latency):
+    """GETNEXT p50 (ms) per tenth of the walk, in order."""
+    if len(latency) < BUCKETS * 5:
+        return []
+    n = len(latency) // BUCKETS
+    return [statistics.median(latency[i * n:(i + 1) * n]) * 1000 for i in range(BUCKETS)]
+
+
+async def run_all(args):
+    """Every mode against the agent at --host/--port; the rows and lookup curve."""
+    rows, names, curve = [], [], []
+    print(f"{'mode':>8} {'max-rep':>7} {'oids':>8} {'requests':>8} {'oids/s':>9} {'walk':>9} "
+          f"{'p50 ms':>7} {'p99 ms':>7} {'mean B':>6} {'max B':>7} {'lost':>5}")
+    if "getnext" in args.modes or "get" in args.modes:
+        stats, secs = await run_mode(args, "getnext")
+        names = stats.names
+        curve = lookup_cost(stats.by_position)
+        if "getnext" in args.modes:
+            rows.append(row("getnext", None, stats, secs, args))
+    if "getbulk" in args.modes:
+        for max_rep in args.max_rep:
+            stats, secs = await run_mode(args, "getbulk", max_rep)
+            rows.append(row("getbulk", max_rep, stats, secs, args))
+    if "get" in args.modes and names:
+        stats, secs = await run_mode(args, "get", names=names)
+        rows.append(row("get", None, stats, secs, args))
+
+    if any(r["max_bytes"] > MTU - 100 for r in rows):
+        print(f"  * responses within 100 bytes of the {MTU}-byte datagram")
+    if any(r["unanswered"] for r in rows):
+        print("  lost: walks that ended on a request with no answer after retries "
+              "(an oversized GETBULK response is dropped by the agent)")
+    if not names and ("getnext" in args.modes or "get" in args.modes):
+        print(f"  nothing under {snmp.dotted(args.root)}: the agent exports no objects there")
+    if curve:
+        print("GETNEXT p50 by position in the walk (ms): "
+              + " ".join(f"{v:.2f}" for v in curve)
+              + f"   last/first {curve[-1] / curve[0]:.1f}x")
+    walked = [r for r in rows if not r["unanswered"] and r["oids"]]
+    if walked and args.poll:
+        best = min(walked, key=lambda r: r["walk_s"])
+        worst = max(walked, key=lambda r: r["walk_s"])
+        label = lambda r: r["mode"] + (f" {r['max_rep']}" if r["max_rep"] else "")
+        print(f"full walk: {best['walk_s']:.2f}s ({label(best)}) to {worst['walk_s']:.2f}s "
+              f"({label(worst)}), {worst['walk_s'] / args.poll * 100:.0f}% of a {args.poll:.0f}s "
+              f"poll at worst")
+    return {"objects": len(names), "rows": rows, "getnext_by_position_ms": curve}
+
+
+def spawn_agent(args, elements):
+    """A snmp_agent.py child serving `elements`; (process, port)."""
+    cmd = [sys.executable, os.path.join(HERE, "snmp_agent.py"), "--port", "0", "--quiet",
+           "--elements", str(elements), "--lookup", args.lookup, "--community", args.community]
+    if args.truncate:
+        cmd.append("--truncate")
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    line = p.stdout.readline()
+    if not line.startswith("listening on "):
+        p.kill()
+        sys.exit(f"snmp_agent.py did not start: {line.strip()}")
+    return p, int(line.split(":")[1])
+
+
+def provision(console, args):
+    send_all(console, (f"/protocol/snmp/agent add name=bench port={args.port} trap-port=0 "
+                       f"community={args.community}",))
+
+
+def parse_list(text):
+    return [int(x) for x in text.split(",") if x]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=1161)
+    ap.add_argument("--community", default="public")
+    ap.add_argument("--root", type=snmp.parse_dotted, default=(1, 3, 6, 1),
+                    help="subtree to walk (default 1.3.6.1)")
+    ap.add_argument("--managers", type=int, default=1, help="concurrent managers")
+    ap.add_argument("--modes", type=lambda s: s.split(","), default=["getnext", "getbulk", "get"])
+    ap.add_argument("--max-rep", type=parse_list, default=[1, 5, 10, 25, 50, 100],
+                    help="GETBULK max-repetitions to sweep")
+    ap.add_argument("--get-batch", type=int, default=10, help="names per GET")
+    ap.add_argument("--timeout", type=float, default=1.0, help="seconds per try")
+    ap.add_argument("--retries", type=int, default=1)
+    ap.add_argument("--poll", type=float, default=60.0, help="NMS poll interval to compare with")
+    ap.add_argument("--agent-elements", type=parse_list, metavar="N,N,...",
+                    help="walk a snmp_agent.py stand-in at each element count instead")
+    ap.add_argument("--lookup", choices=("bisect", "scan"), default="bisect",
+                    help="stand-in's next-OID lookup")
+    ap.add_argument("--truncate", action="store_true",
+                    help="stand-in answers oversized GETBULKs with what fits")
+    ap.add_argument("--start", nargs="?", const="bin/x86_64_debug/openwatt", metavar="BINARY",
+                    help="start OpenWatt and walk its agent on --port")
+    ap.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = ap.parse_args()
+
+    results = {"managers": args.managers, "root": snmp.dotted(args.root), "runs": []}
+    if args.agent_elements:
+        for elements in args.agent_elements:
+            p, args.port = spawn_agent(args, elements)
+            print(f"\n{elements} elements, {args.lookup} lookup"
+                  f"{', truncating' if args.truncate else ''}:")
+            try:
+                run = asyncio.run(run_all(args))
+            finally:
+                p.kill()
+                p.wait()
+            run["elements"] = elements
+            results["runs"].append(run)
+        print(f"\n{'elements':>8} {'objects':>8} {'getnext/s':>10} {'best bulk/s':>12} "
+              f"{'at rep':>6} {'first ms':>9} {'last ms':>8}")
+        for run in results["runs"]:
+            nxt = next((r for r in run["rows"] if r["mode"] == "getnext"), None)
+            bulk = max((r for r in run["rows"] if r["mode"] == "getbulk" and not r["unanswered"]),
+                       key=lambda r: r["oids_per_s"], default=None)
+            curve = run["getnext_by_position_ms"] or [0, 0]
+            print(f"{run['elements']:8} {run['objects']:8} "
+                  f"{nxt['oids_per_s'] if nxt else 0:10.0f} "
+                  f"{bulk['oids_per_s'] if bulk else 0:12.0f} {bulk['max_rep'] if bulk else '-':>6} "
+                  f"{curve[0]:9.2f} {curve[-1]:8.2f}")
+    else:
+        ow = None
+        if args.start:
+            ow = openwatt(args.start, "snmp_walk")
+            if not ow.start():
+                return 1
+        try:
+            if ow:
+                provision(ow.get_console(), args)
+                time.sleep(0.5)
+            print(f"walking {snmp.dotted(args.root)} on {args.host}:{args.port} "
+                  f"with {args.managers} manager(s)")
+            results["runs"].append(asyncio.run(run_all(args)))
+        finally:
+            if ow:
+                ow.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"wrote {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+"""Simulated Tesla Wall Connector slaves on an RS485 bus, for the TWC master.
+
+One pseudo-terminal is the bus; --chargers slaves sit on it and answer
+src/protocol/tesla/master.d as Gen2 TWCs would: SlaveLinkReady until the
+master heartbeats them, a slave heartbeat (state, offered current, current
+in use) for every master heartbeat, and charge info, serial number and VIN
+for the requests in between. Frames are SLIP-style (C0 ... C0, DB escapes,
+additive checksum) and go out paced at --baud; with --trickle they go a
+byte at a time, as a UART delivers them, rather than a frame per write.
+
+Each slave with a car (--cars) goes plugged-in -> starting -> charging
+when the master offers current, then takes LimitCurrent commands, with
+the car ramping its draw at --ramp A/s. A slave that hears no heartbeat
+for --fallback-after seconds drops to --fallback amps until the master
+corrects it, as the real ones do when the master is late.
+
+It reports the gaps between master heartbeats per charger against that
+threshold, how many heartbeats the master re-sent because it missed the
+answer, fallbacks, and frames from the master that did not parse, first
+on a clean bus and then at each --errors rate (slave frames spoiled by
+--faults, master frames lost). With --start OpenWatt gets a serial stream,
+tesla-twc interface and a TWC per charger on the pty, and each --steps
+target current is set through the console and timed until the chargers
+are told and until the cars draw it.
+
+  python3 test/bench/twc_sim.py [--chargers 4] [--cars N] [--errors 0,0.02,0.1]
+      [--faults checksum,escape,truncate,drop,noise] [--duration 60]
+      [--steps 16,8,32] [--trickle] [--start [BINARY]] [--link PATH] [--json PATH]
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import re
+import sys
+import time
+import tty
+
+from common import CONSOLE_ERROR, openwatt, percentile, send_all, whole_ms
+
+END, ESC, ESC_END, ESC_ESC = 0xC0, 0xDB, 0xDC, 0xDD
+
+MASTER_LINK_READY1, MASTER_LINK_READY2, MASTER_HEARTBEAT = 0xFCE1, 0xFBE2, 0xFBE0
+SLAVE_LINK_READY, SLAVE_HEARTBEAT = 0xFDE2, 0xFDE0
+REQUESTS = {0xFBEB: 0xFDEB, 0xFBEC: 0xFDEC, 0xFBED: 0xFDED, 0xFBEE: 0xFDEE, 0xFBEF: 0xFDEF, 0xFBF1: 0xFDF1}
+
+# heartbeat states (twc.d TWCState)
+READY, CHARGING, PLUGGED_IN, BUSY, RAISING, LOWERING, STARTING, LIMIT = 0, 1, 3, 5, 6, 7, 8, 9
+
+FAULTS = ("checksum", "escape", "truncate", "drop", "noise")
+MIN_CURRENT = 500  # master.d: the protocol cannot ask for less than 5 A
+
+
+def escape(data):
+    out = bytearray()
+    for b in data:
+        if b == END:
+            out += bytes((ESC, ESC_END))
+        elif b == ESC:
+            out += bytes((ESC, ESC_ESC))
+        else:
+            out.append(b)
+    return bytes(out)
+
+
+def frame(msg):
+    return bytes((END,)) + escape(msg + bytes((sum(msg[1:]) & 0xFF,))) + bytes((END,))
+
+
+def unescape(raw):
+    out = bytearray()
+    i = 0
+    while i < len(raw):
+        b = raw[i]
+        if b == ESC:
+            i += 1
+            if i >= len(raw) or raw[i] not in (ESC_END, ESC_ESC):
+                return None
+            out.append(END if raw[i] == ESC_END else ESC)
+        else:
+            out.append(b)
+        i += 1
+    return bytes(out)
+
+
+class Charger:
+    def __init__(self, sim, index, twc_id, car):
+        self.sim = sim
+        self.args = sim.args
+        self.index = index
+        self.id = twc_id
+        self.name = f"twc{index}"
+        self.sig = random.Random(twc_id).randrange(256)
+        self.serial = f"A{twc_id:05d}SIM00"[:11].encode()
+        self.vin = f"5YJ3E1EA{index:09d}".encode() if car else bytes(17)
+        self.car = car
+        self.state = PLUGGED_IN if car else READY
+        self.offered = 0       # cA the master has given us
+        self.in_use = 0        # cA the car draws
+        self.energy = (1000 + index * 37) * 1000.0
+        self.heard_master = False
+        self.last_heartbeat = None
+        self.fallback_since = None
+        self.charging_at = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.gaps = []
+        self.heartbeats = self.requests = self.repeats = 0
+        self.fallbacks = 0
+        self.fallback_time = 0.0
+        self.last_was_heartbeat = False
+
+    def reply(self, msg):
+        self.sim.bus.send(msg, self)
+
+    def heartbeat_msg(self):
+        current = self.offered if self.state in (CHARGING, RAISING, LOWERING, STARTING, LIMIT) else 0
+        return (SLAVE_HEARTBEAT.to_bytes(2, "big") + self.id.to_bytes(2, "big") + self.sim.master.to_bytes(2, "big")
+                + bytes((self.state,)) + current.to_bytes(2, "big") + self.in_use.to_bytes(2, "big") + bytes(4))
+
+    def on_heartbeat(self, state, current, now):
+        if self.last_heartbeat is not None:
+            self.gaps.append(now - self.last_heartbeat)
+        self.last_heartbeat = now
+        self.heartbeats += 1
+        if self.last_was_heartbeat:
+            self.repeats += 1  # master missed our last answer and asked again
+        self.last_was_heartbeat = True
+        self.heard_master = True
+        if self.fallback_since is not None:
+            self.fallback_time += now - self.fallback_since
+            self.fallback_since = None
+        if state in (BUSY, STARTING, LIMIT):
+            self.sim.on_command(self, state, current, now)
+            if self.car:
+                self.offered = current
+                if self.state == PLUGGED_IN and state == BUSY:
+                    self.state = STARTING
+                elif self.state == STARTING and state == STARTING:
+                    self.state = CHARGING
+                    self.charging_at = now
+        self.reply(self.heartbeat_msg())
+
+    def on_request(self, cmd):
+        self.requests += 1
+        self.last_was_heartbeat = False
+        body = self.id.to_bytes(2, "big")
+        if cmd == 0xFBEB:
+            volts = (240).to_bytes(2, "big")
+            body += int(self.energy // 1000).to_bytes(4, "big") + volts * 3 + bytes((self.in_use // 50,))
+        elif cmd == 0xFBED:
+            body += self.serial
+        elif cmd == 0xFBEE:
+            body += self.vin[0:7]
+        elif cmd == 0xFBEF:
+            body += self.vin[7:14]
+        elif cmd == 0xFBF1:
+            body += self.vin[14:17]
+        msg = REQUESTS[cmd].to_bytes(2, "big") + body
+        self.reply(msg + bytes(19 - len(msg)))
+
+    def tick(self, now, dt):
+        if self.heard_master and self.fallback_since is None and \
+                now - self.last_heartbeat > self.args.fallback_after:
+            self.fallback_since = now
+            self.fallbacks += 1
+            self.offered = min(self.offered, int(self.args.fallback * 100)) if self.car else self.offered
+        target = self.offered if self.state == CHARGING else 0
+        step = int(self.args.ramp * 100 * dt)
+        if self.in_use < target:
+            self.in_use = min(target, self.in_use + step)
+        elif self.in_use > target:
+            self.in_use = max(target, self.in_use - step)
+        self.energy += self.in_use / 100 * 240 * dt / 3600  # Wh, single phase
+
+
+class Bus:
+    """The RS485 bus: one writer, frames paced at the baud rate."""
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.args = sim.args
+        self.out = collections.deque()
+        self.wake = asyncio.Event()
+        self.buf = bytearray()
+        self.counts = collections.Counter()
+        self.error_rate = 0.0
+        self.rnd = random.Random(sim.args.seed)
+
+    def send(self, msg, charger):
+        data = frame(msg)
+        if self.error_rate and self.rnd.random() < self.error_rate:
+            fault = self.rnd.choice(self.args.faults)
+            self.counts[f"fault_{fault}"] += 1
+            if fault == "drop":
+                return
+            if fault == "checksum":
+                data = data[:-2] + bytes(((data[-2] + 1) & 0xFF or 1,)) + data[-1:]
+                if data[-2] in (END, ESC):
+                    data = data[:-2] + b"\x01" + data[-1:]
+            elif fault == "escape":
+                data = data[:4] + bytes((ESC, 0x00)) + data[4:]
+            elif fault == "truncate":
+                data = data[:len(data) // 2] + bytes((END,))
+            elif fault == "noise":
+                data = bytes(self.rnd.randrange(256) for _ in range(self.rnd.randint(1, 6))) + data
+        self.counts["tx_frames"] += 1
+        delay = self.args.turnaround / 1000
+        asyncio.get_running_loop().call_later(delay, self.queue, data)
+
+    def queue(self, data):
+        self.out.append(data)
+        self.wake.set()
+
+    async def writer(self, fd):
+        per_byte = 10 / self.args.baud
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+            while self.out:
+                data = self.out.popleft()
+                chunks = [data[i:i + 1] for i in range(len(data))] if self.args.trickle else [data]
+                for chunk in chunks:
+                    while True:
+                        try:
+                            os.write(fd, chunk)
+                            break
+                        except BlockingIOError:
+                            await asyncio.sleep(0.005)
+                        except OSError:
+                            return
+                    await asyncio.sleep(len(chunk) * per_byte)
+                self.counts["tx_bytes"] += len(data)
+
+    def on_bytes(self, data, now):
+        self.counts["rx_bytes"] += len(data)
+        for b in data:
+            if b != END:
+                self.buf.append(b)
+                continue
+            raw, self.buf = bytes(self.buf), bytearray()
+            if len(raw) >= 2:
+                self.on_frame(raw, now)
+
+    def on_frame(self, raw, now):
+        msg = unescape(raw)
+        if msg is None:
+            # twc iface.d appends the checksum without escaping it; 0xDB ends the frame
+            # as a dangling escape, 0xC0 ends it early (the next check)
+            body = unescape(raw[:-1]) if raw[-1] == ESC else None
+            self.counts["rx_raw_checksum" if body and sum(body[1:]) & 0xFF == ESC else "rx_bad_escape"] += 1
+            return
+        if len(msg) < 2 or sum(msg[1:-1]) & 0xFF != msg[-1]:
+            split = sum(msg[1:]) & 0xFF == END
+            self.counts["rx_raw_checksum" if split else "rx_bad_checksum"] += 1
+            return
+        msg = msg[:-1]
+        if len(msg) < 6:
+            self.counts["rx_short"] += 1
+            return
+        self.counts["rx_frames"] += 1
+        if self.error_rate and self.rnd.random() < self.error_rate:
+            self.counts["rx_lost"] += 1  # the slave didn't hear it
+            return
+        self.sim.on_master(msg, now)
+
+
+class Sim:
+    def __init__(self, args):
+        self.args = args
+        ids = [0x6914, 0x6820] + [0x5100 + 0x11 * i for i in range(args.chargers)]
+        ids[2:] = [i for i in ids[2:] if i not in ids[:2]]
+        self.chargers = [Charger(self, i, ids[i], i < args.cars) for i in range(args.chargers)]
+        self.by_id = {c.id: c for c in self.chargers}
+        self.bus = Bus(self)
+        self.master = 0
+        self.first_frame = None
+        self.link_ready_seen = 0
+        self.commands = collections.defaultdict(list)  # charger -> [(time, state, current)]
+        self.t0 = time.perf_counter()
+
+    def on_master(self, msg, now):
+        cmd = int.from_bytes(msg[0:2], "big")
+        src = int.from_bytes(msg[2:4], "big")
+        if self.first_frame is None:
+            self.first_frame = now
+        self.master = src
+        if cmd in (MASTER_LINK_READY1, MASTER_LINK_READY2):
+            self.link_ready_seen += 1
+            return
+        if len(msg) < 6:
+            return
+        charger = self.by_id.get(int.from_bytes(msg[4:6], "big"))
+        if charger is None:
+            return
+        if cmd == MASTER_HEARTBEAT and len(msg) >= 9:
+            charger.on_heartbeat(msg[6], int.from_bytes(msg[7:9], "big"), now)
+        elif cmd in REQUESTS:
+            charger.on_request(cmd)
+
+    def on_command(self, charger, state, current, now):
+        log = self.commands[charger.id]
+        if not log or log[-1][1:] != (state, current):
+            log.append((now, state, current))
+
+    async def link_ready(self):
+        # slaves announce themselves until the master heartbeats them
+        while True:
+            for c in self.chargers:
+                if not c.heard_master:
+                    c.reply(SLAVE_LINK_READY.to_bytes(2, "big") + c.id.to_bytes(2, "big") + bytes((c.sig,))
+                            + int(self.args.max_current * 100).to_bytes(2, "big") + bytes(8))
+            await asyncio.sleep(1.0)
+
+    async def ticker(self):
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.05)
+            now = time.perf_counter()
+            for c in self.chargers:
+                c.tick(now, now - last)
+            last = now
+
+
+def expected(current, max_current):
+    return max(MIN_CURRENT, min(int(max_current * 100), int(current * 100)))
+
+
+# /protocol/tesla/twc/add reports a missing interface in its own words
+TWC_ADD_ERROR = re.compile(CONSOLE_ERROR.pattern + r"|^Interface '[^']*' not found", re.M)
+
+
+def provision(console, args, sim, device):
+    cmds = [f"/stream/serial/add name=bench-twc device={device} baud-rate={args.baud}",
+            "/interface/tesla-twc/add name=bench-twc stream=bench-twc"]
+    cmds += [f"/protocol/tesla/twc/add name={c.name} interface=bench-twc id=0x{c.id:04x} "
+             f"max-current={args.max_current:g}" for c in sim.chargers]
+    send_all(console, cmds, failed=TWC_ADD_ERROR)
+
+
+async def wait_for(cond, timeout):
+    deadline = time.perf_counter() + timeout
+    while not cond() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    return cond()
+
+
+def bus_window(sim, seconds):
+    """Stats for the chargers over the last window (callers reset first)."""
+    gaps = [g for c in sim.chargers for g in c.gaps]
+    now = time.perf_counter()
+    fb_time = sum(c.fallback_time + (now - c.fallback_since if c.fallback_since else 0) for c in sim.chargers)
+    hbs = sum(c.heartbeats for c in sim.chargers)
+    return {"heartbeats_per_s": hbs / seconds,
+            "gap_mean_ms": whole_ms(sum(gaps) / len(gaps)) if gaps else None,
+            "gap_p99_ms": whole_ms(percentile(gaps, 99)), "gap_max_ms": whole_ms(max(gaps)) if gaps else None,
+            "late": sum(g > sim.args.fallback_after for g in gaps),
+            "repeats": sum(c.repeats for c in sim.chargers), "heartbeats": hbs,
+            "fallbacks": sum(c.fallbacks for c in sim.chargers), "fallback_s": round(fb_time, 1)}
+
+
+async def run(args, ow):
+    sim = Sim(args)
+    loop = asyncio.get_running_loop()
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    os.set_blocking(master, False)
+    device = os.ttyname(slave)
+    if args.link:
+        if os.path.islink(args.link):
+            os.unlink(args.link)
+        os.symlink(device, args.link)
+
+    def readable():
+        try:
+            data = os.read(master, 4096)
+        except OSError:
+            return
+        sim.bus.on_bytes(data, time.perf_counter())
+
+    loop.add_reader(master, readable)
+    tasks = [loop.create_task(c) for c in (sim.bus.writer(master), sim.link_ready(), sim.ticker())]
+    print(f"TWC bus on {device}{f' ({args.link})' if args.link else ''}: {args.chargers} chargers "
+          f"({', '.join(f'{c.name}=0x{c.id:04x}' for c in sim.chargers)}), {args.cars} with a car, "
+          f"{args.baud} baud{', trickled' if args.trickle else ''}", flush=True)
+    results = {"chargers": args.chargers, "cars": args.cars, "baud": args.baud, "trickle": args.trickle}
+
+    t_start = time.perf_counter()
+    if ow:
+        provision(ow.get_console(), args, sim, device)
+
+    # bring-up
+    if not await wait_for(lambda: all(c.heard_master for c in sim.chargers), args.timeout):
+        print(f"not every charger heard from the master after {args.timeout:.0f}s "
+              f"({sim.bus.counts['rx_frames']} frames seen)")
+        return 1
+    up = {c.name: whole_ms(c.last_heartbeat - t_start) for c in sim.chargers}
+    print(f"first master frame {sim.first_frame - t_start:.2f}s, {sim.link_ready_seen} link-ready broadcasts, "
+          f"every charger heartbeated by {max(up.values()) / 1000:.2f}s")
+    cars = [c for c in sim.chargers if c.car]
+    await wait_for(lambda: all(c.charging_at for c in cars), args.timeout)
+    charging = [c.charging_at - t_start for c in cars if c.charging_at]
+    if cars:
+        print(f"{len(charging)}/{len(cars)} cars charging, last at {max(charging, default=0):.2f}s")
+    results["bringup"] = {"first_frame_ms": whole_ms(sim.first_frame - t_start), "heartbeated_ms": up,
+                          "charging_ms": [whole_ms(t) for t in charging]}
+
+    # heartbeat cadence, clean then noisy
+    print(f"\n{'errors':>7} {'hb/s':>6} {'gap ms':>7} {'p99':>6} {'max':>6} {'late':>5} {'repeat':>7} "
+          f"{'fallbk':>7} {'fb s':>6} {'bad in':>7}")
+    rows = []
+    for rate in args.errors:
+        sim.bus.error_rate = rate
+        for c in sim.chargers:
+            c.reset_stats()
+        bad0 = sum(v for k, v in sim.bus.counts.items() if k.startswith("rx_") and k not in ("rx_bytes", "rx_frames"))
+        await asyncio.sleep(args.duration)
+        row = bus_window(sim, args.duration)
+        row["errors"] = rate
+        row["bad_from_master"] = sum(v for k, v in sim.bus.counts.items()
+                                     if k.startswith("rx_") and k not in ("rx_bytes", "rx_frames", "rx_lost")) - bad0
+        rows.append(row)
+        print(f"{rate:7g} {row['heartbeats_per_s']:6.2f} {row['gap_mean_ms'] or 0:7} {row['gap_p99_ms'] or 0:6} "
+              f"{row['gap_max_ms'] or 0:6} {row['late']:5} {row['repeats']:7} {row['fallbacks']:7} "
+              f"{row['fallback_s']:6} {row['bad_from_master']:7}")
+        if ow and not ow.is_running():
+            print("openwatt exited", file=sys.stderr)
+            return 1
+    sim.bus.error_rate = 0.0
+    results["heartbeats"] = rows
+
+    # current allocation, through the console
+    steps = []
+    if ow and args.steps and cars:
+        console = ow.get_console()
+        print(f"\n{'target A':>9} {'told ms':>8} {'max':>6} {'drawn ms':>9}")
+        for target in args.steps:
+            want = expected(target, args.max_current)
+            t = time.perf_counter()
+            for c in sim.chargers:
+                console.send_command(f"/protocol/tesla/twc/set name={c.name} target-current={target:g}",
+                                     read_delay=0.01, timeout=0.5)
+            told = lambda c: next((ts for ts, state, cur in sim.commands[c.id] if ts >= t and cur == want), None)
+            await wait_for(lambda: all(told(c) for c in cars) and all(abs(c.in_use - want) <= 50 for c in cars),
+                           args.timeout)
+            told_ms = [whole_ms(told(c) - t) for c in cars if told(c)]
+            drawn_ms = [whole_ms(time.perf_counter() - t)] if all(abs(c.in_use - want) <= 50 for c in cars) else []
+            step = {"target": target, "told_ms": told_ms, "drawn_ms": drawn_ms[0] if drawn_ms else None}
+            steps.append(step)
+            print(f"{target:9g} {percentile(told_ms, 50, '-'):>8} {max(told_ms, default='-'):>6} "
+                  f"{step['drawn_ms'] or '-':>9}" + (f"  ({len(cars) - len(told_ms)} never told)"
+                                                             if len(told_ms) < len(cars) else ""))
+            await asyncio.sleep(args.settle)
+    results["steps"] = steps
+
+    c = sim.bus.counts
+    print(f"\nbus: {c['rx_frames']} good frames from the master, {c['rx_bad_checksum']} bad checksum, "
+          f"{c['rx_bad_escape']} bad escape, {c['rx_raw_checksum']} with an unescaped C0/DB checksum, "
+          f"{c['rx_short']} short; {c['tx_frames']} frames to it")
+    results["bus"] = dict(c)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"wrote {args.json}")
+    for t in tasks:
+        t.cancel()
+    loop.remove_reader(master)
+    if args.link and os.path.islink(args.link):
+        os.unlink(args.link)
+    os.close(master)
+    os.close(slave)
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chargers", type=int, default=4)
+    ap.add_argument("--cars", type=int, help="chargers with a car plugged in (default all)")
+    ap.add_argument("--max-current", type=float, default=32.0, help="amps each TWC is rated for")
+    ap.add_argument("--ramp", type=float, default=4.0, help="A/s a car moves its draw by")
+    ap.add_argument("--fallback-after", type=float, default=5.0,
+                    help="seconds without a heartbeat before a slave falls back")
+    ap.add_argument("--fallback", type=float, default=6.0, help="amps a slave falls back to")
+    ap.add_argument("--errors", type=lambda s: [float(r) for r in s.split(",") if r], default=[0.0, 0.02, 0.1],
+                    metavar="P,P,...", help="bus error rates, one --duration window each")
+    ap.add_argument("--faults", type=lambda s: s.split(","), default=list(FAULTS),
+                    metavar="F,F,...", help="what an error does to a slave frame: " + ",".join(FAULTS))
+    ap.add_argument("--duration", type=float, default=60.0)
+    ap.add_argument("--steps", type=lambda s: [float(r) for r in s.split(",") if r], default=[16.0, 8.0, 32.0],
+                    metavar="A,A,...", help="target currents to set (with --start)")
+    ap.add_argument("--settle", type=float, default=2.0)
+    ap.add_argument("--turnaround", type=float, default=10.0, help="ms a slave takes to answer")
+    ap.add_argument("--baud", type=int, default=9600)
+    ap.add_argument("--trickle", action="store_true", help="write a byte at a time, like a UART")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--link", metavar="PATH", help="symlink this path to the pty")
+    ap.add_argument("--start", nargs="?", const="bin/x86_64_debug/openwatt", metavar="BINARY",
+                    help="start OpenWatt and give it the bus")
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = ap.parse_args()
+    if args.cars is None:
+        args.cars = args.chargers
+    bad = [f for f in args.faults if f not in FAULTS]
+    if bad:
+        ap.error(f"unknown fault(s) {','.join(bad)}")
+
+    ow = None
+    if args.start:
+        ow = openwatt(args.start, "twc_sim")
+        if not ow.start():
+            return 1
+    try:
+        return asyncio.run(run(args, ow))
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        if ow:
+            ow.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
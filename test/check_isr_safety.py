@@ -15,14 +15,22 @@ DIRECT calls only. Indirect calls through function pointers are not statically
 decidable here; those are covered at the registration site, where the link
 fabric's isr_task requires the @isr_safe attribute.
 
-  python3 test/check_isr_safety.py <elf> --objdump <path-to-objdump>
+  python3 test/check_isr_safety.py <elf> --objdump <path-to-objdump> [--no-cache]
 """
 
 import argparse
+import bisect
+import concurrent.futures
+import hashlib
+import os
+import pickle
 import re
 import subprocess
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import elffile
+
 RESIDENT_HINTS = ("iram", "ramfunc", "rtc_text", "rtc.text")
 # D mangling for urt.driver.*/driver.boards.*, the C shim entry points, and
 # the synthesized reflex NMI vector.
@@ -33,13 +41,14 @@ ROOT_PATTERNS = (
     re.compile(r"^xt_nmi$"),
 )
 
-SECTION_RE = re.compile(r"^\s*\d+\s+(\S+)\s+([0-9a-f]+)\s+([0-9a-f]+)\s+", re.IGNORECASE)
 FUNC_RE = re.compile(r"^([0-9a-f]+) <([^>]+)>:")
 INSN_RE = re.compile(r"^\s*([0-9a-f]+):\s+[0-9a-f ]+\s+(\S+)\s*(.*)$", re.IGNORECASE)
 TARGET_RE = re.compile(r"\b([0-9a-f]{6,16})\s+<([^>+]+)(?:\+0x[0-9a-f]+)?>", re.IGNORECASE)
 L32R_RE = re.compile(r"^l32r\s+(a\d+),", re.IGNORECASE)
 CALLX_RE = re.compile(r"^callx\d+\s+(a\d+)$", re.IGNORECASE)
 CALL_PREFIXES = ("call", "j", "bl")
+# Bump when the parse changes, so stale caches are not trusted.
+CACHE_VERSION = 2
 
 
 def run(cmd):
@@ -49,14 +58,14 @@ def run(cmd):
     return r.stdout
 
 
-def sections(objdump, elf):
-    found = []
-    for line in run([objdump, "-h", elf]).splitlines():
-        m = SECTION_RE.match(line)
-        if m and int(m.group(2), 16):
-            vma = int(m.group(3), 16)
-            found.append((m.group(1), vma, vma + int(m.group(2), 16)))
-    return found
+def sections(elf):
+    """(name, lo, hi) for every non-empty section the image loads."""
+    try:
+        img = elffile.load(elf)
+    except (OSError, ValueError) as e:
+        sys.exit(f"cannot read {elf}: {e}")
+    return [(s.name, s.addr, s.addr + s.size) for s in img.sections
+            if s.size and s.flags & elffile.SHF_ALLOC]
 
 
 def classify(addr, secs):
@@ -78,67 +87,178 @@ def target_ref(operands):
     return None
 
 
+def disassemble(objdump, elf, name):
+    """[(function, function_addr, [(address, opcode, operands, target)])] for
+    one section, literal pools left out."""
+    functions = []
+    insns = None
+    start = 0
+    registers = {}
+    literal_end = 0
+    first_instruction = False
+    for line in run([objdump, "-d", "-j", name, elf]).splitlines():
+        head = FUNC_RE.match(line)
+        if head:
+            start = int(head.group(1), 16)
+            insns = []
+            functions.append((head.group(2), start, insns))
+            registers = {}
+            literal_end = 0
+            first_instruction = True
+            continue
+        if insns is None:
+            continue
+        insn = INSN_RE.match(line)
+        if not insn:
+            continue
+        address = int(insn.group(1), 16)
+        opcode = insn.group(2).lower()
+        operands = insn.group(3)
+        if first_instruction:
+            first_instruction = False
+            target = target_ref(operands) if opcode == "j" else None
+            if target and target[1] > address:
+                literal_end = target[1]
+                continue
+        if address < literal_end:
+            continue
+        target = None
+        load = L32R_RE.match(f"{opcode} {operands}")
+        callx = CALLX_RE.match(f"{opcode} {operands}")
+        if load:
+            loaded = target_ref(operands)
+            if loaded:
+                registers[load.group(1)] = loaded
+        elif callx:
+            target = registers.get(callx.group(1))
+        elif opcode.startswith(CALL_PREFIXES):
+            target = target_ref(operands)
+        insns.append((address, opcode, operands, target))
+    return functions
+
+
+def section_key(img, sec, objdump, symbols):
+    """What a section's disassembly depends on: its bytes and address, the
+    symbols inside it, which objdump prints as function heads and branch
+    targets, and the objdump doing the printing. Names objdump gives to
+    targets in other sections are not part of it; callgraph() resolves
+    those afresh on every run."""
+    h = hashlib.sha256()
+    h.update(f"{CACHE_VERSION}\0{os.path.realpath(objdump)}\0{sec.addr}\0".encode())
+    h.update(img.data(sec))
+    h.update("\n".join(f"{name} {value:x}" for value, _, name in symbols
+                       if sec.addr <= value < sec.addr + sec.size).encode())
+    return h.hexdigest()
+
+
+def resolver(symbols, heads):
+    """addr -> name for call targets: the function head a section's
+    disassembly printed there, else the nearest symbol at or below it."""
+    values = [value for value, _, _ in symbols]
+
+    def resolve(addr, fallback):
+        if addr in heads:
+            return heads[addr]
+        i = bisect.bisect_right(values, addr) - 1
+        return symbols[i][2] if i >= 0 else fallback
+    return resolve
+
+
+def callgraph(objdump, elf, names, visit=None, cache=True):
+    """Direct calls made by every function in the named sections.
+
+    Returns {caller: {(callee_name, callee_addr)}}. Branches within a function
+    show up as edges to itself. Xtensa loads call targets from a literal pool
+    with l32r and calls through the register with callx; both are tracked
+    per function so those resolve like direct calls.
+
+    visit, if given, sees every instruction that is code rather than literal
+    pool, as visit(function, function_addr, address, opcode, operands,
+    target), where target is the (name, addr) of a resolved call or None.
+
+    Sections are disassembled in parallel, and each one's parse is kept in
+    <elf>.callgraph/ keyed by what it depends on, so after an incremental
+    build only the sections that changed are disassembled again. A call
+    into another section is named from the current symbol table rather
+    than the cached parse, so a rename elsewhere cannot leave it stale.
+    """
+    img = elffile.load(elf)
+    # (value, is_function, name): where symbols share an address the
+    # function sorts last, which is the one resolver() picks; ARM's $a/$t/$d
+    # mapping symbols mark instruction sets, not code, and are left out
+    symbols = sorted((s.value, s.type == elffile.STT_FUNC, s.name) for s in img.symbols()
+                     if s.section is not None and s.name and not s.name.startswith("$"))
+    cache_dir = elf + ".callgraph"
+    parsed, todo = {}, []
+    for name in names:
+        sec = img.section(name)
+        key = section_key(img, sec, objdump, symbols) if sec else None
+        path = os.path.join(cache_dir, re.sub(r"[^\w.-]", "_", name).lstrip(".") + ".pickle")
+        if cache and key:
+            try:
+                with open(path, "rb") as f:
+                    stored_key, functions = pickle.load(f)
+                if stored_key == key:
+                    parsed[name] = functions
+                    continue
+            except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+                pass
+        todo.append((name, key, path))
+
+    if todo:
+        with concurrent.futures.ThreadPoolExecutor(os.cpu_count() or 1) as pool:
+            jobs = [(name, key, path, pool.submit(disassemble, objdump, elf, name))
+                    for name, key, path in todo]
+            for name, key, path, job in jobs:
+                parsed[name] = job.result()
+                if cache and key:
+                    try:
+                        os.makedirs(cache_dir, exist_ok=True)
+                        with open(path + ".tmp", "wb") as f:
+                            pickle.dump((key, parsed[name]), f, pickle.HIGHEST_PROTOCOL)
+                        os.replace(path + ".tmp", path)
+                    except OSError:
+                        pass    # a read-only build tree just goes uncached
+
+    resolve = resolver(symbols, {start: function for name in names
+                                 for function, start, _ in parsed[name]})
+    graph = {}
+    for name in names:
+        sec = img.section(name)
+        lo, hi = (sec.addr, sec.addr + sec.size) if sec else (0, 0)
+        for function, start, insns in parsed[name]:
+            edges = graph.setdefault(function, set())
+            for address, opcode, operands, target in insns:
+                if target and not lo <= target[1] < hi:
+                    target = resolve(target[1], target[0]), target[1]
+                if target:
+                    edges.add(target)
+                if visit:
+                    visit(function, start, address, opcode, operands, target)
+    return graph
+
+
+def roots_of(graph):
+    return {f for f in graph if any(p.match(f) for p in ROOT_PATTERNS)}
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("elf")
     ap.add_argument("--objdump", required=True)
+    ap.add_argument("--no-cache", action="store_true",
+                    help="disassemble everything, ignoring <elf>.callgraph/")
     args = ap.parse_args()
 
-    secs = sections(args.objdump, args.elf)
+    secs = sections(args.elf)
     resident_secs = [s for s in secs if resident(s[0])]
     if not resident_secs:
         sys.exit("no resident code sections found; the ELF or section names are unexpected")
 
     # caller -> {(callee_name, callee_addr)} across all resident code
-    graph, roots = {}, set()
-    for name, _, _ in resident_secs:
-        current = None
-        registers = {}
-        literal_end = 0
-        first_instruction = False
-        for line in run([args.objdump, "-d", "-j", name, args.elf]).splitlines():
-            head = FUNC_RE.match(line)
-            if head:
-                current = head.group(2)
-                graph.setdefault(current, set())
-                if any(p.match(current) for p in ROOT_PATTERNS):
-                    roots.add(current)
-                registers = {}
-                literal_end = 0
-                first_instruction = True
-                continue
-            if current is None:
-                continue
-            insn = INSN_RE.match(line)
-            if not insn:
-                continue
-            address = int(insn.group(1), 16)
-            opcode = insn.group(2).lower()
-            operands = insn.group(3)
-            if first_instruction:
-                first_instruction = False
-                target = target_ref(operands) if opcode == "j" else None
-                if target and target[1] > address:
-                    literal_end = target[1]
-                    continue
-            if address < literal_end:
-                continue
-            load = L32R_RE.match(f"{opcode} {operands}")
-            if load:
-                target = target_ref(operands)
-                if target:
-                    registers[load.group(1)] = target
-                continue
-            callx = CALLX_RE.match(f"{opcode} {operands}")
-            if callx:
-                target = registers.get(callx.group(1))
-                if target:
-                    graph[current].add(target)
-                continue
-            if opcode.startswith(CALL_PREFIXES):
-                target = target_ref(operands)
-                if target:
-                    graph[current].add(target)
+    graph = callgraph(args.objdump, args.elf, [s[0] for s in resident_secs],
+                      cache=not args.no_cache)
+    roots = roots_of(graph)
 
     if not graph:
         sys.exit("disassembled no functions; the checker is not doing its job")
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""Estimate the longest path through each interrupt root's resident code.
+
+An ISR that runs long holds off every other interrupt at or below its level;
+on the RS485 UARTs at high baud that is a FIFO overrun. check_isr_safety.py
+proves ISR code stays resident; this, over the same roots and call graph,
+says how long it can run.
+
+Each function's longest path is taken over its control-flow graph (a static
+estimate, not a simulation): conditional branches are assumed taken or not,
+whichever is longer, and a call costs the callee's own longest path. What
+cannot be bounded is reported rather than guessed at:
+
+    loop        a cycle in the control flow or a zero-overhead loop
+                (Xtensa loop*); its body is counted once
+    indirect    a call or jump through a register the disassembly cannot
+                resolve
+    recursion   a cycle in the call graph
+    outside     a call to code outside the resident sections, which
+                check_isr_safety.py rejects anyway
+
+Cycles are instructions plus a flat pipeline penalty on every control
+transfer and a multi-cycle divide; resident code runs from IRAM, so there
+are no cache misses to model.
+
+  python3 test/isr_latency.py <elf> --objdump <path-to-objdump>
+      [--budget REGEX=CYCLES ...] [--default-budget CYCLES] [--mhz N] [--strict]
+"""
+
+import argparse
+import re
+import sys
+
+from check_isr_safety import callgraph, resident, roots_of, sections, target_ref
+
+CALL_RE = re.compile(r"^(call\d+|callx\d+|call[lq]?|bl|blx|blr|jal|jalr|c\.jal|c\.jalr)$")
+RET_RE = re.compile(r"^(ret\w*|rfe|rfi|rfde|rfwo|rfwu|rfme|rfue|mret|sret|eret|iret\w*)(\.n)?$")
+JUMP_RE = re.compile(r"^(j|jmp[lq]?|b|b\.n|b\.w|c\.j|j\.l)$")
+INDIRECT_JUMP_RE = re.compile(r"^(jx|jr|c\.jr|br|bx)$")
+LOOP_RE = re.compile(r"^loop(nez|gtz)?$")
+BRANCH_RE = re.compile(r"^(j(?!mp)[a-z]+|b[a-z]+|cb\w+|tb\w+|c\.b\w+)(\.[a-z]+)?$")
+DIVIDE_RE = re.compile(r"^(quo|rem|div|idiv|udiv|sdiv)")
+
+TRANSFER_PENALTY = 2
+DIVIDE_CYCLES = 32
+
+
+def cycles_of(opcode, kind):
+    if DIVIDE_RE.match(opcode):
+        return DIVIDE_CYCLES
+    return 1 + (TRANSFER_PENALTY if kind != "plain" else 0)
+
+
+def classify(opcode, operands, target):
+    """(kind, (name, addr) or None); kind is call, ret, jump, branch, loop,
+    indirect call, indirect jump or plain."""
+    if RET_RE.match(opcode) or opcode == "bx" and operands.strip() == "lr":
+        return "ret", None
+    if CALL_RE.match(opcode):
+        return ("call", target) if target else ("indirect call", None)
+    if INDIRECT_JUMP_RE.match(opcode):
+        return "indirect jump", None
+    ref = target or target_ref(operands)
+    if LOOP_RE.match(opcode):
+        return "loop", ref
+    if JUMP_RE.match(opcode):
+        return ("jump", ref) if ref else ("indirect jump", None)
+    if BRANCH_RE.match(opcode) and ref:
+        return "branch", ref
+    return "plain", None
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("elf")
+    ap.add_argument("--objdump", required=True)
+    ap.add_argument("--budget", action="append", default=[],
+                    metavar="REGEX=CYCLES",
+                    help="cycle limit for the roots matching REGEX; repeatable, "
+                         "first match wins")
+    ap.add_argument("--default-budget", type=int, metavar="CYCLES",
+                    help="limit for roots no --budget matches")
+    ap.add_argument("--mhz", type=float, default=240.0,
+                    help="core clock, to show cycles as microseconds")
+    ap.add_argument("--strict", action="store_true",
+                    help="fail a budgeted root whose path cannot be bounded")
+    args = ap.parse_args()
+
+    budgets = []
+    for b in args.budget:
+        pattern, _, limit = b.rpartition("=")
+        if not pattern or not limit.isdigit():
+            ap.error(f"--budget wants REGEX=CYCLES, not {b!r}")
+        budgets.append((re.compile(pattern), int(limit)))
+
+    secs = sections(args.elf)
+    resident_secs = [s for s in secs if resident(s[0])]
+    if not resident_secs:
+        sys.exit("no resident code sections found; the ELF or section names are unexpected")
+
+    code, starts = {}, {}
+
+    def visit(func, start, address, opcode, operands, target):
+        starts[func] = start
+        code.setdefault(func, []).append((address, opcode, operands, target))
+
+    graph = callgraph(args.objdump, args.elf, [s[0] for s in resident_secs], visit)
+    roots = sorted(roots_of(graph))
+    if not roots:
+        sys.exit("found no OpenWatt/uRT symbols in resident sections; nothing was actually checked")
+
+    memo, onstack = {}, set()
+
+    def cost(f):
+        """(instructions, cycles, {why the figure is a floor}, heaviest call chain)"""
+        if f in memo:
+            return memo[f]
+        if f in onstack:
+            return 0, 0, {"recursion"}, []
+        insns = code.get(f)
+        if insns is None:
+            return 0, 0, {"outside"}, []
+        onstack.add(f)
+        why = set()
+        index = {a: i for i, (a, _, _, _) in enumerate(insns)}
+        end = len(insns)
+        own, succs = [], []
+        for i, (addr, opcode, operands, target) in enumerate(insns):
+            kind, ref = classify(opcode, operands, target)
+            n, c, chain, weight = 1, cycles_of(opcode, kind), [], 0
+            succ = [] if kind in ("ret", "jump", "indirect jump") else [i + 1]
+            if kind.startswith("indirect"):
+                why.add("indirect")
+            elif ref and ref[0] == f and kind == "call":
+                why.add("recursion")
+            elif ref and ref[0] == f and ref[1] == starts[f]:
+                why.add("loop")
+            elif ref and ref[0] == f:
+                if kind == "loop":
+                    why.add("loop")
+                elif ref[1] in index:
+                    succ.append(index[ref[1]])
+            elif ref:
+                # a call, or a jump or branch into another function: a tail call
+                cn, cc, cw, cchain = cost(ref[0])
+                n, c, chain, weight = n + cn, c + cc, [ref[0]] + cchain, cc
+                why |= cw
+            own.append((n, c, chain, weight))
+            succs.append([s for s in succ if s < end])
+
+        # Longest path from the entry over the control-flow graph, depth
+        # first; an edge back to an instruction still on the stack closes a
+        # loop and is not followed.
+        best = [None] * end
+        state = [0] * end
+        stack = [(0, iter(succs[0]))]
+        state[0] = 1
+        while stack:
+            i, it = stack[-1]
+            nxt = next(it, None)
+            if nxt is not None:
+                if state[nxt] == 1:
+                    why.add("loop")
+                elif state[nxt] == 0:
+                    state[nxt] = 1
+                    stack.append((nxt, iter(succs[nxt])))
+                continue
+            stack.pop()
+            state[i] = 2
+            n, c, chain, weight = own[i]
+            tails = [best[s] for s in succs[i] if best[s] is not None]
+            tn, tc, tchain, tweight = max(tails, key=lambda t: t[1], default=(0, 0, [], 0))
+            if tweight > weight or not chain:
+                chain, weight = tchain, tweight
+            best[i] = (n + tn, c + tc, chain, weight)
+        onstack.discard(f)
+        memo[f] = best[0][0], best[0][1], why, best[0][2]
+        return memo[f]
+
+    rows = []
+    for r in roots:
+        n, c, why, chain = cost(r)
+        limit = next((lim for p, lim in budgets if p.search(r)), args.default_budget)
+        rows.append((c, n, r, why, chain, limit))
+    rows.sort(key=lambda row: (-row[0], row[2]))
+
+    print(f"roots: {len(roots)}   resident functions: {len(code)}   "
+          f"({args.mhz:g} MHz, +{TRANSFER_PENALTY} cycles per control transfer)")
+    print(f"\n{'cycles':>9} {'insns':>7} {'us':>7} {'budget':>7}  root")
+    failed = []
+    for c, n, r, why, chain, limit in rows:
+        floor = ">=" if why else "  "
+        budget = str(limit) if limit is not None else "-"
+        over = limit is not None and (c > limit or (args.strict and why))
+        print(f"{floor}{c:7} {n:7} {c / args.mhz:7.2f} {budget:>7}  {r}"
+              f"{'  OVER' if over else ''}")
+        if chain:
+            print(f"{'':34}via {' -> '.join(chain)}")
+        if why:
+            print(f"{'':34}not bounded: {', '.join(sorted(why))}")
+        if over:
+            failed.append(r)
+
+    if failed:
+        print(f"\n{len(failed)} ISR(s) over budget: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
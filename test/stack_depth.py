@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""Worst-case stack depth from each interrupt root and task entry point.
+
+Task stacks are sized by hand, and the only feedback is a stack overflow in
+the field or RAM wasted on a stack that never gets near its end. This walks
+the same direct-call graph check_isr_safety.py builds, charges each function
+its frame, and reports the deepest chain from every root.
+
+Frame sizes come from -fstack-usage output where given (--su, a directory
+searched for *.su files), otherwise from the function's prologue. GCC names
+functions in .su files by their source name ("int ns::f(int)"), so the graph's
+symbols are demangled with the c++filt beside --objdump to look them up:
+
+    Xtensa    entry a1, N
+    RISC-V    addi sp, sp, -N
+    ARM       push {...} / sub sp, [sp,] #N / stp ..., [sp, #-N]!
+    x86       push / sub $N, %rsp, plus the return address
+
+What it cannot see, it says: a call through a pointer the disassembly does
+not resolve, a frame sized at run time (alloca, movsp), recursion, and calls
+into code outside the analysed sections (ROM, or a section left out). A root
+that reaches any of these has a depth that is a floor, not a bound, and is
+marked so.
+
+  python3 test/stack_depth.py <elf> --objdump <path-to-objdump>
+      [--entry NAME ...] [--su DIR] [--max BYTES] [--all-code]
+"""
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+from check_isr_safety import callgraph, elffile, resident, roots_of, sections
+
+PROLOGUE_INSNS = 16
+
+FRAME_RES = (
+    (re.compile(r"^entry\s+a1,\s*(\d+)"), 1),
+    (re.compile(r"^(?:c\.)?addi(?:16sp)?\s+sp,\s*(?:sp,\s*)?-(\d+)$"), 1),
+    (re.compile(r"^sub(?:\.w|w|s)?\s+sp,\s*(?:sp,\s*)?#(\d+)"), 1),
+    (re.compile(r"^stp\s+\S+,\s*\S+,\s*\[sp,\s*#-(\d+)\]!"), 1),
+    (re.compile(r"^sub[lq]?\s+\$0x([0-9a-f]+),%[re]sp"), 16),
+)
+PUSH_RE = re.compile(r"^push\s*\{([^}]*)\}")
+X86_PUSH_RE = re.compile(r"^push[lq]?\s")
+DYNAMIC_RE = re.compile(r"^(movsp\b|sub(?:\.w|s)?\s+sp,\s*(?:sp,\s*)?[a-z]|sub[lq]?\s+%\w+,%[re]sp)")
+# A call the disassembly could not give a target for.
+INDIRECT_RE = re.compile(r"^(callx\d*|call[lq]?|jalr|blr|blx)$")
+BRANCH_PREFIXES = ("call", "j", "b", "ret")
+
+# Default task entry points: the C entry points and ESP-IDF's app task.
+DEFAULT_ENTRIES = ("main", "app_main")
+
+# Machines whose call instruction pushes the return address itself.
+EM_386, EM_X86_64 = 3, 62
+
+
+class Frame:
+    __slots__ = ("size", "insns", "done", "dynamic", "indirect")
+
+    def __init__(self):
+        self.size = 0
+        self.insns = 0
+        self.done = False       # prologue over
+        self.dynamic = False
+        self.indirect = False
+
+
+# file.c:12:6:name, where name may itself hold colons ("int ns::f(int)")
+SU_ORIGIN_RE = re.compile(r"^.*?:\d+:\d+:(.+)$")
+# GCC's annotations on a source name, and its suffixes on a clone's symbol
+DECORATION_RE = re.compile(r"(\s*\[(?:with|clone) [^\]]*\])+$|"
+                           r"\.(?:constprop|isra|part|cold|lto_priv)(?:\.\d+)*$")
+
+
+def plain_name(name):
+    """The qualified name alone, without return type, template arguments,
+    parameters or clone suffix: "T ns::f(T) [with T = int]", "int
+    ns::f<int>(int) [clone .constprop.0]" and "ns::f(int)" are all "ns::f".
+    Overloads and instances collapse into one name; their frames are maxed."""
+    name = DECORATION_RE.sub("", name)
+    out, depth = [], 0
+    for ch in name:
+        if ch == "<":
+            depth += 1
+        elif ch == ">":
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            if ch == "(":
+                break
+            out.append(ch)
+    return "".join(out).strip().rsplit(" ", 1)[-1]
+
+
+def short_name(name):
+    """The last component of a plain name, for .su files that leave the
+    scope out (gdc gives "f" or "pkg.mod.f" depending on version)."""
+    return re.split(r"::|\.", name)[-1]
+
+
+def stack_usage(root):
+    """plain function name -> bytes, from every *.su file under root."""
+    found = {}
+    for dirpath, _, files in os.walk(root):
+        for f in files:
+            if not f.endswith(".su"):
+                continue
+            for line in open(os.path.join(dirpath, f), errors="replace"):
+                # file.c:12:6:name<TAB>48<TAB>static
+                parts = line.rstrip("\n").split("\t")
+                m = SU_ORIGIN_RE.match(parts[0])
+                if m and len(parts) >= 2 and parts[1].isdigit():
+                    name = plain_name(m.group(1))
+                    found[name] = max(found.get(name, 0), int(parts[1]))
+    return found
+
+
+def demangler(objdump):
+    """The c++filt from objdump's toolchain, else the one on PATH, else None."""
+    head, tail = os.path.split(objdump)
+    if tail.endswith("objdump"):
+        sibling = os.path.join(head, tail[:-len("objdump")] + "c++filt")
+        if shutil.which(sibling):
+            return sibling
+    return shutil.which("c++filt")
+
+
+def demangle(cxxfilt, names):
+    """symbol -> demangled name; D symbols need c++filt told what they are."""
+    out = {n: n for n in names}
+    if not cxxfilt:
+        return out
+    d = sorted(n for n in names if n.startswith("_D"))
+    rest = sorted(n for n in names if not n.startswith("_D"))
+    for batch, style in ((d, ["-s", "dlang"]), (rest, [])):
+        if not batch:
+            continue
+        r = subprocess.run([cxxfilt] + style, input="\n".join(batch) + "\n",
+                           capture_output=True, text=True)
+        lines = r.stdout.splitlines()
+        if r.returncode == 0 and len(lines) == len(batch):
+            out.update(zip(batch, lines))
+    return out
+
+
+def su_frames(su, names, cxxfilt):
+    """symbol -> .su frame size, for each of names the .su data covers.
+
+    Matched on the plain name, or failing that on the last component when
+    the .su files leave the scope off; a name shared that way takes the
+    largest frame, which keeps the figure a bound."""
+    short = {}
+    for name, size in su.items():
+        k = short_name(name)
+        short[k] = max(short.get(k, 0), size)
+    found = {}
+    for sym, pretty in demangle(cxxfilt, names).items():
+        name = plain_name(pretty)
+        size = su.get(name, short.get(short_name(name)))
+        if size is not None:
+            found[sym] = size
+    return found
+
+
+def frames_of(objdump, elf, names, img):
+    frames = {}
+    x86 = img.machine in (EM_386, EM_X86_64)
+    word = img.bits // 8
+
+    def visit(func, start, address, opcode, operands, target):
+        fr = frames.get(func)
+        if fr is None:
+            fr = frames[func] = Frame()
+            if x86:
+                fr.size = word
+        text = f"{opcode} {operands}".strip()
+        if DYNAMIC_RE.match(text):
+            fr.dynamic = True
+        if target is None and INDIRECT_RE.match(opcode) and "<" not in operands:
+            fr.indirect = True
+        if fr.done:
+            return
+        fr.insns += 1
+        if fr.insns > PROLOGUE_INSNS or opcode.startswith(BRANCH_PREFIXES):
+            fr.done = True
+            return
+        for rx, base in FRAME_RES:
+            m = rx.match(text)
+            if m:
+                fr.size += int(m.group(1), base)
+                return
+        m = PUSH_RE.match(text)
+        if m:
+            fr.size += 4 * len([r for r in m.group(1).split(",") if r.strip()])
+        elif X86_PUSH_RE.match(text):
+            fr.size += word
+
+    graph = callgraph(objdump, elf, names, visit)
+    return graph, frames
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("elf")
+    ap.add_argument("--objdump", required=True)
+    ap.add_argument("--entry", action="append", default=[],
+                    help="task entry point (regex on the symbol); repeatable. "
+                         f"Default: {', '.join(DEFAULT_ENTRIES)}")
+    ap.add_argument("--su", help="directory of -fstack-usage .su files")
+    ap.add_argument("--max", type=int, metavar="BYTES",
+                    help="exit non-zero if any root can go deeper than this")
+    ap.add_argument("--all-code", action="store_true",
+                    help="also report every function that nothing calls")
+    args = ap.parse_args()
+
+    img = elffile.load(args.elf)
+    secs = sections(args.elf)
+    code = [s.name for s in img.sections
+            if s.size and s.flags & elffile.SHF_EXECINSTR and s.flags & elffile.SHF_ALLOC]
+    if not code:
+        sys.exit("no code sections found")
+
+    graph, frames = frames_of(args.objdump, args.elf, code, img)
+    starts = {}
+    for s in img.symbols():
+        if s.section is not None and s.type == elffile.STT_FUNC:
+            starts.setdefault(s.name, s.value)
+    su = su_frames(stack_usage(args.su), graph, demangler(args.objdump)) if args.su else {}
+
+    def frame(f):
+        if f in su:
+            return su[f]
+        fr = frames.get(f)
+        return fr.size if fr else None
+
+    # callees proper: a function's edges to itself are its own branches,
+    # unless they land on its first instruction
+    def callees(f):
+        for callee, addr in graph.get(f, ()):
+            if callee == f and starts.get(f) != addr:
+                continue
+            yield callee
+
+    memo, onstack, recursive = {}, set(), set()
+
+    def depth(f):
+        """(bytes, chain, {reasons the figure is only a floor})"""
+        if f in memo:
+            return memo[f]
+        if f in onstack:
+            recursive.add(f)
+            return 0, [f + " (recursion)"], {"recursion"}
+        own = frame(f)
+        why = set()
+        if own is None:
+            why.add("outside analysed code")
+            own = 0
+        fr = frames.get(f)
+        if fr and fr.dynamic:
+            why.add("dynamic frame")
+        if fr and fr.indirect:
+            why.add("indirect call")
+        onstack.add(f)
+        best, chain = 0, []
+        for callee in sorted(set(callees(f))):
+            d, c, w = depth(callee)
+            why |= w
+            if d > best or not chain:
+                best, chain = d, c
+        onstack.discard(f)
+        memo[f] = own + best, [f] + chain, why
+        return memo[f]
+
+    isr = sorted(f for f in roots_of(graph)
+                 if resident(next((n for n, lo, hi in secs
+                                   if lo <= starts.get(f, -1) < hi), None)))
+    patterns = [re.compile(f"^(?:{e})$") for e in args.entry or DEFAULT_ENTRIES]
+    tasks = sorted(f for f in graph if any(p.match(f) for p in patterns))
+    roots = [("isr", f) for f in isr] + [("task", f) for f in tasks if f not in isr]
+    if args.all_code:
+        called = {c for f in graph for c in callees(f) if c != f}
+        roots += [("uncalled", f) for f in sorted(graph)
+                  if f not in called and f not in isr and f not in tasks]
+    if not roots:
+        sys.exit("no roots found: no resident OpenWatt/uRT symbols and no --entry matched")
+
+    rows = []
+    for kind, f in roots:
+        d, chain, why = depth(f)
+        rows.append((d, kind, f, chain, why))
+    rows.sort(key=lambda r: (-r[0], r[2]))
+
+    print(f"functions: {len(graph)}   with a known frame: "
+          f"{sum(1 for f in graph if frame(f) is not None)}"
+          f"{'   from .su: ' + str(len(su)) if su else ''}")
+    print(f"\n{'bytes':>7} {'kind':>8}  root")
+    over = []
+    for d, kind, f, chain, why in rows:
+        floor = ">=" if why else "  "
+        print(f"{floor}{d:5} {kind:>8}  {f}")
+        print(f"{'':17}  via {' -> '.join(chain[1:]) or '(leaf)'}")
+        if why:
+            print(f"{'':17}  not a bound: {', '.join(sorted(why))}")
+        if args.max is not None and (d > args.max or why):
+            over.append(f)
+
+    if recursive:
+        print(f"\nrecursive: {', '.join(sorted(recursive))}")
+    indirect = sorted(f for f in memo if frames.get(f) and frames[f].indirect)
+    if indirect:
+        print(f"indirect calls not followed, in: {', '.join(indirect)}")
+
+    if over:
+        print(f"\n{len(over)} root(s) exceed {args.max} bytes or have no bound")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
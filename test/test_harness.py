@@ -16,6 +16,12 @@ from typing import Optional, List, Dict, Any, Tuple
 import re
 
 
+# Bracket markers for tools/allocprof.py's per-command attribution. Must match
+# OPEN/CLOSE there.
+ALLOC_OPEN = '> '
+ALLOC_CLOSE = '< '
+
+
 class OpenWattConsole:
     """Manages communication with OpenWatt interactive console via stdin/stdout"""
 
@@ -95,6 +101,16 @@ class OpenWattConsole:
             self.connected = False
             raise RuntimeError(f"Error sending command '{cmd}': {e}")
 
+    def mark(self, label: str) -> str:
+        """Drop an M marker into the allocation event stream
+
+        Needs a build with AllocProfile. The response is consumed here so it
+        does not leak into the next command's output.
+        """
+        label = label.replace('"', "'")
+        return self.send_command(f'/system/alloc/mark-point label="{label}"',
+                                 read_delay=0.05, timeout=1.0)
+
     def close(self):
         """Close the connection"""
         if self.process and self.process.stdin:
@@ -115,7 +131,8 @@ class OpenWattConsole:
 class OpenWattProcess:
     """Manages OpenWatt process lifecycle with --interactive mode"""
 
-    def __init__(self, binary_path='bin/x86_64_debug/openwatt', startup_delay=3.0, use_debugger=False):
+    def __init__(self, binary_path='bin/x86_64_debug/openwatt', startup_delay=3.0, use_debugger=False,
+                 stderr_path: Optional[str] = None):
         # Make path absolute if relative
         if not Path(binary_path).is_absolute():
             # Assume relative to project root (parent of test/)
@@ -136,6 +153,10 @@ class OpenWattProcess:
 
         self.startup_delay = startup_delay
         self.use_debugger = use_debugger
+        # Send stderr straight to a file instead of a pipe. The allocation
+        # event stream is far too much for a pipe nobody reads until stop().
+        self.stderr_path = Path(stderr_path) if stderr_path else None
+        self._stderr_file = None
         self.process: Optional[subprocess.Popen] = None
         self.console: Optional[OpenWattConsole] = None
         self.output_lines: List[str] = []
@@ -157,11 +178,13 @@ class OpenWattProcess:
             # Keep stderr separate so we can capture logs
             # Use line buffering (bufsize=1) for text mode
             # Run from project root so conf/startup.conf can be found
+            if self.stderr_path:
+                self._stderr_file = open(self.stderr_path, 'w', encoding='utf-8')
             self.process = subprocess.Popen(
                 [str(self.binary_path), '--interactive'],
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,  # Separate stderr for logs
+                stderr=self._stderr_file or subprocess.PIPE,  # Separate stderr for logs
                 text=True,
                 bufsize=1,
                 encoding='utf-8',
@@ -203,7 +226,11 @@ class OpenWattProcess:
                     pass
 
             # Capture stderr (assertions, error messages)
-            if self.process.stderr:
+            if self._stderr_file:
+                self._stderr_file.flush()
+                with open(self.stderr_path, encoding='utf-8', errors='replace') as f:
+                    self.stderr_lines.extend(f.read().splitlines())
+            elif self.process.stderr:
                 try:
                     remaining_err = self.process.stderr.read()
                     if remaining_err:
@@ -286,6 +313,10 @@ class OpenWattProcess:
                 pass
             self.process = None
 
+        if self._stderr_file:
+            self._stderr_file.close()
+            self._stderr_file = None
+
         # Cleanup temp files (unless crashed - keep crash info)
         if not self.crashed:
             for f in [self.crash_file, self.output_file, self.log_file]:
@@ -334,10 +365,17 @@ class OpenWattProcess:
 
 
 class TestRunner:
-    """Runs test cases against OpenWatt"""
+    """Runs test cases against OpenWatt
+
+    With alloc_log set, stderr (and the allocation event stream with it) is
+    written to that file and every test is bracketed with markers, so
+    `tools/allocprof.py commands <alloc_log>` can attribute allocations to
+    each test.
+    """
 
-    def __init__(self, auto_start=True):
+    def __init__(self, auto_start=True, alloc_log: Optional[str] = None):
         self.auto_start = auto_start
+        self.alloc_log = alloc_log
         self.process: Optional[OpenWattProcess] = None
         self.results: List[Dict[str, Any]] = []
 
@@ -347,7 +385,7 @@ class TestRunner:
         print("=" * 60)
 
         if self.auto_start:
-            self.process = OpenWattProcess()
+            self.process = OpenWattProcess(stderr_path=self.alloc_log)
             if not self.process.start():
                 return {'success': False, 'error': 'Failed to start OpenWatt'}
 
@@ -355,6 +393,8 @@ class TestRunner:
             console = self.process.get_console()
             if not console:
                 return {'success': False, 'error': 'Failed to get console'}
+            if self.alloc_log:
+                console.send_command('/system/alloc/log enable=true')
 
             for i, test in enumerate(tests, 1):
                 # Check if process crashed
@@ -373,8 +413,11 @@ class TestRunner:
                         'results': self.results
                     }
 
-                print(f"\n[{i}/{len(tests)}] {test.get('name', 'Unnamed test')}")
+                name = test.get('name', 'Unnamed test')
+                print(f"\n[{i}/{len(tests)}] {name}")
+                self._mark(console, f"{ALLOC_OPEN}test {name}")
                 result = self._run_test(console, test)
+                self._mark(console, f"{ALLOC_CLOSE}test {name}")
                 self.results.append(result)
 
                 if result['success']:
@@ -404,6 +447,15 @@ class TestRunner:
             'results': self.results
         }
 
+    def _mark(self, console: OpenWattConsole, label: str):
+        """Bracket marker for allocprof; a dead console shows up as a crash next test"""
+        if not self.alloc_log:
+            return
+        try:
+            console.mark(label)
+        except RuntimeError:
+            pass
+
     def _run_test(self, console: OpenWattConsole, test: Dict[str, Any]) -> Dict[str, Any]:
         """Run a single test"""
         cmd = test.get('command')
@@ -518,6 +570,8 @@ def main():
     parser.add_argument('--commands', nargs='+', help='Commands to run in quick mode')
     parser.add_argument('--output', help='Output file for results')
     parser.add_argument('--suite', help='JSON file with test suite')
+    parser.add_argument('--alloc-log', help='Capture the allocation event stream to this file, '
+                                            'with each test bracketed for tools/allocprof.py commands')
 
     args = parser.parse_args()
 
@@ -528,7 +582,7 @@ def main():
     elif args.suite:
         with open(args.suite) as f:
             tests = json.load(f)
-        runner = TestRunner()
+        runner = TestRunner(alloc_log=args.alloc_log)
         result = runner.run_test_suite(tests)
         sys.exit(0 if result['success'] else 1)
 
@@ -52,6 +52,12 @@ API Reference:
         session.show_response(20)            # Print first 20 lines
         session.save_response('file.txt')   # Save to file
 
+    Allocation attribution (needs an AllocProfile build):
+        session = TestSession(alloc_log='alloc.log')
+        session.cmd('/device/print')     # bracketed with allocation markers
+        session.mark('> warmup') ... session.mark('< warmup')
+        # then: python tools/allocprof.py commands alloc.log --elf <binary>
+
     Utilities:
         session.history()            # Show command history
         session.quiet()              # Disable verbose output
@@ -74,7 +80,7 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(__file__))
 
-from test_harness import OpenWattProcess, OpenWattConsole
+from test_harness import OpenWattProcess, OpenWattConsole, ALLOC_OPEN, ALLOC_CLOSE
 import re
 import time
 from typing import Optional, List, Dict, Any
@@ -83,10 +89,14 @@ from typing import Optional, List, Dict, Any
 class TestSession:
     """Persistent test session for iterative development"""
 
-    def __init__(self, binary_path='bin/x86_64_debug/openwatt', auto_start=False):
+    def __init__(self, binary_path='bin/x86_64_debug/openwatt', auto_start=False,
+                 alloc_log: Optional[str] = None):
         self.process: Optional[OpenWattProcess] = None
         self.console: Optional[OpenWattConsole] = None
         self.binary_path = binary_path
+        # When set, stderr and the allocation event stream go to this file and
+        # every cmd() is bracketed with markers for `allocprof.py commands`
+        self.alloc_log = alloc_log
         self.last_response: str = ""
         self.command_history: List[Dict[str, Any]] = []
         self.verbose = True
@@ -101,7 +111,7 @@ class TestSession:
             return True
 
         print("Starting OpenWatt...")
-        self.process = OpenWattProcess(self.binary_path)
+        self.process = OpenWattProcess(self.binary_path, stderr_path=self.alloc_log)
         if not self.process.start():
             crash_info = self.process.get_crash_info()
             if crash_info:
@@ -118,6 +128,9 @@ class TestSession:
             self.stop()
             return False
 
+        if self.alloc_log:
+            self.console.send_command('/system/alloc/log enable=true')
+
         print("Session ready!")
         return True
 
@@ -161,9 +174,13 @@ class TestSession:
         if self.verbose:
             print(f"\n> {command}")
 
+        if self.alloc_log:
+            self.console.mark(f"{ALLOC_OPEN}cmd {command}")
         start_time = time.time()
         self.last_response = self.console.send_command(command, read_delay=delay, timeout=timeout)
         elapsed = time.time() - start_time
+        if self.alloc_log:
+            self.console.mark(f"{ALLOC_CLOSE}cmd {command}")
 
         # Record in history
         self.command_history.append({
@@ -179,6 +196,16 @@ class TestSession:
 
         return self.last_response
 
+    def mark(self, label: str):
+        """Drop a marker into the allocation event stream
+
+        Labels starting with '> ' and '< ' open and close a window of their
+        own, which allocprof reports alongside the per-command ones.
+        """
+        if not self.is_running():
+            raise RuntimeError("Session not running")
+        self.console.mark(label)
+
     def expect_contains(self, text: str, msg: Optional[str] = None) -> bool:
         """Validate last response contains text"""
         result = text in self.last_response
@@ -13,6 +13,31 @@ where the ELF and its symbols already are.
 Usage:
     allocprof.py <logfile> [--elf BINARY] [--addr2line TOOL]
                  [--hot-ms N] [--top N] [--split-at LABEL]
+                 [--folded PREFIX] [--timeline PATH] [--timeline-ms N]
+    allocprof.py diff <before> <after> [--elf BINARY | --elf-before BINARY
+                 --elf-after BINARY] [--hot-ms N] [--top N] [--split-at LABEL]
+    allocprof.py commands <logfile> [--elf BINARY] [--sort COLUMN]
+                 [--sites N] [--fail-leaked BYTES]
+    allocprof.py trend <logfile> [--elf BINARY] [--every PREFIX]
+                 [--min-rate BYTES_PER_HOUR] [--heap SIZE] [--top N]
+
+--folded writes the whole captured stack of every allocation, per lifetime
+class, for a flame graph; --timeline writes live bytes over time, split at
+each marker.
+
+commands attributes allocations to the console commands or tests the harness
+bracketed with "> label" / "< label" markers (test/test_session.py, alloc_log):
+bytes allocated, peak above the level the window opened at, bytes still held
+when it closed, and bytes never freed at all.
+
+trend samples the bytes each call site holds at every periodic marker of a
+soak capture (label starting "soak" by default), fits the growth, and tells
+caches that level off from leaks that keep climbing; with --heap it projects
+how long the board has before the heap runs out.
+
+diff replays both captures and lines call sites up by resolved symbol, so
+the two may come from different builds. Sites are ranked by the change in
+bytes they still hold at the end of the capture, then by bytes allocated.
 
 Lifetime classes, matching the vocabulary the tool was built around:
     transient   freed within --hot-ms
@@ -23,15 +48,19 @@ Lifetime classes, matching the vocabulary the tool was built around:
 
 import argparse
 import collections
+import csv
+import json
 import re
 import shutil
 import subprocess
 import sys
 
+import elffile
+
 EVENT = re.compile(r"\bap ([AFRMB]) ([0-9a-f]+) (.*)$")
 
 
-def find_slide(path, elf, nm="nm"):
+def find_slide(path, elf):
     """Recover the PIE/ASLR load slide from the stream's B event.
 
     The target emits the runtime address of one named symbol; the same
@@ -44,19 +73,20 @@ def find_slide(path, elf, nm="nm"):
         if kind == "B" and len(f) >= 2:
             runtime, symbol = int(f[0], 16), f[1]
             break
-    if runtime is None or not elf or not shutil.which(nm):
+    if runtime is None or not elf:
         return 0
 
     try:
-        out = subprocess.run([nm, elf], capture_output=True, text=True,
-                             check=True).stdout
-    except subprocess.CalledProcessError:
+        syms = elffile.load(elf).symbols()
+    except (OSError, ValueError) as e:
+        print(f"warning: {e}; assuming no slide", file=sys.stderr)
         return 0
 
-    for line in out.splitlines():
-        parts = line.split()
-        if len(parts) >= 3 and symbol in parts[-1]:
-            return runtime - int(parts[0], 16)
+    # exact name first; the stream may carry a prefix of a mangled one
+    for match in (lambda n: n == symbol, lambda n: symbol in n):
+        for s in syms:
+            if s.section is not None and match(s.name):
+                return runtime - s.value
 
     print(f"warning: symbol {symbol} not found in {elf}; assuming no slide",
           file=sys.stderr)
@@ -64,13 +94,18 @@ def find_slide(path, elf, nm="nm"):
 
 
 class Alloc:
-    __slots__ = ("size", "t_alloc", "frames", "freed_at")
+    # mark and freed_mark count the M events seen before the allocation and
+    # the free. Timestamps are milliseconds and a marker often shares one
+    # with the events either side of it; the count never does.
+    __slots__ = ("size", "t_alloc", "frames", "freed_at", "mark", "freed_mark")
 
-    def __init__(self, size, t_alloc, frames):
+    def __init__(self, size, t_alloc, frames, mark=0):
         self.size = size
         self.t_alloc = t_alloc
         self.frames = frames
         self.freed_at = None
+        self.mark = mark
+        self.freed_mark = None
 
 
 def parse(path):
@@ -84,7 +119,9 @@ def parse(path):
             yield kind, ms, rest
 
 
-def replay(path):
+def replay(path, series=None):
+    """Replay the stream; if series is a list, append (ms, live_bytes,
+    markers_so_far) to it after every allocation, free and realloc."""
     live = {}                 # ptr -> Alloc
     done = []                 # completed Allocs
     marks = []                # (ms, label)
@@ -106,8 +143,10 @@ def replay(path):
             # A repeated pointer means we missed the free (log truncated at
             # the front, or the stream was toggled off); retire the old one.
             if ptr in live:
-                done.append(live.pop(ptr))
-            live[ptr] = Alloc(size, ms, frames)
+                stale = live.pop(ptr)
+                stale.freed_mark = len(marks)
+                done.append(stale)
+            live[ptr] = Alloc(size, ms, frames, len(marks))
             cur_bytes += size
 
         elif kind == "R":
@@ -120,7 +159,8 @@ def replay(path):
             # A moved block keeps its identity, so the original call site
             # follows it rather than reading as churn.
             live[ptr] = Alloc(size, prev.t_alloc if prev else ms,
-                              prev.frames if prev else [])
+                              prev.frames if prev else [],
+                              prev.mark if prev else len(marks))
             cur_bytes += size
 
         elif kind == "F":
@@ -131,9 +171,12 @@ def replay(path):
                 unmatched_frees += 1
                 continue
             a.freed_at = ms
+            a.freed_mark = len(marks)
             cur_bytes -= a.size
             done.append(a)
 
+        if series is not None:
+            series.append((ms, cur_bytes, len(marks)))
         if cur_bytes > peak_bytes:
             peak_bytes, peak_at = cur_bytes, ms
 
@@ -189,29 +232,19 @@ def blame(frames, syms):
     return frames[-1], "(trace too shallow -- raise trace_depth)", ""
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("logfile")
-    ap.add_argument("--elf", help="binary to resolve call sites against")
-    ap.add_argument("--addr2line", default="addr2line")
-    ap.add_argument("--hot-ms", type=int, default=1000,
-                    help="freed within this many ms counts as transient")
-    ap.add_argument("--top", type=int, default=15)
-    ap.add_argument("--split-at", default="boot-complete",
-                    help="marker splitting immortal from long-lived")
-    args = ap.parse_args()
+def split_time(marks, label):
+    """Time of the first marker carrying label, or None."""
+    for ms, l in marks:
+        if l == label:
+            return ms
+    return None
 
-    live, done, marks, peak_bytes, peak_at, unmatched = replay(args.logfile)
-
-    split_ms = None
-    for ms, label in marks:
-        if label == args.split_at:
-            split_ms = ms
-            break
 
+def classify(live, done, split_ms, hot_ms):
+    """Sort every allocation into (transient, long_lived, immortal)."""
     transient, long_lived, immortal = [], [], []
     for a in done:
-        if a.freed_at is not None and a.freed_at - a.t_alloc < args.hot_ms:
+        if a.freed_at is not None and a.freed_at - a.t_alloc < hot_ms:
             transient.append(a)
         elif split_ms is not None and a.t_alloc <= split_ms:
             immortal.append(a)
@@ -223,6 +256,126 @@ def main():
             immortal.append(a)
         else:
             long_lived.append(a)
+    return transient, long_lived, immortal
+
+
+def symbolise(path, groups, elf, tool):
+    """Resolve every frame any allocation in groups captured.
+
+    Returns (syms, slide) so the caller can say when a slide was applied.
+    """
+    every = {a for grp in groups for x in grp for a in x.frames}
+    slide = find_slide(path, elf)
+    return resolve(sorted(every), elf, tool, slide), slide
+
+
+def by_site(group, syms):
+    """Aggregate allocations by blamed call site: [count, bytes, largest]."""
+    sites = collections.defaultdict(lambda: [0, 0, 0])
+    for a in group:
+        s = sites[blame(a.frames, syms)]
+        s[0] += 1
+        s[1] += a.size
+        s[2] = max(s[2], a.size)
+    return sites
+
+
+CLASSES = ("immortal", "long-lived", "transient")
+
+
+# -- exports ------------------------------------------------------------------
+#
+# blame() keeps one frame per allocation, which is the right answer to "who
+# asked" and the wrong one to "which subsystem's paths churn". These keep the
+# whole captured stack, in Brendan Gregg's folded format (root first, frames
+# joined by ';', weight last) so flamegraph.pl and speedscope read it as is.
+
+def frame_name(addr, syms):
+    fn = syms.get(addr, ("", ""))[0]
+    name = fn if fn and fn != "??" else f"0x{addr}"
+    return name.replace(";", ":")
+
+
+def folded(group, syms, by_bytes):
+    """Collapse each allocation's stack, weighted by bytes or by count."""
+    stacks = collections.Counter()
+    for a in group:
+        # frames are captured innermost first; flame graphs want the root
+        stack = ";".join(frame_name(f, syms) for f in reversed(a.frames))
+        stacks[stack or "(no frames)"] += a.size if by_bytes else 1
+    return stacks
+
+
+def write_folded(prefix, groups, syms):
+    """One file per lifetime class and weight: <prefix>.<class>.<weight>.folded"""
+    written = []
+    for name, group in zip(CLASSES, groups):
+        if not group:
+            continue
+        for weight, by_bytes in (("bytes", True), ("count", False)):
+            path = f"{prefix}.{name}.{weight}.folded"
+            with open(path, "w") as f:
+                for stack, n in sorted(folded(group, syms, by_bytes).items()):
+                    f.write(f"{stack} {n}\n")
+            written.append(path)
+    return written
+
+
+def timeline(series, marks, step_ms):
+    """Bucket replay() series samples into (marker, ms, live, peak) rows.
+
+    marker is the label of the last M event before the bucket, or "" ahead
+    of the first one. A bucket never straddles a marker, so every row
+    belongs to one stretch of the capture; live is the level at the end of
+    the bucket and peak the highest it reached inside it.
+    """
+    rows, label, bucket, m, since = [], "", None, 0, 0
+    for ms, live, seen in series:
+        while m < seen:
+            if bucket:
+                rows.append((label, *bucket))
+                bucket = None
+            since, label = marks[m]
+            m += 1
+        if bucket and (not step_ms or ms - bucket[0] >= step_ms):
+            rows.append((label, *bucket))
+            bucket = None
+        if bucket is None:
+            start = ms - ms % step_ms if step_ms else ms
+            bucket = [max(start, since), live, live]
+        bucket[1] = live
+        bucket[2] = max(bucket[2], live)
+    if bucket:
+        rows.append((label, *bucket))
+    return rows
+
+
+def write_timeline(path, rows):
+    """CSV, or JSON grouped by marker if path ends in .json."""
+    if path.endswith(".json"):
+        segments = []
+        for label, ms, live, peak in rows:
+            if not segments or segments[-1]["marker"] != label:
+                segments.append({"marker": label, "start_ms": ms, "points": []})
+            segments[-1]["points"].append([ms, live, peak])
+        with open(path, "w") as f:
+            json.dump({"columns": ["ms", "live_bytes", "peak_bytes"],
+                       "segments": segments}, f)
+            f.write("\n")
+        return
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(("marker", "ms", "live_bytes", "peak_bytes"))
+        w.writerows(rows)
+
+
+def report(args):
+    series = [] if args.timeline else None
+    live, done, marks, peak_bytes, peak_at, unmatched = replay(args.logfile,
+                                                               series)
+
+    split_ms = split_time(marks, args.split_at)
+    transient, long_lived, immortal = classify(live, done, split_ms, args.hot_ms)
 
     # Transient headroom: peak bytes held by allocations that turned out to
     # be transient, plus the largest single one. This is what the heap must
@@ -265,25 +418,22 @@ def main():
     print(f"\nNever freed during capture: {len(never)} allocs, "
           f"{total(never)} bytes ({len(after)} of them after '{args.split_at}')")
 
-    every = {a for grp in (immortal, long_lived, transient) for x in grp
-             for a in x.frames}
-    slide = find_slide(args.logfile, args.elf)
+    groups = (immortal, long_lived, transient)
+    syms, slide = symbolise(args.logfile, groups, args.elf, args.addr2line)
     if slide:
         print(f"\n(load slide 0x{slide:x} recovered from the stream)")
-    syms = resolve(sorted(every), args.elf, args.addr2line, slide)
 
-    for name, group in (("immortal", immortal), ("long-lived", long_lived),
-                        ("transient", transient)):
+    if args.folded:
+        for path in write_folded(args.folded, groups, syms):
+            print(f"wrote {path}")
+    if args.timeline:
+        write_timeline(args.timeline, timeline(series, marks, args.timeline_ms))
+        print(f"wrote {args.timeline}")
+
+    for name, group in zip(CLASSES, groups):
         if not group:
             continue
-        sites = collections.defaultdict(lambda: [0, 0, 0])  # count, bytes, max
-        for a in group:
-            key = blame(a.frames, syms)
-            s = sites[key]
-            s[0] += 1
-            s[1] += a.size
-            s[2] = max(s[2], a.size)
-
+        sites = by_site(group, syms)
         print(f"\n{name} by call site (top {args.top} of {len(sites)}):")
         ranked = sorted(sites.items(), key=lambda kv: kv[1][1], reverse=True)
         for (addr, fn, loc), (count, byts, mx) in ranked[:args.top]:
@@ -291,5 +441,399 @@ def main():
             print(f"  {byts:9} bytes  {count:5} allocs  (largest {mx:6})  {where}")
 
 
+# -- diff ---------------------------------------------------------------------
+#
+# Two captures from two builds share no addresses, so sites are keyed by the
+# symbol blame() resolved, not by PC. The source line is left out of the key
+# too: an unrelated edit above the call moves it. A site that never resolved
+# keeps its raw address and will only line up against the same build.
+
+def site_key(key):
+    addr, fn, _ = key
+    return fn if fn and fn != "??" else f"0x{addr}"
+
+
+def capture(path, elf, tool, hot_ms, split_at):
+    """Replay one capture into {site: {class: [count, bytes, largest]}}."""
+    live, done, marks, peak_bytes, _, _ = replay(path)
+    split_ms = split_time(marks, split_at)
+    groups = classify(live, done, split_ms, hot_ms)[::-1]   # CLASSES order
+    syms, _ = symbolise(path, groups, elf, tool)
+
+    sites = collections.defaultdict(dict)
+    for name, group in zip(CLASSES, groups):
+        for key, (count, byts, mx) in by_site(group, syms).items():
+            slot = sites[site_key(key)].setdefault(name, [0, 0, 0])
+            slot[0] += count
+            slot[1] += byts
+            slot[2] = max(slot[2], mx)
+    return sites, peak_bytes, split_ms is not None
+
+
+def dominant(classes):
+    """The lifetime class holding most of a site's bytes, or '-'."""
+    if not classes:
+        return "-"
+    return max(CLASSES, key=lambda c: classes.get(c, (0, 0, 0))[1])
+
+
+# Transient bytes come back; immortal and long-lived ones are what the heap
+# has to carry. Rank by the held bytes so churn cannot drown out a leak.
+HELD = ("immortal", "long-lived")
+
+
+def diff(argv):
+    ap = argparse.ArgumentParser(prog="allocprof.py diff")
+    ap.add_argument("before")
+    ap.add_argument("after")
+    ap.add_argument("--elf", help="binary both captures ran (same build)")
+    ap.add_argument("--elf-before", help="binary the first capture ran")
+    ap.add_argument("--elf-after", help="binary the second capture ran")
+    ap.add_argument("--addr2line", default="addr2line")
+    ap.add_argument("--hot-ms", type=int, default=1000,
+                    help="freed within this many ms counts as transient")
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--split-at", default="boot-complete",
+                    help="marker splitting immortal from long-lived")
+    args = ap.parse_args(argv)
+
+    side = {}
+    for label, path, elf in (("before", args.before, args.elf_before or args.elf),
+                             ("after", args.after, args.elf_after or args.elf)):
+        sites, peak, split = capture(path, elf, args.addr2line,
+                                     args.hot_ms, args.split_at)
+        if not split:
+            print(f"  ({label}: no '{args.split_at}' marker: nothing counted "
+                  "as immortal)")
+        side[label] = sites, peak
+
+    (old, old_peak), (new, new_peak) = side["before"], side["after"]
+
+    def sums(classes, which=CLASSES):
+        count = sum(classes[c][0] for c in which if c in classes)
+        byts = sum(classes[c][1] for c in which if c in classes)
+        mx = max((classes[c][2] for c in which if c in classes), default=0)
+        return count, byts, mx
+
+    rows = []
+    for site in old.keys() | new.keys():
+        a, b = old.get(site, {}), new.get(site, {})
+        ac, ab, am = sums(a)
+        bc, bb, bm = sums(b)
+        held = sums(b, HELD)[1] - sums(a, HELD)[1]
+        rows.append((held, bb - ab, bc - ac, am, bm,
+                     dominant(a), dominant(b), site, not a, not b))
+
+    print(f"before: {args.before}  peak {old_peak} bytes, {len(old)} sites")
+    print(f"after:  {args.after}  peak {new_peak} bytes, {len(new)} sites")
+    print(f"peak live bytes: {new_peak - old_peak:+d}")
+
+    def show(title, picked):
+        print(f"\n{title} (top {args.top} of {len(picked)}):")
+        print(f"  {'held':>9} {'bytes':>9} {'count':>7} {'largest':>16}  "
+              f"{'class':<23}  site")
+        for held, db, dc, am, bm, ca, cb, site, added, gone in picked[:args.top]:
+            cls = ca if ca == cb else f"{ca} -> {cb}"
+            tag = "  (new)" if added else "  (gone)" if gone else ""
+            print(f"  {held:+9d} {db:+9d} {dc:+7d} {am:>6} -> {bm:<6}  "
+                  f"{cls:<23}  {site}{tag}")
+
+    # A site that grew held bytes is a regression even if its churn fell;
+    # one that only churns more sorts after them, by total bytes.
+    worse = sorted((r for r in rows if r[0] > 0 or (r[0] == 0 and r[1] > 0)),
+                   key=lambda r: (r[0], r[1]), reverse=True)
+    better = sorted((r for r in rows if r[0] < 0 or (r[0] == 0 and r[1] < 0)),
+                    key=lambda r: (r[0], r[1]))
+    if worse:
+        show("regressions by held bytes", worse)
+    if better:
+        show("improvements", better)
+    if not worse and not better:
+        print("\nno per-site change in allocated bytes")
+
+
+# -- commands -----------------------------------------------------------------
+#
+# The test harness brackets each console command (or each test) it sends
+# with a pair of markers, "> <what>" before and "< <what>" after. Each pair
+# is a window, and an allocation belongs to the innermost window open when
+# it was made. Windows with the same label are one row, so a command the
+# suite sends ten times shows up once with ten runs.
+
+OPEN, CLOSE = "> ", "< "
+
+
+def windows(marks):
+    """Pair bracket markers into windows.
+
+    Returns (windows, owner, unmatched): each window is [label, open_idx,
+    close_idx] in marker indices, owner[n] is the window innermost-open
+    after the first n markers (or None), and unmatched counts markers that
+    opened or closed nothing.
+    """
+    found, owner, stack, unmatched = [], [None], [], 0
+    for i, (_, label) in enumerate(marks):
+        if label.startswith(OPEN):
+            found.append([label[len(OPEN):], i, None])
+            stack.append(len(found) - 1)
+        elif label.startswith(CLOSE):
+            what = label[len(CLOSE):]
+            for depth in range(len(stack) - 1, -1, -1):
+                if found[stack[depth]][0] == what:
+                    # anything opened inside and never closed ends here too
+                    for w in stack[depth:]:
+                        found[w][2] = i
+                    unmatched += len(stack) - depth - 1
+                    del stack[depth:]
+                    break
+            else:
+                unmatched += 1
+        owner.append(stack[-1] if stack else None)
+    unmatched += len(stack)     # still open when the capture stopped
+    return found, owner, unmatched
+
+
+def commands(argv):
+    ap = argparse.ArgumentParser(prog="allocprof.py commands")
+    ap.add_argument("logfile")
+    ap.add_argument("--elf", help="binary to resolve call sites against")
+    ap.add_argument("--addr2line", default="addr2line")
+    ap.add_argument("--top", type=int, default=30)
+    ap.add_argument("--sort", choices=("bytes", "allocs", "peak", "retained",
+                                       "leaked"), default="bytes")
+    ap.add_argument("--sites", type=int, default=3,
+                    help="call sites to show under each command that leaked")
+    ap.add_argument("--fail-leaked", type=int, metavar="BYTES",
+                    help="exit non-zero if any command leaked more than this")
+    args = ap.parse_args(argv)
+
+    series = []
+    live, done, marks, _, _, _ = replay(args.logfile, series)
+    found, owner, unmatched = windows(marks)
+    if not found:
+        print(f"no '{OPEN.strip()}'/'{CLOSE.strip()}' markers in "
+              f"{args.logfile}; was the capture taken with the harness's "
+              "alloc_log option?", file=sys.stderr)
+        return 1
+
+    # Heap level when each marker was hit, and the highest level reached
+    # between each marker and the next; a window's peak is measured from
+    # the level it opened at.
+    level = [0] * (len(marks) + 1)
+    high = [0] * (len(marks) + 1)
+    cur = seen = 0
+    for _, cur_next, n in series:
+        while seen < n:
+            seen += 1
+            level[seen] = high[seen] = cur
+        cur = cur_next
+        high[n] = max(high[n], cur)
+    while seen < len(marks):
+        seen += 1
+        level[seen] = high[seen] = cur
+
+    # label -> [runs, allocs, bytes, peak, retained, leaked]
+    rows = collections.defaultdict(lambda: [0, 0, 0, 0, 0, 0])
+    leaks = collections.defaultdict(list)
+    for label, lo, hi in found:
+        if hi is None:
+            continue
+        r = rows[label]
+        r[0] += 1
+        base = level[lo + 1]
+        r[3] = max(r[3], max(high[lo + 1:hi + 1]) - base)
+
+    for a, never in [(a, False) for a in done] + [(a, True) for a in live.values()]:
+        w = owner[a.mark]
+        if w is None or found[w][2] is None:
+            continue
+        label, _, hi = found[w]
+        r = rows[label]
+        r[1] += 1
+        r[2] += a.size
+        if a.freed_mark is None or a.freed_mark > hi:
+            r[4] += a.size
+        if never:
+            r[5] += a.size
+            leaks[label].append(a)
+
+    syms = {}
+    if args.sites and leaks:
+        syms, _ = symbolise(args.logfile, leaks.values(), args.elf,
+                            args.addr2line)
+
+    col = ("runs", "allocs", "bytes", "peak", "retained",
+           "leaked").index(args.sort)
+    ranked = sorted(rows.items(), key=lambda kv: kv[1][col], reverse=True)
+    print(f"{len(found)} windows, {len(rows)} distinct "
+          f"(top {args.top} by {args.sort})")
+    if unmatched:
+        print(f"  ({unmatched} unmatched bracket markers -- command timed "
+              "out or capture cut short?)")
+    print(f"\n{'runs':>5} {'allocs':>7} {'bytes':>9} {'peak':>8} "
+          f"{'retained':>9} {'leaked':>8}  command")
+    for label, (runs, n, byts, peak, kept, leaked) in ranked[:args.top]:
+        print(f"{runs:5} {n:7} {byts:9} {peak:8} {kept:9} {leaked:8}  {label}")
+        if leaked and args.sites:
+            sites = by_site(leaks[label], syms)
+            top = sorted(sites.items(), key=lambda kv: kv[1][1], reverse=True)
+            for (addr, fn, loc), (count, lb, _) in top[:args.sites]:
+                where = f"{fn} [{loc}]" if fn else f"0x{addr}"
+                print(f"{'':>51}  leaked {lb} bytes in {count}: {where}")
+
+    if args.fail_leaked is not None:
+        over = [l for l, r in rows.items() if r[5] > args.fail_leaked]
+        if over:
+            print(f"\nFAIL: {len(over)} command(s) leaked more than "
+                  f"{args.fail_leaked} bytes: {', '.join(over)}")
+            return 1
+    return 0
+
+
+# -- trend --------------------------------------------------------------------
+#
+# A soak capture drops a marker every so often ("soak", "soak 12", ...). At
+# each one we take the bytes every call site holds and fit a line through
+# them. A cache fills and then holds steady; a leak keeps climbing at the
+# same rate. Comparing the slope over the last half of the samples with the
+# slope over all of them tells the two apart without guessing a warm-up time.
+
+def slope(points):
+    """Least-squares (slope, r^2) of (x, y) points."""
+    n = len(points)
+    mx = sum(x for x, _ in points) / n
+    my = sum(y for _, y in points) / n
+    sxx = sum((x - mx) ** 2 for x, _ in points)
+    sxy = sum((x - mx) * (y - my) for x, y in points)
+    syy = sum((y - my) ** 2 for _, y in points)
+    if not sxx:
+        return 0.0, 0.0
+    b = sxy / sxx
+    return b, (sxy * sxy / (sxx * syy) if syy else 1.0)
+
+
+def parse_size(text):
+    """'327680', '320K', '320KB', '8M' -> bytes."""
+    m = re.fullmatch(r"\s*(\d+)\s*([KMG]?)i?B?\s*", text, re.IGNORECASE)
+    if not m:
+        raise argparse.ArgumentTypeError(f"not a size: {text!r}")
+    return int(m.group(1)) << {"": 0, "K": 10, "M": 20, "G": 30}[m.group(2).upper()]
+
+
+def trend(argv):
+    ap = argparse.ArgumentParser(prog="allocprof.py trend")
+    ap.add_argument("logfile")
+    ap.add_argument("--elf", help="binary to resolve call sites against")
+    ap.add_argument("--addr2line", default="addr2line")
+    ap.add_argument("--every", default="soak", metavar="PREFIX",
+                    help="markers whose label starts with this are samples")
+    ap.add_argument("--min-rate", type=float, default=1.0,
+                    help="bytes/hour below which a site is not reported")
+    ap.add_argument("--heap", type=parse_size,
+                    help="heap the board has (e.g. 160K); projects time to "
+                         "exhaustion from the peak seen and the leak rate")
+    ap.add_argument("--top", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    live, done, marks, peak_bytes, _, _ = replay(args.logfile)
+    samples = [(i, ms) for i, (ms, label) in enumerate(marks)
+               if label.startswith(args.every)]
+    if len(samples) < 4:
+        print(f"need at least 4 '{args.every}' markers to fit a trend, "
+              f"found {len(samples)}", file=sys.stderr)
+        return 1
+    first, last = samples[0][0], samples[-1][0]
+
+    # Only allocations alive across at least one sample can move the curve.
+    spanning = [a for a in done + list(live.values())
+                if a.mark <= last and (a.freed_mark is None or a.freed_mark > first)]
+    syms, _ = symbolise(args.logfile, [spanning], args.elf, args.addr2line)
+
+    # site -> {marker index: byte delta}; held at sample i is the running sum
+    # up to i of every allocation made before it and not yet freed.
+    steps = collections.defaultdict(collections.Counter)
+    for a in spanning:
+        key = site_key(blame(a.frames, syms))
+        steps[key][a.mark] += a.size
+        if a.freed_mark is not None:
+            steps[key][a.freed_mark] -= a.size
+
+    t0 = samples[0][1]
+    rows = []
+    for site, delta in steps.items():
+        held, cur, pending, p = [], 0, sorted(delta.items()), 0
+        for i, ms in samples:
+            while p < len(pending) and pending[p][0] <= i:
+                cur += pending[p][1]
+                p += 1
+            held.append(((ms - t0) / 3600000, cur))
+        rate, r2 = slope(held)
+        if rate < args.min_rate:
+            continue
+        half = held[len(held) // 2:]
+        tail, _ = slope(half) if len(half) >= 2 else (rate, 0.0)
+        # Still climbing at (at least half) its average rate: a leak. Climbed
+        # and then levelled off: something filling up to its working size.
+        kind = ("leak" if tail >= 0.5 * rate else
+                "plateau" if tail <= 0.1 * rate else "slowing")
+        rows.append((kind, tail if kind == "leak" else rate, r2,
+                     held[0][1], held[-1][1], site))
+
+    hours = (samples[-1][1] - t0) / 3600000
+    print(f"{len(samples)} '{args.every}' samples over {hours:.1f} h, "
+          f"peak live {peak_bytes} bytes")
+    if not rows:
+        print(f"no call site grew faster than {args.min_rate:g} bytes/hour")
+        return 0
+
+    order = {"leak": 0, "slowing": 1, "plateau": 2}
+    rows.sort(key=lambda r: (order[r[0]], -r[1]))
+    print(f"\n{'bytes/h':>10} {'r2':>5} {'held first -> last':>23}  "
+          f"{'class':<8}  site")
+    for kind, rate, r2, lo, hi, site in rows[:args.top]:
+        print(f"{rate:10.1f} {r2:5.2f} {lo:10} -> {hi:<9}  {kind:<8}  {site}")
+
+    leaking = sum(r[1] for r in rows if r[0] == "leak")
+    print(f"\nleak rate: {leaking:.1f} bytes/hour across "
+          f"{sum(r[0] == 'leak' for r in rows)} site(s)")
+    if args.heap:
+        headroom = args.heap - peak_bytes
+        if headroom <= 0:
+            print(f"heap {args.heap}: already exhausted at the capture's peak")
+        elif leaking > 0:
+            h = headroom / leaking
+            print(f"heap {args.heap}, {headroom} free at peak: exhausted in "
+                  f"~{h:.0f} h ({h / 24:.1f} days)")
+    return 0
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "diff":
+        return diff(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "commands":
+        return commands(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "trend":
+        return trend(sys.argv[2:])
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("logfile")
+    ap.add_argument("--elf", help="binary to resolve call sites against")
+    ap.add_argument("--addr2line", default="addr2line")
+    ap.add_argument("--hot-ms", type=int, default=1000,
+                    help="freed within this many ms counts as transient")
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--split-at", default="boot-complete",
+                    help="marker splitting immortal from long-lived")
+    ap.add_argument("--folded", metavar="PREFIX",
+                    help="write whole-stack folded files per lifetime class, "
+                         "weighted by bytes and by count")
+    ap.add_argument("--timeline", metavar="PATH",
+                    help="write live bytes over time, split by marker "
+                         "(.json for JSON, otherwise CSV)")
+    ap.add_argument("--timeline-ms", type=int, default=100,
+                    help="bucket width for --timeline; 0 keeps every event")
+    return report(ap.parse_args())
+
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""Read an ELF image in process: sections, symbols, build-id, raw bytes.
+
+The size and allocation tools used to run objdump/nm and regex their text,
+which costs a process and a parse of the whole symbol table per question.
+Everything they asked is a table lookup in the file itself. ELF32 and ELF64,
+either byte order; the file is mapped, not read, so a 16 MB debug ELF costs
+only the pages actually touched.
+
+    import elffile
+    img = elffile.load("openwatt.elf")      # cached per path and mtime
+    img.section(".data"), img.data(".data"), img.symbols(), img.build_id()
+
+No DWARF: line numbers still come from addr2line, and disassembly from
+objdump.
+"""
+
+import collections
+import mmap
+import os
+import struct
+
+Section = collections.namedtuple(
+    "Section", "index name type flags addr offset size link info entsize")
+# section is the name of the section the symbol is defined in, or None for
+# undefined, absolute and common symbols.
+Symbol = collections.namedtuple("Symbol", "name value size type bind section")
+
+SHT_SYMTAB = 2
+SHT_NOTE = 7
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+
+STT_OBJECT = 1
+STT_FUNC = 2
+STT_TLS = 6
+
+PT_TLS = 7
+
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xFF00
+SHN_XINDEX = 0xFFFF
+
+NT_GNU_BUILD_ID = 3
+
+
+class ElfFile:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        m = self._map
+        if m[:4] != b"\x7fELF":
+            raise ValueError(f"{path}: not an ELF file")
+        if m[4] not in (1, 2) or m[5] not in (1, 2):
+            raise ValueError(f"{path}: unknown ELF class/data {m[4]}/{m[5]}")
+        self.bits = 64 if m[4] == 2 else 32
+        e = "<" if m[5] == 1 else ">"
+        self._e = e
+
+        if self.bits == 64:
+            (_, self.machine, _, self.entry, phoff, shoff, _, _, phentsize, phnum,
+             shentsize, shnum, shstrndx) = struct.unpack_from(e + "HHIQQQIHHHHHH", m, 16)
+            self._sh = struct.Struct(e + "IIQQQQIIQQ")
+            ph = struct.Struct(e + "IIQQQQQQ")   # type flags offset vaddr paddr filesz memsz align
+            self._sym = struct.Struct(e + "IBBHQQ")
+        else:
+            (_, self.machine, _, self.entry, phoff, shoff, _, _, phentsize, phnum,
+             shentsize, shnum, shstrndx) = struct.unpack_from(e + "HHIIIIIHHHHHH", m, 16)
+            self._sh = struct.Struct(e + "IIIIIIIIII")
+            ph = struct.Struct(e + "IIIIIIII")       # type offset vaddr paddr filesz memsz flags align
+            self._sym = struct.Struct(e + "IIIBBH")
+
+        # (type, vaddr) of each program header; only PT_TLS is wanted so far
+        self.segments = []
+        for i in range(phnum if phoff else 0):
+            f = ph.unpack_from(m, phoff + i * phentsize)
+            self.segments.append((f[0], f[3] if self.bits == 64 else f[2]))
+
+        raw = []
+        if shoff:
+            # More than SHN_LORESERVE sections: the real counts live in
+            # section 0, which is otherwise unused.
+            first = self._sh.unpack_from(m, shoff)
+            if shnum == 0:
+                shnum = first[5]
+            if shstrndx == SHN_XINDEX:
+                shstrndx = first[6]
+            raw = [self._sh.unpack_from(m, shoff + i * shentsize)
+                   for i in range(shnum)]
+
+        names = raw[shstrndx][4] if shstrndx < len(raw) else None
+        self.sections = []
+        for i, (name, typ, flags, addr, off, size, link, info, _, entsize) in enumerate(raw):
+            self.sections.append(Section(
+                i, self._str(names, name) if names is not None else "",
+                typ, flags, addr, off, size, link, info, entsize))
+        self._by_name = {}
+        for s in self.sections:
+            self._by_name.setdefault(s.name, s)
+        self._symbols = None
+
+    def _str(self, offset, index):
+        end = self._map.find(b"\0", offset + index)
+        return self._map[offset + index:end].decode("utf-8", "replace")
+
+    def section(self, name):
+        """The first section called name, or None."""
+        return self._by_name.get(name)
+
+    def data(self, section):
+        """A section's bytes (by name or Section); empty for .bss-like ones."""
+        s = self.section(section) if isinstance(section, str) else section
+        if s is None or s.type == SHT_NOBITS:
+            return b""
+        return self._map[s.offset:s.offset + s.size]
+
+    def read(self, addr, size):
+        """size bytes of the file image at a virtual address, or None.
+
+        This is the initialiser for a .data address: what is in the file,
+        not what the target holds after it has run.
+        """
+        for s in self.sections:
+            if (s.flags & SHF_ALLOC and s.type != SHT_NOBITS
+                    and s.addr <= addr and addr + size <= s.addr + s.size):
+                start = s.offset + addr - s.addr
+                return self._map[start:start + size]
+        return None
+
+    def tls_base(self):
+        """Where an STT_TLS symbol's value counts from, or None.
+
+        A TLS symbol's value is an offset into the TLS template, not an
+        address: from the PT_TLS segment in a linked image, from .tdata
+        (which starts the template) in an object with no segments.
+        """
+        for typ, vaddr in self.segments:
+            if typ == PT_TLS:
+                return vaddr
+        s = self.section(".tdata")
+        return s.addr if s is not None else None
+
+    def section_at(self, addr):
+        """The allocated section containing addr, or None."""
+        for s in self.sections:
+            if s.flags & SHF_ALLOC and s.size and s.addr <= addr < s.addr + s.size:
+                return s
+        return None
+
+    def symbols(self):
+        """Every symbol in .symtab, or .dynsym if the image is stripped."""
+        if self._symbols is not None:
+            return self._symbols
+        tables = [s for s in self.sections if s.type == SHT_SYMTAB] or \
+                 [s for s in self.sections if s.type == SHT_DYNSYM]
+        out = []
+        for tab in tables:
+            strings = self.sections[tab.link].offset
+            step = tab.entsize or self._sym.size
+            for off in range(tab.offset + step, tab.offset + tab.size, step):
+                if self.bits == 64:
+                    name, info, _, shndx, value, size = self._sym.unpack_from(self._map, off)
+                else:
+                    name, value, size, info, _, shndx = self._sym.unpack_from(self._map, off)
+                sec = None
+                if SHN_UNDEF < shndx < SHN_LORESERVE and shndx < len(self.sections):
+                    sec = self.sections[shndx].name
+                out.append(Symbol(self._str(strings, name), value, size,
+                                  info & 0xF, info >> 4, sec))
+        self._symbols = out
+        return out
+
+    def symbol(self, name):
+        """The first defined symbol called name, or None."""
+        for s in self.symbols():
+            if s.name == name and s.section is not None:
+                return s
+        return None
+
+    def build_id(self):
+        """The GNU build-id as hex, or None if the link did not emit one."""
+        e = self._e
+        for s in self.sections:
+            if s.type != SHT_NOTE:
+                continue
+            note = self.data(s)
+            off = 0
+            while off + 12 <= len(note):
+                namesz, descsz, typ = struct.unpack_from(e + "III", note, off)
+                off += 12
+                name = bytes(note[off:off + namesz])
+                off += (namesz + 3) & ~3
+                desc = bytes(note[off:off + descsz])
+                off += (descsz + 3) & ~3
+                if typ == NT_GNU_BUILD_ID and name == b"GNU\0":
+                    return desc.hex()
+        return None
+
+
+_cache = {}
+
+
+def load(path):
+    """Open path, sharing one ElfFile per file until it is rebuilt."""
+    st = os.stat(path)
+    key = (os.path.realpath(path), st.st_mtime_ns, st.st_size)
+    img = _cache.get(key)
+    if img is None:
+        img = _cache[key] = ElfFile(path)
+    return img
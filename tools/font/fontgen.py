@@ -5,6 +5,20 @@
 #   python fontgen.py preview font_small.txt "HELLO 32.5A"
 #   python fontgen.py check   font_small.txt
 #   python fontgen.py d       font_small.txt > ../../src/driver/font/small.d
+#   python fontgen.py cost    font_small.txt ui_strings.txt ../../src/driver/boards/smartevse/display.d
+#   python fontgen.py cache   font_small.txt 256 ui_strings.txt > ../../src/driver/font/small_cache.d
+#
+# cost replays render.d's draw_text over the strings the UI draws -- literals
+# passed to display_text/draw_text in .d files, or a list with redraw weights --
+# and counts index probes, bitmap reads and page-buffer writes. cache picks the
+# strings that save the most per byte within a budget and emits their page
+# images as a D table.
+#
+# Several fonts given to d or check share one bitmap, so columns two fonts draw
+# the same way are stored once: "d font_small.txt font_large.txt" writes module
+# driver.font.small_large. Offsets are bytes until the bitmap outgrows them, and
+# ushorts after.
+import os
 import re
 import sys
 
@@ -136,64 +150,152 @@ def render(height, table, text, gap=1):
     return "\n".join(canvas)
 
 
-def layout(height, glyphs):
-    enc = {}
-    for cp, _, rows in glyphs:
-        data, is_raw = encode(pack(height, rows))
-        enc[cp] = (data, len(rows[0]), is_raw)
-
-    # Shortest-common-superstring, greedy: drop anything already contained in a
-    # longer glyph, then repeatedly merge the pair sharing the most bytes. Beats
-    # feeding the glyphs in some order and appending, by a wide margin.
-    def overlap(a, b):
-        for n in range(min(len(a), len(b)) - 1, 0, -1):
-            if a.endswith(b[:n]):
-                return n
-        return 0
-
-    parts = []
-    for k in sorted({e[0] for e in enc.values()}, key=lambda k: (-len(k), k)):
-        if not any(k in p for p in parts):
-            parts.append(k)
-
-    while len(parts) > 1:
-        best_n, best_i, best_j = 0, 0, 1
+def superstring(seqs):
+    """One byte string holding every sequence in seqs, as short as greedy gets it.
+
+    Shortest-common-superstring, greedy: drop anything already contained in a
+    longer sequence, then repeatedly join the pair sharing the most bytes. Beats
+    feeding the glyphs in some order and appending, by a wide margin.
+
+    Joining a after b leaves the join's overlaps with everything else equal to
+    a's at the front and b's at the back, so every pair is looked at once:
+    candidate joins come out of a prefix index, longest overlap first, and a
+    join is taken if a still has no successor, b no predecessor, and the two
+    are not already ends of the same chain.
+    """
+    parts, inside = [], set()
+    for k in sorted(set(seqs), key=lambda k: (-len(k), k)):
+        if k in inside:
+            continue
+        parts.append(k)
+        inside.update(k[i:j] for i in range(len(k)) for j in range(i + 1, len(k) + 1))
+
+    n = len(parts)
+    succ, pred, overlap = [None] * n, [None] * n, [0] * n
+    chain = list(range(n))
+
+    def find(i):
+        while chain[i] != i:
+            chain[i] = chain[chain[i]]
+            i = chain[i]
+        return i
+
+    for k in range(max(map(len, parts), default=1) - 1, 0, -1):
+        starts = {}
+        for j, b in enumerate(parts):
+            if len(b) > k and pred[j] is None:
+                starts.setdefault(b[:k], []).append(j)
+        if not starts:
+            continue
         for i, a in enumerate(parts):
-            for j, b in enumerate(parts):
-                if i != j:
-                    n = overlap(a, b)
-                    if n > best_n:
-                        best_n, best_i, best_j = n, i, j
-        if best_n == 0:
-            break
-        merged = parts[best_i] + parts[best_j][best_n:]
-        parts = [p for k, p in enumerate(parts) if k not in (best_i, best_j)] + [merged]
-
-    blob = b"".join(parts)
-    slot = {}
-    for cp, (data, width, is_raw) in enc.items():
-        assert data in blob, "packed blob lost a glyph"
-        slot[cp] = (blob.index(data), width, is_raw)
-    for cp, target in ALIAS.items():
-        if target in slot:
-            slot[cp] = slot[target]
-
-    # a coding scheme is only worth having if it survives a decode
-    for cp, _, rows in glyphs:
-        o, w, r = slot[cp]
-        assert decode(blob, o, w, r) == pack(height, rows), f"U+{cp:04X} does not decode"
-    return list(blob), slot
-
-
-def emit_d(height, glyphs, out=sys.stdout):
-    blob, slot = layout(height, glyphs)
+            if len(a) <= k or succ[i] is not None:
+                continue
+            for j in starts.get(a[-k:], ()):
+                if pred[j] is None and find(i) != find(j):
+                    succ[i], pred[j], overlap[i] = j, i, k
+                    chain[find(j)] = find(i)
+                    break
+
+    blob = bytearray()
+    for i in range(n):
+        if pred[i] is not None:
+            continue
+        blob += parts[i]
+        while succ[i] is not None:
+            blob += parts[succ[i]][overlap[i]:]
+            i = succ[i]
+    return bytes(blob)
+
+
+def layout_fonts(fonts):
+    """One bitmap for several fonts: fonts is [(height, glyphs)], and the result
+    (blob, [slot per font]) with slot mapping codepoint -> (offset, width, raw)."""
+    encs = []
+    for height, glyphs in fonts:
+        enc = {}
+        for cp, _, rows in glyphs:
+            data, is_raw = encode(pack(height, rows))
+            enc[cp] = (data, len(rows[0]), is_raw)
+        encs.append(enc)
+
+    blob = superstring([e[0] for enc in encs for e in enc.values()])
+    slots = []
+    for (height, glyphs), enc in zip(fonts, encs):
+        slot = {}
+        for cp, (data, width, is_raw) in enc.items():
+            assert data in blob, "packed blob lost a glyph"
+            slot[cp] = (blob.index(data), width, is_raw)
+        for cp, target in ALIAS.items():
+            if target in slot:
+                slot[cp] = slot[target]
+
+        # a coding scheme is only worth having if it survives a decode
+        for cp, _, rows in glyphs:
+            o, w, r = slot[cp]
+            assert decode(blob, o, w, r) == pack(height, rows), f"U+{cp:04X} does not decode"
+        slots.append(slot)
+    return list(blob), slots
+
+
+def layout(height, glyphs):
+    blob, (slot,) = layout_fonts([(height, glyphs)])
+    return blob, slot
+
+
+def font_name(path):
+    """font_small for font_small.txt: the prefix on everything it generates."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def emit_d(fonts, out=sys.stdout):
+    """D source for [(path, height, glyphs)], every font sharing one bitmap."""
+    blob, slots = layout_fonts([(h, g) for _, h, g in fonts])
+    names = [font_name(path) for path, _, _ in fonts]
+    shared = len(fonts) > 1
+    bitmap = "font_bitmap" if shared else f"{names[0]}_bitmap"
+    module = "_".join(n[5:] if n.startswith("font_") else n for n in names)
+
+    p = lambda *a: print(*a, file=out)
+    p(f"// Generated by tools/font/fontgen.py from "
+      f"{', '.join('tools/font/' + os.path.basename(path) for path, _, _ in fonts)}.")
+    p("// Edit the .txt and regenerate; do not edit this file.")
+    p(f"module driver.font.{module};")
+    p("")
+    p("nothrow @nogc:")
+    p("")
+
+    def emit_bitmap():
+        p("// One byte per column, LSB = top row, run-length coded: a byte with bit 7 set")
+        p("// stands for two columns of its low seven bits. Glyphs whose columns already")
+        p("// appear elsewhere point into them, so offsets are neither ordered nor disjoint.")
+        if shared:
+            p(f"// Shared by {', '.join(names)}; a glyph drawn the same way in two")
+            p("// fonts is stored once.")
+        p(f"immutable ubyte[{len(blob)}] {bitmap} = [")
+        for i in range(0, len(blob), 16):
+            p("    " + " ".join(f"0x{b:02X}," for b in blob[i:i + 16]))
+        p("];")
+        p("")
+
+    if shared:
+        emit_bitmap()
+    for name, (_, height, glyphs), slot in zip(names, fonts, slots):
+        emit_font(name, height, slot, bitmap, emit_bitmap if not shared else None, p)
+        if shared and name != names[-1]:
+            p("")
+
+
+def emit_font(name, height, slot, bitmap, emit_bitmap, p):
     count = LAST - FIRST + 1
     empty = (0, 0, False)
     offsets = [slot.get(c, empty)[0] for c in range(FIRST, LAST + 1)]
     widths = [slot.get(c, empty)[1] for c in range(FIRST, LAST + 1)]
     raws = [slot.get(c, empty)[2] for c in range(FIRST, LAST + 1)]
-    if max(offsets) > 0xFF:
-        raise SystemExit(f"offset {max(offsets)} does not fit in a byte; bitmap is {len(blob)} bytes")
+    # offsets take a byte each while the bitmap is small enough, else a ushort
+    wide = max(offsets) > 0xFF
+    if max(offsets) > 0xFFFF:
+        raise SystemExit(f"offset {max(offsets)} does not fit in 16 bits")
+    offset_type, cell = ("ushort", 5) if wide else ("ubyte", 3)
 
     nybbles = [w | (RAW_FLAG if r else 0) for w, r in zip(widths, raws)]
     padded = nybbles + [0] * (count & 1)
@@ -201,45 +303,32 @@ def emit_d(height, glyphs, out=sys.stdout):
     extras = sorted(EXTRAS)
     extra_base = min(EXTRAS) - FIRST
 
-    p = lambda *a: print(*a, file=out)
-    p("// Generated by tools/font/fontgen.py from tools/font/font_small.txt.")
-    p("// Edit the .txt and regenerate; do not edit this file.")
-    p("module driver.font.small;")
-    p("")
-    p("nothrow @nogc:")
+    p(f"enum {name}_height = {height};")
+    p(f"enum {name}_first = 0x{FIRST:02X};")
+    p(f"enum {name}_max_width = {max(widths)};")
+    p(f"enum {name}_gap = 1;   // blank columns a renderer must insert between glyphs")
     p("")
-    p(f"enum font_small_height = {height};")
-    p(f"enum font_small_first = 0x{FIRST:02X};")
-    p(f"enum font_small_max_width = {max(widths)};")
-    p("enum font_small_gap = 1;   // blank columns a renderer must insert between glyphs")
-    p("")
-    p("// The symbols with no ASCII slot. font_small_extra maps each to the character")
+    p(f"// The symbols with no ASCII slot. {name}_extra maps each to the character")
     p("// a caller would actually write, so lookup takes a wchar rather than a code.")
     p("enum : char")
     p("{")
     for cp in extras:
-        p(f"    font_small_{EXTRAS[cp][0]} = 0x{cp:02X},")
+        p(f"    {name}_{EXTRAS[cp][0]} = 0x{cp:02X},")
     p("}")
     p("")
     # a non-printing character has to go in as an escape or the source is unreadable
     lit = lambda ch: f"'{ch}'" if ch.isprintable() else "'\\u%04X'" % ord(ch)
-    p("immutable wchar[%d] font_small_extra = [ %s ];"
-      % (len(extras), ", ".join(lit(EXTRAS[cp][1]) for cp in extras)))
-    p("")
-    p("// One byte per column, LSB = top row, run-length coded: a byte with bit 7 set")
-    p("// stands for two columns of its low seven bits. Glyphs whose columns already")
-    p("// appear elsewhere point into them, so offsets are neither ordered nor disjoint.")
-    p(f"immutable ubyte[{len(blob)}] font_small_bitmap = [")
-    for i in range(0, len(blob), 16):
-        p("    " + " ".join(f"0x{b:02X}," for b in blob[i:i + 16]))
-    p("];")
+    p("immutable wchar[%d] %s_extra = [ %s ];"
+      % (len(extras), name, ", ".join(lit(EXTRAS[cp][1]) for cp in extras)))
     p("")
-    # font_small_glyph no longer guards against a zero width, because a hole in the
+    if emit_bitmap:
+        emit_bitmap()
+    # The generated _glyph no longer guards against a zero width, because a hole in the
     # table would run its decode loop off the end of the buffer. Enforce it here.
     for c, w in zip(range(FIRST, LAST + 1), widths):
         if w == 0:
-            raise SystemExit(f"U+{c:04X} has no glyph; a hole in the table would overrun the "
-                             "decode buffer, so every slot must be filled or the range trimmed")
+            raise SystemExit(f"{name}: U+{c:04X} has no glyph; a hole in the table would overrun "
+                             "the decode buffer, so every slot must be filled or the range trimmed")
 
     rows = []
     i = 0
@@ -250,10 +339,10 @@ def emit_d(height, glyphs, out=sys.stdout):
         rows.append((i, n))
         i += n
 
-    p("// Indexed by c - font_small_first.")
-    p(f"immutable ubyte[{count}] font_small_offset = [")
+    p(f"// Indexed by c - {name}_first.")
+    p(f"immutable {offset_type}[{count}] {name}_offset = [")
     for i, n in rows:
-        row = " ".join(f"{offsets[j]:3d}," for j in range(i, i + n)).ljust(8 * 5 - 1)
+        row = " ".join(f"{offsets[j]:{cell}d}," for j in range(i, i + n)).ljust(8 * (cell + 2) - 1)
         chars = "".join(EXTRAS[c][2] if c in EXTRAS else chr(c)
                         for c in range(FIRST + i, FIRST + i + n))
         p(f"    {row}   // {chars}")
@@ -262,17 +351,17 @@ def emit_d(height, glyphs, out=sys.stdout):
     p("// Two glyphs per byte: low nybble is the even index, high nybble the odd one.")
     p("// Within a nybble, bits 0-2 are the width and bit 3 means the glyph is stored")
     p("// raw because its pixels need bit 7. A width of zero means there is no glyph.")
-    p(f"immutable ubyte[{len(packed)}] font_small_width = [")
+    p(f"immutable ubyte[{len(packed)}] {name}_width = [")
     for i in range(0, len(packed), 12):
         p("    " + " ".join(f"0x{b:02X}," for b in packed[i:i + 12]))
     p("];")
     p("")
     p("// Table index for a character, or -1 if the font has no glyph for it.")
-    p("int font_small_index(wchar c) pure")
+    p(f"int {name}_index(wchar c) pure")
     p("{")
-    p("    if (c >= font_small_first && c < 0x7F)")
-    p("        return c - font_small_first;")
-    p("    foreach (i, extra; font_small_extra)")
+    p(f"    if (c >= {name}_first && c < 0x7F)")
+    p(f"        return c - {name}_first;")
+    p(f"    foreach (i, extra; {name}_extra)")
     p("    {")
     p("        if (extra == c)")
     p(f"            return cast(int)i + {min(EXTRAS) - FIRST};")
@@ -280,35 +369,35 @@ def emit_d(height, glyphs, out=sys.stdout):
     p("    return -1;")
     p("}")
     p("")
-    p("uint font_small_width_of(wchar c) pure")
+    p(f"uint {name}_width_of(wchar c) pure")
     p("{")
-    p("    immutable int i = font_small_index(c);")
+    p(f"    immutable int i = {name}_index(c);")
     p("    if (i < 0)")
     p("        return 0;")
-    p("    return (font_small_width[i >> 1] >> ((i & 1) * 4)) & 0x7;")
+    p(f"    return ({name}_width[i >> 1] >> ((i & 1) * 4)) & 0x7;")
     p("}")
     p("")
-    p("// Expands one glyph into buffer, which must hold font_small_max_width bytes.")
+    p(f"// Expands one glyph into buffer, which must hold {name}_max_width bytes.")
     p("// Returns the columns written, or zero if the font has no glyph for c.")
-    p("uint font_small_glyph(wchar c, ubyte[] buffer)")
+    p(f"uint {name}_glyph(wchar c, ubyte[] buffer)")
     p("{")
-    p("    immutable int i = font_small_index(c);")
+    p(f"    immutable int i = {name}_index(c);")
     p("    if (i < 0)")
     p("        return 0;")
     p("")
-    p("    immutable uint nybble = (font_small_width[i >> 1] >> ((i & 1) * 4)) & 0xF;")
+    p(f"    immutable uint nybble = ({name}_width[i >> 1] >> ((i & 1) * 4)) & 0xF;")
     p("    immutable uint width = nybble & 0x7;")
     p("    if (buffer.length < width)")
     p("        return 0;")
     p("")
-    p("    uint o = font_small_offset[i];")
+    p(f"    uint o = {name}_offset[i];")
     p("    if (nybble & 0x8)")
     p("    {")
-    p("        buffer[0 .. width] = font_small_bitmap[o .. o + width];")
+    p(f"        buffer[0 .. width] = {bitmap}[o .. o + width];")
     p("        return width;")
     p("    }")
     p("")
-    p("    ubyte bits = font_small_bitmap[o];")
+    p(f"    ubyte bits = {bitmap}[o];")
     p("    for (uint n = 0;;)")
     p("    {")
     p("        buffer[n] = bits & 0x7F;")
@@ -317,28 +406,210 @@ def emit_d(height, glyphs, out=sys.stdout):
     p("        if (bits & 0x80)")
     p("            bits &= 0x7F;")
     p("        else")
-    p("            bits = font_small_bitmap[++o];")
+    p(f"            bits = {bitmap}[++o];")
     p("    }")
     p("}")
 
 
-if __name__ == "__main__":
-    mode, path = sys.argv[1], sys.argv[2]
-    height, glyphs = parse(path)
-    if mode == "preview":
-        print(render(height, {cp: rows for cp, _, rows in glyphs}, sys.argv[3]))
-    elif mode == "d":
-        sys.stdout.reconfigure(encoding="utf-8", newline="\n")
-        emit_d(height, glyphs)
-    elif mode == "check":
-        blob, slot = layout(height, glyphs)
+# --- what drawing a string costs the firmware ------------------------------------
+
+DRAW_CALL = re.compile(r"\b(?:display_text|draw_text)\s*\([^;]*?\"((?:[^\"\\]|\\.)*)\"")
+
+
+def ui_strings(paths):
+    """{string: weight} from the given sources. A .d file contributes the literal
+    of every display_text/draw_text call in it, once each; any other file is one
+    string per line, optionally "<redraws per minute><TAB>" first."""
+    found = {}
+    for path in paths:
+        text = open(path, encoding="utf-8").read()
+        if path.endswith(".d"):
+            for m in DRAW_CALL.finditer(text):
+                lit = re.sub(r"\\(.)", r"\1", m.group(1))
+                found[lit] = found.get(lit, 0) + 1
+            continue
+        for line in text.splitlines():
+            if not line or line.startswith("#"):
+                continue
+            weight, tab, rest = line.partition("\t")
+            if tab and weight.strip().isdigit():
+                found[rest] = found.get(rest, 0) + int(weight)
+            else:
+                found[line] = found.get(line, 0) + 1
+    return found
+
+
+def glyph_index(c):
+    """(table index or -1, comparisons) the way the generated _index finds it."""
+    if FIRST <= c < 0x7F:
+        return c - FIRST, 1
+    for n, cp in enumerate(sorted(EXTRAS)):
+        if EXTRAS[cp][1] == chr(c):
+            return cp - FIRST, n + 2
+    return -1, len(EXTRAS) + 1
+
+
+def draw_cost(blob, slot, text, y=0):
+    """What render.d's draw_text does for text at row y, in the units that cost
+    on the MCU: index comparisons, bitmap bytes read, page-buffer bytes written.
+    One pass sizes the line and a second draws it, so every glyph is looked up
+    three times; off a page boundary each column is two read-modify-writes."""
+    probes = reads = writes = 0
+    per_column = 1 if y % 8 == 0 else 2
+    for ch in text:
+        i, n = glyph_index(ord(ch))
+        probes += 2 * n                         # width_of when sizing, and again drawing
+        if i < 0:
+            continue
+        offset, width, is_raw = slot.get(i + FIRST, (0, 0, False))
+        if not width:
+            continue
+        probes += n                             # and once more inside _glyph
+        reads += 1                              # width nybble
+        if is_raw:
+            reads += width
+        else:
+            o, bits = offset, blob[offset]
+            reads += 1
+            for _ in range(width - 1):
+                if bits & 0x80:
+                    bits &= 0x7F
+                else:
+                    o += 1
+                    bits = blob[o]
+                    reads += 1
+        writes += (width + 1) * per_column      # the glyph and the gap after it
+    if writes:
+        writes -= per_column                    # no gap after the last glyph
+    return probes, reads, writes
+
+
+def image(height, slot, blob, text):
+    """The columns draw_text writes for text on a page-aligned row."""
+    out = []
+    for ch in text:
+        i, _ = glyph_index(ord(ch))
+        if i < 0 or not slot.get(i + FIRST, (0, 0, False))[1]:
+            continue
+        if out:
+            out.append(0)
+        out += decode(blob, *slot[i + FIRST])
+    return out
+
+
+def cost_report(font, sources, y=0):
+    height, glyphs = parse(font)
+    blob, slot = layout(height, glyphs)
+    strings = ui_strings(sources)
+    if not strings:
+        raise SystemExit("no strings found in " + ", ".join(sources))
+    rows = []
+    for text, weight in strings.items():
+        probes, reads, writes = draw_cost(blob, slot, text, y)
+        rows.append((weight * (probes + reads + writes), weight, probes, reads, writes, text))
+    rows.sort(key=lambda r: (-r[0], r[5]))
+    total = sum(r[0] for r in rows)
+    print(f"{len(rows)} strings at y={y}; cost = (probes + bitmap reads + buffer writes) x weight")
+    print(f"{'cost':>8} {'share':>6} {'weight':>6} {'probes':>6} {'reads':>6} {'writes':>6}  string")
+    for c, weight, probes, reads, writes, text in rows:
+        print(f"{c:8} {100 * c / total:5.1f}% {weight:6} {probes:6} {reads:6} {writes:6}  {text!r}")
+    return rows
+
+
+def emit_cache(font, budget, sources, out=sys.stdout):
+    """D table of pre-rendered columns for the costliest strings that fit budget
+    bytes, columns plus text plus index, chosen by cost saved per byte."""
+    height, glyphs = parse(font)
+    blob, slot = layout(height, glyphs)
+    name = font_name(font)
+    picks, spent = [], 2                        # the index's closing entry
+    candidates = []
+    for text, weight in ui_strings(sources).items():
+        cols = image(height, slot, blob, text)
+        if not cols:
+            continue
+        probes, reads, writes = draw_cost(blob, slot, text)
+        # a cache hit is a string compare and a copy of the columns
+        saved = weight * (probes + reads + writes - len(text.encode()) - len(cols))
+        size = len(cols) + len(text.encode()) + 2
+        if saved > 0:
+            candidates.append((saved / size, saved, text, cols, size))
+    for _, saved, text, cols, size in sorted(candidates, key=lambda c: (-c[0], c[2])):
+        if spent + size <= budget:
+            picks.append((text, cols))
+            spent += size
+    if not picks:
+        raise SystemExit(f"nothing fits in {budget} bytes")
+    picks.sort(key=lambda p: p[0])
+
+    columns = [b for _, cols in picks for b in cols]
+    starts = [0]
+    for _, cols in picks:
+        starts.append(starts[-1] + len(cols))
+    if starts[-1] > 0xFFFF:
+        raise SystemExit("cached columns do not fit 16-bit offsets; lower the budget")
+    lit = lambda t: '"' + "".join(ch if ch.isprintable() and ch not in '"\\' else
+                                  "\\u%04X" % ord(ch) for ch in t) + '"'
+
+    p = lambda *a: print(*a, file=out)
+    p(f"// Generated by tools/font/fontgen.py from tools/font/{os.path.basename(font)} and")
+    p(f"// {', '.join(sources)}; {spent} of a {budget} byte budget.")
+    p("// Edit the inputs and regenerate; do not edit this file.")
+    p(f"module driver.font.{name[5:] if name.startswith('font_') else name}_cache;")
+    p("")
+    p("nothrow @nogc:")
+    p("")
+    p("// Strings the display redraws often enough to store pre-rendered: each is the")
+    p("// columns draw_text would write at a page-aligned y, gap columns included, so")
+    p("// a hit is a copy into the page buffer with no lookup and no decode.")
+    p(f"immutable string[{len(picks)}] {name}_cache_text = [")
+    for text, _ in picks:
+        p(f"    {lit(text)},")
+    p("];")
+    p("")
+    p(f"// {name}_cache_columns[start[i] .. start[i + 1]] is {name}_cache_text[i].")
+    p(f"immutable ushort[{len(starts)}] {name}_cache_start = [")
+    for i in range(0, len(starts), 12):
+        p("    " + " ".join(f"{v}," for v in starts[i:i + 12]))
+    p("];")
+    p("")
+    p(f"immutable ubyte[{len(columns)}] {name}_cache_columns = [")
+    for i in range(0, len(columns), 16):
+        p("    " + " ".join(f"0x{b:02X}," for b in columns[i:i + 16]))
+    p("];")
+    p("")
+    p("// The pre-rendered columns for text, or null if it is not cached.")
+    p(f"const(ubyte)[] {name}_cached(const(char)[] text) pure")
+    p("{")
+    p(f"    foreach (i, s; {name}_cache_text)")
+    p("    {")
+    p("        if (s == text)")
+    p(f"            return {name}_cache_columns[{name}_cache_start[i] .. {name}_cache_start[i + 1]];")
+    p("    }")
+    p("    return null;")
+    p("}")
+
+
+def check(paths):
+    fonts = [(path,) + parse(path) for path in paths]
+    blob, slots = layout_fonts([(h, g) for _, h, g in fonts])
+    top = max(o for slot in slots for o, _, _ in slot.values())
+    width = "16-bit" if top > 0xFF else "8-bit"
+    if len(fonts) > 1:
+        alone = sum(len(layout(h, g)[0]) for _, h, g in fonts)
+        print(f"shared bitmap {len(blob)} bytes for {len(fonts)} fonts "
+              f"({alone} laid out one by one), max offset {top}, {width} offsets")
+    for (path, height, glyphs), slot in zip(fonts, slots):
         offsets = [slot[cp][0] for cp, _, _ in glyphs]
         raw = sum(len(pack(height, r)) for _, _, r in glyphs)
         coded = sum(len(encode(pack(height, r))[0]) for _, _, r in glyphs)
         print(f"{path}: {len(glyphs)} glyphs, height {height}")
-        print(f"  bitmap      {len(blob)} bytes, max offset {max(offsets)} / 255")
-        print(f"  tables      {LAST - FIRST + 1} offset + {(LAST - FIRST + 2) // 2} width bytes")
-        print(f"  columns     {raw} raw -> {coded} run-length coded -> {len(blob)} packed")
+        if len(fonts) == 1:
+            print(f"  bitmap      {len(blob)} bytes, max offset {max(offsets)} ({width} offsets)")
+            print(f"  tables      {LAST - FIRST + 1} offset + {(LAST - FIRST + 2) // 2} width bytes")
+            print(f"  columns     {raw} raw -> {coded} run-length coded -> {len(blob)} packed")
+        else:
+            print(f"  columns     {raw} raw -> {coded} run-length coded")
         print(f"  stored raw  {', '.join(n for cp, n, _ in glyphs if slot[cp][2]) or 'none'}")
         seq = {n: encode(pack(height, r))[0] for _, n, r in glyphs}
         for name, k in sorted(seq.items()):
@@ -348,5 +619,22 @@ if __name__ == "__main__":
         show = lambda c: f"'{chr(c)}'" if 0x21 <= c <= 0x7E else f"0x{c:02X}"
         absent = [c for c in range(FIRST, LAST + 1) if c not in slot]
         print(f"  absent      {' '.join(show(c) for c in absent) or 'none'}")
+
+
+if __name__ == "__main__":
+    mode, paths = sys.argv[1], sys.argv[2:]
+    if mode == "preview":
+        height, glyphs = parse(paths[0])
+        print(render(height, {cp: rows for cp, _, rows in glyphs}, paths[1]))
+    elif mode == "d":
+        sys.stdout.reconfigure(encoding="utf-8", newline="\n")
+        emit_d([(path,) + parse(path) for path in paths])
+    elif mode == "check":
+        check(paths)
+    elif mode == "cost":
+        cost_report(paths[0], paths[1:])
+    elif mode == "cache":
+        sys.stdout.reconfigure(encoding="utf-8", newline="\n")
+        emit_cache(paths[0], int(paths[1]), paths[2:])
     else:
-        raise SystemExit("mode must be preview|d|check")
+        raise SystemExit("mode must be preview|d|check|cost|cache")
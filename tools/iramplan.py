@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""Recommend the flash functions worth making resident, for a given IRAM budget.
+
+Code in flash runs through the instruction cache; on the ESP32 a miss on the
+Modbus or routing hot path costs a flash read per line, which is real
+throughput. IRAM is scarce, so what goes there should be what runs most per
+byte. This combines a measured profile with the static call graph and the
+function sizes in the ELF and picks, greedily by samples per byte, the
+functions to mark @critical until the budget is spent.
+
+Samples come from either or both of:
+
+    --pc LOG      a PC-sample stream, one "pc <hex-addr> [count]" per sample
+                  (from a sampling timer, or a debugger script halting the
+                  core periodically); each sample counts for the function
+                  it lands in
+    --alloc LOG   an allocprof stream (tools/allocprof.py); every captured
+                  frame counts for its function, so this favours the paths
+                  that allocate, which is a proxy, not a profile
+
+A function whose name makes it an interrupt root (check_isr_safety.py's
+ROOT_PATTERNS) is only worth moving together with everything it calls from
+flash, so it is costed as the whole closure. The proposed set is then put
+through the residency check as if it had been moved.
+
+    iramplan.py <elf> --objdump TOOL (--pc LOG | --alloc LOG)...
+                --budget BYTES [--top N] [--out PATH]
+"""
+
+import argparse
+import bisect
+import collections
+import os
+import re
+import sys
+
+import elffile
+from allocprof import find_slide, parse, parse_size
+from ramreport import d_demangle
+from sizemap import region
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test"))
+from check_isr_safety import ROOT_PATTERNS, callgraph, classify, resident, sections
+
+PC_RE = re.compile(r"\bpc ([0-9a-f]+)(?: (\d+))?\s*$", re.IGNORECASE)
+
+
+class Functions:
+    """Address -> function, over the ELF's sized function symbols."""
+
+    def __init__(self, img):
+        spans = {}
+        for s in img.symbols():
+            if s.section is not None and s.type == elffile.STT_FUNC and s.size:
+                spans.setdefault(s.value, (s.value + s.size, s.name, s.section))
+        self.starts = sorted(spans)
+        self.spans = [spans[a] for a in self.starts]
+        self.size = {name: end - start for start, (end, name, _) in zip(self.starts, self.spans)}
+        self.section = {name: sec for end, name, sec in self.spans}
+
+    def at(self, addr):
+        i = bisect.bisect_right(self.starts, addr) - 1
+        if i >= 0 and addr < self.spans[i][0]:
+            return self.spans[i][1]
+        return None
+
+
+def pc_samples(path, funcs, hits):
+    with open(path, "r", errors="replace") as f:
+        for line in f:
+            m = PC_RE.search(line)
+            if m:
+                name = funcs.at(int(m.group(1), 16))
+                if name:
+                    hits[name] += int(m.group(2) or 1)
+
+
+def alloc_samples(path, elf, funcs, hits):
+    slide = find_slide(path, elf)
+    for kind, _, f in parse(path):
+        if kind != "A":
+            continue
+        # one hit per function per event, however deep it recursed
+        for name in {funcs.at(int(a, 16) - slide) for a in f[2:]}:
+            if name:
+                hits[name] += 1
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("elf")
+    ap.add_argument("--objdump", required=True)
+    ap.add_argument("--pc", action="append", default=[], metavar="LOG",
+                    help="PC-sample log; repeatable")
+    ap.add_argument("--alloc", action="append", default=[], metavar="LOG",
+                    help="allocprof event stream; repeatable")
+    ap.add_argument("--budget", type=parse_size, required=True,
+                    help="IRAM bytes to spend (k/M suffixes accepted)")
+    ap.add_argument("--top", type=int, default=40)
+    ap.add_argument("--out", metavar="PATH",
+                    help="write the recommended symbols, one per line")
+    args = ap.parse_args()
+    if not args.pc and not args.alloc:
+        ap.error("give at least one --pc or --alloc log")
+
+    img = elffile.load(args.elf)
+    funcs = Functions(img)
+    hits = collections.Counter()
+    for path in args.pc:
+        pc_samples(path, funcs, hits)
+    for path in args.alloc:
+        alloc_samples(path, args.elf, funcs, hits)
+    total = sum(hits.values())
+    if not total:
+        print("no samples landed in a known function; wrong ELF?", file=sys.stderr)
+        return 1
+
+    secs = sections(args.elf)
+    kinds = {s.name: region(s) for s in img.sections if s.size and s.flags & elffile.SHF_ALLOC}
+    code = [name for name, kind in kinds.items() if kind in ("code", "iram")]
+    graph = callgraph(args.objdump, args.elf, code)
+
+    def in_flash(name, addr=None):
+        sec = funcs.section.get(name) if addr is None else classify(addr, secs)
+        return sec is not None and not resident(sec)
+
+    def is_root(name):
+        return any(p.match(name) for p in ROOT_PATTERNS)
+
+    chosen = set()
+
+    def closure(name):
+        """name and the flash code it reaches, less what is already chosen."""
+        seen, queue = {name}, [name]
+        while queue:
+            for callee, addr in graph.get(queue.pop(), ()):
+                if callee not in seen and callee not in chosen and in_flash(callee, addr):
+                    seen.add(callee)
+                    queue.append(callee)
+        return seen
+
+    def cost(name):
+        group = closure(name) if is_root(name) else {name}
+        return group, sum(funcs.size.get(f, 0) for f in group)
+
+    candidates = [f for f in hits if in_flash(f) and funcs.size.get(f)]
+    candidates.sort(key=lambda f: (-hits[f] / cost(f)[1], -hits[f], f))
+
+    picks, spent = [], 0
+    for f in candidates:
+        if f in chosen:
+            continue
+        group, size = cost(f)
+        if spent + size > args.budget:
+            continue
+        chosen |= group
+        spent += size
+        picks.append((f, size, len(group) - 1))
+
+    flash_hits = sum(n for f, n in hits.items() if in_flash(f))
+    moved_hits = sum(hits[f] for f in chosen)
+    print(f"samples: {total}   in flash code: {flash_hits} ({100 * flash_hits / total:.1f}%)"
+          f"   candidates: {len(candidates)}")
+    print(f"budget {args.budget} bytes: spent {spent} on {len(chosen)} function(s), "
+          f"covering {moved_hits} samples "
+          f"({100 * moved_hits / flash_hits if flash_hits else 0:.1f}% of flash)")
+
+    print(f"\n{'samples':>8} {'share':>6} {'bytes':>7} {'total':>7}  function")
+    running = 0
+    for f, size, extra in picks[:args.top]:
+        running += size
+        note = f"  (+{extra} callee(s) it roots)" if extra else ""
+        print(f"{hits[f]:8} {100 * hits[f] / total:5.1f}% {size:7} {running:7}  "
+              f"{d_demangle(f)}{note}")
+    if len(picks) > args.top:
+        print(f"{'':32}... {len(picks) - args.top} more")
+
+    # The residency check, as if the chosen set had been moved.
+    resident_now = {f for f in graph if not in_flash(f)} | chosen
+    roots = {f for f in resident_now if is_root(f)}
+    seen, queue, violations = set(roots), list(roots), []
+    while queue:
+        caller = queue.pop()
+        for callee, addr in graph.get(caller, ()):
+            if callee not in resident_now and in_flash(callee, addr):
+                violations.append((caller, callee))
+            elif callee not in seen:
+                seen.add(callee)
+                queue.append(callee)
+    if violations:
+        print(f"\nresidency check: {len(violations)} call(s) would leave resident memory:")
+        for caller, callee in violations:
+            print(f"  {d_demangle(caller)}\n      -> {d_demangle(callee)}")
+    else:
+        print(f"\nresidency check: OK ({len(roots)} roots, {len(seen)} reachable)")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            for name in sorted(chosen):
+                f.write(name + "\n")
+        print(f"wrote {args.out}")
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""Plan the Modbus reads a device profile costs, and what that does to the bus.
+
+Reads the reg:/mb: elements of profiles (docs/PROFILE_FILE_FORMAT.md), groups
+them by sample frequency the way ModbusBinding schedules them (high every
+second, medium every 10 s, low every minute, realtime as often as the bus
+allows; a frequency the profile loader does not know is medium), and for each
+tier finds the fewest read transactions that cover it:
+
+    - one transaction reads one register kind (coils, discrete inputs, input
+      or holding registers), and no more than fits a ModbusMessageDataMaxLength
+      (252) byte PDU, and no more than the spec allows: 125 registers or
+      2000 coils or discrete inputs; an element wider than that is an error
+    - a gap between elements is read through only when that is cheaper on the
+      wire than a second transaction, and never past --max-gap registers (set
+      0 for devices that reject reads of unmapped registers)
+
+Greedy left to right is optimal for this. Each transaction is then priced in
+RS485 bus time at --baud: request and response frames, the 3.5 character
+silence after each, and the device's --turnaround. A profile whose tiers need
+more than --limit of the bus is flagged, and with --bus all the profiles given
+are taken to share one bus.
+
+    modbusplan.py [PROFILE|DIR ...] [--baud N] [--realtime-hz N]
+                  [--max-gap REGS] [--turnaround MS] [--limit PCT] [--bus]
+                  [--detail]
+
+With no paths, every *.conf under conf/profiles is read.
+"""
+
+import argparse
+import collections
+import glob
+import os
+import re
+import sys
+
+MODBUS_MESSAGE_DATA_MAX_LENGTH = 252    # protocol/modbus/message.d
+# A read response's data is a byte count and then the values.
+MAX_REGS = (MODBUS_MESSAGE_DATA_MAX_LENGTH - 1) // 2
+# Read Coils / Read Discrete Inputs stop at 2000 (0x7D0), short of the PDU.
+MAX_BITS = min(2000, (MODBUS_MESSAGE_DATA_MAX_LENGTH - 1) * 8)
+
+# address + function + start + count + CRC; response adds a byte count
+REQUEST_BYTES = 8
+RESPONSE_OVERHEAD = 5
+SILENCE_CHARS = 3.5
+
+KINDS = ("coil", "discrete", "input", "holding")
+
+# Frequency -> reads per second, from ModbusBinding.add_register_entry.
+# Realtime is sampled every millisecond, i.e. as fast as the bus goes; the
+# rate asked of it is --realtime-hz.
+TIERS = ("realtime", "high", "medium", "low")
+RATES = {"high": 1.0, "medium": 1 / 10, "low": 1 / 60}
+ONCE = ("const", "config")
+NEVER = ("ondemand", "report")
+
+TYPE = re.compile(r"^([a-z]+?)(\d*)(?:le|be)?(?:_\w+)?$")
+# legacy byte types: u8h, i8l -> one byte of a register
+LEGACY_BYTE = re.compile(r"^[uis]8[hl]$")
+
+Element = collections.namedtuple("Element", "id kind reg words freq")
+
+
+def split_fields(text):
+    """Split on commas outside double quotes."""
+    out, cur, quoted = [], "", False
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        if ch == "," and not quoted:
+            out.append(cur.strip())
+            cur = ""
+        else:
+            cur += ch
+    out.append(cur.strip())
+    return out
+
+
+def strip_comment(line):
+    quoted = False
+    for i, ch in enumerate(line):
+        if ch == '"':
+            quoted = not quoted
+        elif ch == "#" and not quoted:
+            return line[:i]
+    return line
+
+
+def kind_of(reg):
+    """(kind, 0-based address) the way ModbusProtocolModule.parse_element reads it."""
+    if reg < 10000:
+        return "coil", reg
+    if reg < 20000:
+        return "discrete", reg - 10000
+    if 30000 <= reg < 40000:
+        return "input", reg - 30000
+    if 40000 <= reg <= 105535:
+        return "holding", reg - 40000
+    return None, None
+
+
+def wire_bytes(spec):
+    """Bytes a type spans on the wire, or None if this tool cannot tell."""
+    spec = spec.split("/")[0].strip().strip('"')
+    count = 1
+    m = re.match(r"^(.*)\[(\d+)\]$", spec)
+    if m:
+        spec, count = m.group(1), int(m.group(2))
+    spec = spec.split(":")[0]
+    if "@" in spec or LEGACY_BYTE.match(spec):
+        return 2                                # a bit slice of one register
+    m = TYPE.match(spec)
+    if not m:
+        return None
+    family, width = m.group(1), int(m.group(2) or 0)
+    if family == "str":
+        return width
+    if family == "dt" and width:
+        return width // 8
+    if family in ("u", "i", "s", "f", "enum", "enumf", "bf") and width:
+        return max(2, width // 8) * count
+    if family == "bool":
+        return 2
+    return None
+
+
+def parse(path):
+    """[Element], [warnings] for the Modbus elements of one profile."""
+    elements, warnings = [], []
+    for lineno, raw in enumerate(open(path, encoding="utf-8", errors="replace"), 1):
+        line = strip_comment(raw).strip()
+        m = re.match(r"^(reg|mb):\s*(.*)$", line)
+        if not m:
+            continue
+        body = m.group(2)
+        head, _, desc = body.partition("desc:")
+        fields = split_fields(head)
+        try:
+            reg = int(fields[0], 0)
+        except ValueError:
+            warnings.append(f"{path}:{lineno}: bad register {fields[0]!r}")
+            continue
+        kind, addr = kind_of(reg)
+        if kind is None:
+            warnings.append(f"{path}:{lineno}: register {reg} is in no Modbus range")
+            continue
+        d = split_fields(desc) if desc else []
+        ident = d[0] if d and d[0] else f"{reg}"
+        freq = (d[2].strip('"').lower() if len(d) > 2 and d[2] else "medium")
+        if freq not in TIERS + ONCE + NEVER:
+            # profile.d warns and keeps its Frequency.medium default
+            warnings.append(f"{path}:{lineno}: invalid frequency {freq!r}; sampled as medium")
+            freq = "medium"
+        if kind in ("coil", "discrete"):
+            words = 1
+        else:
+            n = wire_bytes(fields[1]) if len(fields) > 1 else None
+            if n is None:
+                warnings.append(f"{path}:{lineno}: cannot size type {fields[1] if len(fields) > 1 else ''!r}"
+                                "; assuming one register")
+                n = 2
+            words = (n + 1) // 2
+        elements.append(Element(ident, kind, addr, words, freq))
+    return elements, warnings
+
+
+def max_count(kind):
+    """Most registers (or bits) one read of this kind may ask for."""
+    return MAX_BITS if kind in ("coil", "discrete") else MAX_REGS
+
+
+def plan(elements, max_gap, bridge):
+    """Fewest reads covering elements (one kind): [(start, count, [ids])].
+
+    bridge is the largest gap, in registers, worth reading through rather
+    than paying for another transaction. An element wider than one read
+    allows still gets a read of its own; analyse() reports it as an error.
+    """
+    reads = []
+    limit = max_count(elements[0].kind) if elements else MAX_REGS
+    for e in sorted(elements, key=lambda e: (e.reg, -e.words)):
+        end = e.reg + e.words
+        if reads:
+            start, count, ids = reads[-1]
+            gap = e.reg - (start + count)
+            if end <= start + count:
+                ids.append(e.id)
+                continue
+            if gap <= min(max_gap, bridge) and end - start <= limit:
+                reads[-1] = (start, end - start, ids + [e.id])
+                continue
+        reads.append((e.reg, e.words, [e.id]))
+    return reads
+
+
+class Bus:
+    def __init__(self, baud, bits, turnaround_ms):
+        self.char_s = bits / baud
+        # above 19200 baud the spec fixes the silence at 1.75 ms
+        self.silence_s = SILENCE_CHARS * self.char_s if baud <= 19200 else 0.00175
+        self.turnaround_s = turnaround_ms / 1000
+
+    def response_bytes(self, kind, count):
+        data = (count + 7) // 8 if kind in ("coil", "discrete") else 2 * count
+        return RESPONSE_OVERHEAD + data
+
+    def seconds(self, kind, count):
+        frames = REQUEST_BYTES + self.response_bytes(kind, count)
+        return frames * self.char_s + 2 * self.silence_s + self.turnaround_s
+
+    def bridge(self):
+        """Registers of gap that cost as much wire time as a new transaction."""
+        extra = (REQUEST_BYTES + RESPONSE_OVERHEAD) * self.char_s + 2 * self.silence_s + self.turnaround_s
+        return int(extra / (2 * self.char_s))
+
+
+def analyse(path, args, bus):
+    elements, warnings = parse(path)
+    errors = [f"{path}: {e.id} spans {e.words} {e.kind} registers; "
+              f"one read carries at most {max_count(e.kind)}"
+              for e in elements if e.words > max_count(e.kind)]
+    tiers = {}
+    for tier in TIERS + ("once",):
+        group = [e for e in elements
+                 if (e.freq == tier) or (tier == "once" and e.freq in ONCE)]
+        reads = []
+        for kind in KINDS:
+            of_kind = [e for e in group if e.kind == kind]
+            if of_kind:
+                reads += [(kind,) + r for r in plan(of_kind, args.max_gap, bus.bridge())]
+        rate = args.realtime_hz if tier == "realtime" else RATES.get(tier, 0)
+        per_round = sum(bus.seconds(k, n) for k, _, n, _ in reads)
+        tiers[tier] = (reads, rate, per_round)
+    return elements, tiers, warnings, errors
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("paths", nargs="*",
+                    help="profiles or directories of them (default conf/profiles)")
+    ap.add_argument("--baud", type=int, default=9600)
+    ap.add_argument("--bits", type=int, default=11,
+                    help="bits per character on the wire (11 for 8E1/8N2, 10 for 8N1)")
+    ap.add_argument("--turnaround", type=float, default=5.0, metavar="MS",
+                    help="device response latency per request")
+    ap.add_argument("--realtime-hz", type=float, default=1.0,
+                    help="rate to price realtime elements at")
+    ap.add_argument("--max-gap", type=int, default=MAX_REGS, metavar="REGS",
+                    help="never read through a gap longer than this")
+    ap.add_argument("--limit", type=float, default=70.0, metavar="PCT",
+                    help="flag a profile needing more than this share of the bus")
+    ap.add_argument("--bus", action="store_true",
+                    help="the profiles share one bus: also report their total")
+    ap.add_argument("--detail", action="store_true", help="list every planned read")
+    args = ap.parse_args()
+
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "conf", "profiles")
+    paths = []
+    for p in args.paths or [root]:
+        if os.path.isdir(p):
+            paths += sorted(glob.glob(os.path.join(p, "**", "*.conf"), recursive=True))
+        else:
+            paths.append(p)
+
+    bus = Bus(args.baud, args.bits, args.turnaround)
+    print(f"{args.baud} baud, {args.bits} bits/char, {args.turnaround:g} ms turnaround, "
+          f"realtime at {args.realtime_hz:g} Hz; reads through gaps up to "
+          f"{min(args.max_gap, bus.bridge())} registers, at most {MAX_REGS} per read")
+    print(f"\n{'load':>7} {'reads/s':>8} {'rt max':>7} {'once':>5}  "
+          + " ".join(f"{t:>9}" for t in TIERS) + "  profile")
+
+    total_load, rt_round, flagged, all_warnings, all_errors, rows = 0.0, 0.0, [], [], [], 0
+    for path in paths:
+        elements, tiers, warnings, errors = analyse(path, args, bus)
+        all_warnings += warnings
+        all_errors += errors
+        if not elements:
+            continue
+        rows += 1
+        load = sum(per_round * rate for _, rate, per_round in tiers.values())
+        reads_s = sum(len(reads) * rate for reads, rate, _ in tiers.values())
+        # realtime takes whatever the fixed-rate tiers leave
+        fixed = load - tiers["realtime"][2] * tiers["realtime"][1]
+        rt = tiers["realtime"][2]
+        rt_max = f"{(1 - fixed) / rt:7.1f}" if rt and fixed < 1 else "      -"
+        cells = " ".join(f"{len(tiers[t][0]):3}/{tiers[t][2] * 1000:4.0f}ms" for t in TIERS)
+        mark = "  OVER" if 100 * load > args.limit else ""
+        print(f"{100 * load:6.1f}% {reads_s:8.2f} {rt_max} {len(tiers['once'][0]):5}  {cells}  {path}{mark}")
+        if mark:
+            flagged.append(path)
+        total_load += load
+        rt_round += rt
+        if args.detail:
+            for t in TIERS + ("once",):
+                for kind, start, count, ids in tiers[t][0]:
+                    print(f"{'':10}{t:>8} {kind:>8} {start:5} +{count:<3} "
+                          f"{bus.seconds(kind, count) * 1000:6.1f} ms  {', '.join(ids)}")
+    if not rows:
+        print("no Modbus elements found in " + ", ".join(args.paths or [root]))
+        return 1
+
+    print("\nper tier: reads per round / bus time per round; load is the share of a second")
+    if args.bus and rows > 1:
+        fixed = total_load - rt_round * args.realtime_hz
+        print(f"\nshared bus: {100 * total_load:.1f}% load"
+              + (f", realtime achievable up to {(1 - fixed) / rt_round:.1f} Hz"
+                 if rt_round and fixed < 1 else ""))
+        if 100 * total_load > args.limit:
+            print(f"bus over the {args.limit:g}% limit")
+            flagged.append("(shared bus)")
+    for w in all_warnings:
+        print(f"warning: {w}", file=sys.stderr)
+    for e in all_errors:
+        print(f"error: {e}", file=sys.stderr)
+    if flagged:
+        print(f"\n{len(flagged)} over the {args.limit:g}% limit: {', '.join(flagged)}")
+    return 1 if flagged or all_errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
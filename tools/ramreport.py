@@ -7,15 +7,31 @@ half, the globals the linker places in .data and .bss. On an embedded target
 image in flash that gets copied at startup, so a global that only looks
 zero-initialised is paying twice.
 
-    ramreport.py <binary> [--nm nm] [--top N] [--module]
+    ramreport.py <binary> [--top N] [--module]
+                 [--zero-init [--nearly FRACTION]]
+    ramreport.py diff <old> <new> [--top N] [--module]
+                 [--budget FILE --board NAME]
+
+--zero-init reads each .data/.tdata/.sdata symbol's initialiser out of the
+file and lists those that are all zero (or, with --nearly, mostly zero),
+ranked by the flash image and boot-time copy they waste.
+
+diff matches symbols (or modules) across two builds by name, flags the new and
+grown ones, and ranks them by the change weighted that way: .data counted twice.
+With --budget it checks the new build against a board's limits and exits
+non-zero if any is exceeded.
 """
 
 import argparse
 import collections
+import json
 import re
 import subprocess
 import sys
 
+import elffile
+from allocprof import parse_size
+
 # Section names, not nm's type letters: those cannot tell .data from
 # .data.rel.ro, and conflating them reports flash as RAM. Anything holding a
 # Type.init blob or a vtable lands in the latter and is flash on a target
@@ -24,23 +40,32 @@ RAM_SECTIONS = (".bss", ".data", ".tbss", ".tdata", ".sbss", ".sdata")
 DATA_SECTIONS = (".data", ".tdata", ".sdata")
 
 
-def symbols(binary, objdump):
-    out = subprocess.run([objdump, "-t", binary],
-                         capture_output=True, text=True, check=True).stdout
-    for line in out.splitlines():
-        # addr flags... section size name
-        f = line.split()
-        if len(f) < 5 or not f[0][:1].isdigit() and not f[0][:1] in "abcdef":
-            continue
-        section, size, name = f[-3], f[-2], f[-1]
-        if section not in RAM_SECTIONS:
-            continue
-        try:
-            sz = int(size, 16)
-        except ValueError:
+def symbols(binary):
+    for sym in elffile.load(binary).symbols():
+        if sym.size and sym.section in RAM_SECTIONS:
+            yield sym.size, sym.section, sym.name
+
+
+def initialisers(binary):
+    """Yield (size, section, name, zero_bytes) for every .data-class symbol.
+
+    The bytes are read straight out of the file: the initialiser image is
+    the section's contents, wherever the loader later copies it to.
+    """
+    img = elffile.load(binary)
+    tls = img.tls_base()
+    for sym in img.symbols():
+        sz, sec, addr = sym.size, sym.section, sym.value
+        if not sz or sec not in DATA_SECTIONS:
             continue
-        if sz:
-            yield sz, section, name
+        if sym.type == elffile.STT_TLS:
+            # an offset into the TLS template, which .tdata begins
+            if tls is None:
+                continue
+            addr += tls
+        blob = img.read(addr, sz)
+        if blob is not None:
+            yield sz, sec, sym.name, blob.count(0)
 
 
 def demangle(names, nm_cxxfilt="c++filt"):
@@ -79,16 +104,64 @@ def module_of(pretty):
     return pretty.rsplit(".", 1)[0] if "." in pretty else "(none)"
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("binary")
-    ap.add_argument("--objdump", default="objdump")
-    ap.add_argument("--top", type=int, default=30)
-    ap.add_argument("--module", action="store_true",
-                    help="aggregate by module instead of listing symbols")
-    args = ap.parse_args()
+def load(binary):
+    return [(sz, sec, d_demangle(nm)) for sz, sec, nm in symbols(binary)]
+
 
-    syms = [(sz, typ, d_demangle(nm)) for sz, typ, nm in symbols(args.binary, args.objdump)]
+def cost(size, section):
+    """RAM plus the flash a symbol's initialiser image takes."""
+    return size * 2 if section in DATA_SECTIONS else size
+
+
+# A global that is all zero but lands in .data pays for its flash image and
+# the copy at boot for nothing. The usual near miss is a class __initZ blob:
+# the vptr keeps it out of .bss however zero the fields are (docs/SIZE_REVIEW.md,
+# "Verified mechanics"), so it only shows up with --nearly.
+
+def zero_init(args):
+    found = []
+    for sz, sec, name, zeros in initialisers(args.binary):
+        if zeros / sz >= args.nearly:
+            found.append((sz, zeros, sec, d_demangle(name)))
+    if not found:
+        print(f"no .data symbol is {args.nearly:.0%} zero")
+        return 0
+
+    exact = [f for f in found if f[1] == f[0]]
+    wasted = sum(f[0] for f in exact)
+    print(f".data symbols with all-zero initialisers: {len(exact)}, "
+          f"{wasted} bytes of flash image and boot copy")
+    if args.nearly < 1:
+        near = [f for f in found if f[1] != f[0]]
+        print(f"  plus {len(near)} at least {args.nearly:.0%} zero "
+              f"({sum(f[1] for f in near)} zero bytes between them)")
+    print()
+
+    # ranked by zero bytes: what moving to .bss (or splitting off the
+    # non-zero part) would take out of flash and the boot copy
+    if args.module:
+        agg = collections.defaultdict(lambda: [0, 0, 0])
+        for sz, zeros, _, name in found:
+            slot = agg[module_of(name)]
+            slot[0] += zeros
+            slot[1] += sz
+            slot[2] += 1
+        rows = sorted(agg.items(), key=lambda kv: kv[1][0], reverse=True)
+        print(f"{'zero':>9} {'of .data':>9} {'syms':>5}  module")
+        for mod, (zeros, sz, n) in rows[:args.top]:
+            print(f"{zeros:9} {sz:9} {n:5}  {mod}")
+    else:
+        print(f"{'zero':>9} {'bytes':>9} {'sec':>6}  symbol")
+        for sz, zeros, sec, name in sorted(found, key=lambda f: (-f[1], f[3]))[:args.top]:
+            print(f"{zeros:9} {sz:9} {sec:>6}  {name}")
+    return 0
+
+
+def report(args):
+    if args.zero_init:
+        return zero_init(args)
+
+    syms = load(args.binary)
     if not syms:
         print("no RAM symbols found (stripped binary?)", file=sys.stderr)
         return 1
@@ -118,5 +191,150 @@ def main():
     return 0
 
 
+# -- diff ---------------------------------------------------------------------
+#
+# Symbols are matched by demangled name, so two builds line up even when
+# every address moved. A symbol that moved from .bss to .data did not grow,
+# but it now costs flash too, and the weighted column shows it.
+
+# Budget file: one entry per board, every limit optional.
+#
+#   {
+#     "smartevse-v30": {"static": "96K", "data": "8K", "growth": 512},
+#     "waveshare-esp32-s3-rs485-can": {"static": "160K"}
+#   }
+#
+# static   .data + .bss in symbols, in the new build
+# data     .data alone, which is also the flash initialiser image
+# growth   weighted (.data twice) increase over the old build
+BUDGET_KEYS = ("static", "data", "growth")
+
+
+def budget_for(path, board):
+    with open(path) as f:
+        budgets = json.load(f)
+    if board not in budgets:
+        raise SystemExit(f"{path}: no budget for board '{board}' "
+                         f"(have: {', '.join(sorted(budgets)) or 'none'})")
+    entry = budgets[board]
+    unknown = set(entry) - set(BUDGET_KEYS)
+    if unknown:
+        raise SystemExit(f"{path}: board '{board}' has unknown keys "
+                         f"{sorted(unknown)}; expected {', '.join(BUDGET_KEYS)}")
+    try:
+        # a bare number is bytes; a string is "64K", "320KB", "8M", as in allocprof
+        return {k: v if isinstance(v, int) else parse_size(str(v)) for k, v in entry.items()}
+    except argparse.ArgumentTypeError as e:
+        raise SystemExit(f"{path}: board '{board}': {e}")
+
+
+def tally(syms, key):
+    """key(name) -> [bytes, .data bytes, weighted], summed."""
+    out = collections.defaultdict(lambda: [0, 0, 0])
+    for sz, sec, name in syms:
+        slot = out[key(name)]
+        slot[0] += sz
+        if sec in DATA_SECTIONS:
+            slot[1] += sz
+        slot[2] += cost(sz, sec)
+    return out
+
+
+def diff(argv):
+    ap = argparse.ArgumentParser(prog="ramreport.py diff")
+    ap.add_argument("old")
+    ap.add_argument("new")
+    ap.add_argument("--objdump", help="deprecated, ignored")
+    ap.add_argument("--top", type=int, default=30)
+    ap.add_argument("--module", action="store_true",
+                    help="aggregate by module instead of listing symbols")
+    ap.add_argument("--budget", help="JSON file of per-board limits")
+    ap.add_argument("--board", help="entry in --budget to enforce")
+    args = ap.parse_args(argv)
+    if bool(args.budget) != bool(args.board):
+        ap.error("--budget and --board go together")
+
+    old, new = load(args.old), load(args.new)
+    for path, syms in ((args.old, old), (args.new, new)):
+        if not syms:
+            print(f"{path}: no RAM symbols found (stripped binary?)",
+                  file=sys.stderr)
+            return 1
+
+    key = module_of if args.module else (lambda name: name)
+    a, b = tally(old, key), tally(new, key)
+    whole_a = [sum(v[i] for v in a.values()) for i in range(3)]
+    whole_b = [sum(v[i] for v in b.values()) for i in range(3)]
+
+    print(f"{'':14} {'static':>9} {'.data':>9} {'weighted':>9}")
+    print(f"{'old':14} {whole_a[0]:9} {whole_a[1]:9} {whole_a[2]:9}  {args.old}")
+    print(f"{'new':14} {whole_b[0]:9} {whole_b[1]:9} {whole_b[2]:9}  {args.new}")
+    print(f"{'change':14} {whole_b[0] - whole_a[0]:+9d} "
+          f"{whole_b[1] - whole_a[1]:+9d} {whole_b[2] - whole_a[2]:+9d}")
+    print("\n(weighted counts .data twice: RAM plus its flash initialiser)")
+
+    rows = []
+    for name in a.keys() | b.keys():
+        pa, pb = a.get(name), b.get(name)
+        va, vb = pa or [0, 0, 0], pb or [0, 0, 0]
+        dw = vb[2] - va[2]
+        if not dw and va[0] == vb[0]:
+            continue
+        tag = "new" if pa is None else "gone" if pb is None else \
+              "grown" if dw > 0 else "shrunk"
+        rows.append((dw, vb[0] - va[0], vb[1] - va[1], va[0], vb[0], tag, name))
+
+    what = "module" if args.module else "symbol"
+    grown = sorted((r for r in rows if r[0] > 0), reverse=True)
+    shrunk = sorted(r for r in rows if r[0] <= 0)
+    for title, picked in (("new or grown", grown), ("shrunk or gone", shrunk)):
+        if not picked:
+            continue
+        print(f"\n{title} (top {args.top} of {len(picked)}):")
+        print(f"{'weighted':>9} {'bytes':>7} {'.data':>7} {'old -> new':^18}  "
+              f"{'':6}  {what}")
+        for dw, db, dd, sa, sb, tag, name in picked[:args.top]:
+            print(f"{dw:+9d} {db:+7d} {dd:+7d} {sa:>7} -> {sb:<7}  "
+                  f"{tag:6}  {name}")
+    if not rows:
+        print(f"\nno {what} changed size")
+
+    if not args.budget:
+        return 0
+    limits = budget_for(args.budget, args.board)
+    measured = {"static": whole_b[0], "data": whole_b[1],
+                "growth": whole_b[2] - whole_a[2]}
+    print(f"\nbudget for {args.board}:")
+    over = 0
+    for k in BUDGET_KEYS:
+        if k not in limits:
+            continue
+        ok = measured[k] <= limits[k]
+        over += not ok
+        print(f"  {k:7} {measured[k]:9} / {limits[k]:<9} "
+              f"{'ok' if ok else 'OVER by ' + str(measured[k] - limits[k])}")
+    return 1 if over else 0
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "diff":
+        return diff(sys.argv[2:])
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("binary")
+    # sections and symbols come from elffile now; --objdump is still accepted,
+    # and ignored, so existing scripts keep working
+    ap.add_argument("--objdump", help="deprecated, ignored")
+    ap.add_argument("--top", type=int, default=30)
+    ap.add_argument("--module", action="store_true",
+                    help="aggregate by module instead of listing symbols")
+    ap.add_argument("--zero-init", action="store_true",
+                    help="list .data symbols whose initialiser is zero")
+    ap.add_argument("--nearly", type=float, default=1.0, metavar="FRACTION",
+                    help="with --zero-init, also list symbols at least this "
+                         "fraction zero (e.g. 0.9)")
+    return report(ap.parse_args())
+
+
 if __name__ == "__main__":
     sys.exit(main())
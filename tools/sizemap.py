@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Map where the whole image goes: code, read-only data, IRAM and RAM.
+
+ramreport.py answers "what does this cost in RAM"; this is its companion for
+flash, and the first thing to run before a size fight (docs/SIZE_REVIEW.md).
+Every allocated section is sorted into a region by what it costs on a target
+that executes in place:
+
+    code      executable, mapped from flash (.text, .flash.text)
+    rodata    read-only data in flash (.rodata, .flash.rodata, .data.rel.ro)
+    iram      code copied into internal RAM (.iram0.*, .ramfunc, rtc text):
+              costs its size in flash *and* in RAM
+    data      initialised RAM: RAM plus a flash initialiser image
+    bss       zeroed RAM, no flash
+
+and symbols are charged to their D module, or with --family to the template
+they are an instance of, so fifty Array!T instantiations read as one line.
+
+    sizemap.py <binary> [--family] [--region NAME] [--top N] [--json PATH]
+
+--json writes the region / section / module / symbol hierarchy as nested
+{"name", "children"} nodes with "value" on the leaves, which is what d3's
+treemap and most other treemap viewers take directly.
+"""
+
+import argparse
+import collections
+import json
+import os
+import re
+import sys
+
+import elffile
+from ramreport import d_demangle, module_of
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test"))
+from check_isr_safety import resident
+
+REGIONS = ("code", "rodata", "iram", "data", "bss")
+
+# A template instance's mangled name carries __T<len><name> after the
+# qualified path of the scope it was declared in.
+TEMPLATE = re.compile(r"__T(\d+)")
+
+
+def region(sec):
+    name = sec.name.lower()
+    if sec.type == elffile.SHT_NOBITS:
+        return "bss"
+    if sec.flags & elffile.SHF_EXECINSTR:
+        return "iram" if resident(sec.name) else "code"
+    # RELRO is writable until the loader is done with it, and flash on a
+    # target that executes in place.
+    if sec.flags & elffile.SHF_WRITE and "rel.ro" not in name:
+        return "data"
+    return "rodata"
+
+
+def family(name):
+    """urt.array.Array!(...) for any instance of Array, or None."""
+    m = TEMPLATE.search(name) if name.startswith("_D") else None
+    if not m:
+        return None
+    n = int(m.group(1))
+    start = m.end()
+    return f"{d_demangle(name[:m.start()])}.{name[start:start + n]}!(...)"
+
+
+def inventory(binary):
+    """(region, section, size, mangled name) for every sized symbol, plus
+    one '(unattributed)' entry per section for what no symbol claims."""
+    img = elffile.load(binary)
+    secs = {s.name: s for s in img.sections
+            if s.size and s.flags & elffile.SHF_ALLOC}
+    seen, claimed, out = set(), collections.Counter(), []
+    for sym in img.symbols():
+        sec = secs.get(sym.section)
+        if sec is None or not sym.size:
+            continue
+        # aliases share an address and size; charge them once
+        key = (sym.section, sym.value, sym.size)
+        if key in seen:
+            continue
+        seen.add(key)
+        claimed[sec.name] += sym.size
+        out.append((region(sec), sec.name, sym.size, sym.name))
+    for sec in secs.values():
+        rest = sec.size - claimed[sec.name]
+        if rest > 0:
+            out.append((region(sec), sec.name, rest, "(unattributed)"))
+    return secs, out
+
+
+def owner(name, by_family):
+    if name == "(unattributed)":
+        return name
+    if by_family:
+        f = family(name)
+        if f:
+            return f
+    return module_of(d_demangle(name))
+
+
+def treemap(binary, entries):
+    root = {"name": binary, "children": []}
+
+    def child(node, name):
+        kids = node.setdefault("_index", {})
+        if name not in kids:
+            kids[name] = {"name": name, "children": []}
+            node["children"].append(kids[name])
+        return kids[name]
+
+    for reg, sec, size, name in entries:
+        node = child(child(root, reg), sec)
+        pretty = d_demangle(name)
+        mod = module_of(pretty) if name != "(unattributed)" else "(unattributed)"
+        for part in mod.split("."):
+            node = child(node, part)
+        leaf = pretty.rsplit(".", 1)[-1] if mod != "(none)" else pretty
+        node["children"].append({"name": leaf, "value": size})
+
+    def strip(node):
+        node.pop("_index", None)
+        for c in node.get("children", ()):
+            strip(c)
+    strip(root)
+    return root
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("binary")
+    ap.add_argument("--family", action="store_true",
+                    help="charge template instances to their template")
+    ap.add_argument("--region", choices=REGIONS,
+                    help="rank by this region instead of by flash")
+    ap.add_argument("--top", type=int, default=30)
+    ap.add_argument("--json", metavar="PATH",
+                    help="write a hierarchical treemap of the image")
+    args = ap.parse_args()
+
+    _, entries = inventory(args.binary)
+    if not entries:
+        print("no allocated sections found", file=sys.stderr)
+        return 1
+
+    per_sec = collections.defaultdict(lambda: [None, 0])
+    for reg, sec, size, _ in entries:
+        per_sec[sec][0] = reg
+        per_sec[sec][1] += size
+    totals = collections.Counter()
+    for reg, size in per_sec.values():
+        totals[reg] += size
+    flash = sum(totals[r] for r in ("code", "rodata", "iram", "data"))
+    ram = totals["iram"] + totals["data"] + totals["bss"]
+    print(f"flash {flash} bytes, RAM {ram} bytes  (" +
+          ", ".join(f"{r} {totals[r]}" for r in REGIONS) + ")")
+    print()
+    print(f"{'bytes':>9} {'region':>7}  section")
+    for sec, (reg, size) in sorted(per_sec.items(), key=lambda kv: -kv[1][1]):
+        print(f"{size:9} {reg:>7}  {sec}")
+
+    agg = collections.defaultdict(collections.Counter)
+    for reg, _, size, name in entries:
+        agg[owner(name, args.family)][reg] += size
+
+    def flash_of(row):
+        return row["code"] + row["rodata"] + row["iram"] + row["data"]
+
+    def weight(row):
+        return row[args.region] if args.region else flash_of(row)
+
+    what = "template family / module" if args.family else "module"
+    by = args.region or "flash"
+    rows = sorted(agg.items(), key=lambda kv: weight(kv[1]), reverse=True)
+    print(f"\nby {what}, ranked by {by} (top {args.top} of {len(rows)}):")
+    print("".join(f"{r:>9}" for r in REGIONS) + f" {'flash':>9}  {what}")
+    for name, row in rows[:args.top]:
+        if not weight(row):
+            break
+        cells = "".join(f"{row[r]:9}" for r in REGIONS)
+        print(f"{cells} {flash_of(row):9}  {name}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(treemap(args.binary, entries), f)
+            f.write("\n")
+        print(f"\nwrote {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
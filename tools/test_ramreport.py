@@ -0,0 +1,55 @@
+"""ramreport --zero-init against a small image built with the host gcc.
+
+    python3 -m unittest discover -s tools -p "test_*.py"
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import ramreport
+
+SOURCE = r"""
+int d_zero[32] = { 0 };                 /* .bss, whatever it says */
+int d_nearly[64] = { 1 };               /* .data, 63/64 zero */
+int d_full[16] = { 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16 };
+__thread int t_pad[4] = { -1, -1, -1, -1 }; /* keeps the others off .tdata's start */
+__thread int t_nearly[64] = { 1 };      /* .tdata, 63/64 zero */
+__attribute__((section(".tdata.t_zero"))) __thread int t_zero[8]; /* .tdata, all zero */
+
+int main(void) { return d_nearly[0] + d_full[0] + t_pad[0] + t_nearly[0] + t_zero[0]; }
+"""
+
+
+@unittest.skipUnless(shutil.which("gcc"), "needs gcc")
+class ZeroInitTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp(prefix="ramreport_")
+        src = os.path.join(cls.dir, "zero.c")
+        with open(src, "w") as f:
+            f.write(SOURCE)
+        cls.binary = os.path.join(cls.dir, "zero")
+        subprocess.run(["gcc", "-O0", "-o", cls.binary, src], check=True)
+        cls.found = {name: (sz, sec, zeros)
+                     for sz, sec, name, zeros in ramreport.initialisers(cls.binary)}
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir, ignore_errors=True)
+
+    def test_data(self):
+        self.assertEqual(self.found["d_nearly"], (256, ".data", 255))
+        self.assertEqual(self.found["d_full"], (64, ".data", 48))
+
+    def test_tdata(self):
+        # TLS symbol values are offsets into the TLS template, not addresses
+        self.assertEqual(self.found["t_pad"], (16, ".tdata", 0))
+        self.assertEqual(self.found["t_nearly"], (256, ".tdata", 255))
+        self.assertEqual(self.found["t_zero"][2], 32)
+
+
+if __name__ == "__main__":
+    unittest.main()